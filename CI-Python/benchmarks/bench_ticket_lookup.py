@@ -0,0 +1,102 @@
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+"""
+Benchmark for ticket lookups by name and by seller email.
+
+Fills a throw-away sqlite database with N listings and times
+qa327.backend.find_ticket / get_tickets_by_seller with and without
+the indexes declared on the Ticket model, and get_ticket of names that
+were never listed with and without the ticket name filter (in the
+indexed and no index columns).
+
+Usage (from the CI-Python folder):
+
+    python benchmarks/bench_ticket_lookup.py [N ...]
+
+N defaults to 10000 100000 1000000.
+"""
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+INSERT_CHUNK = 50000
+SELLERS = 1000
+EXPIRY = datetime.date(2030, 12, 31)
+
+# point the app at a temporary database before qa327 is imported
+tmp_folder = tempfile.mkdtemp()
+os.environ['DB_NAME'] = os.path.join(tmp_folder, 'bench.sqlite').lstrip('/')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qa327 import app  # noqa: E402
+from qa327.models import db, Ticket, create_missing_indexes, init_db  # noqa: E402
+import qa327.backend as bn  # noqa: E402
+
+
+def fill_tickets(size):
+    """Replace the content of the ticket table with `size` listings"""
+    db.session.query(Ticket).delete()
+    for start in range(0, size, INSERT_CHUNK):
+        rows = [
+            dict(name='ticket%d' % i, email='seller%d@test.com' % (i % SELLERS),
+                 quantity=10, price=50, date=EXPIRY)
+            for i in range(start, min(start + INSERT_CHUNK, size))
+        ]
+        db.session.execute(Ticket.__table__.insert(), rows)
+    db.session.commit()
+
+
+def time_lookups(lookup, keys):
+    """Average latency of lookup(key) over keys, in microseconds"""
+    start = time.perf_counter()
+    for key in keys:
+        lookup(key)
+        db.session.rollback()  # don't let the session cache answer for us
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def drop_ticket_indexes():
+    for index in Ticket.__table__.indexes:
+        index.drop(bind=db.engine)
+
+
+def run(sizes):
+    print('%10s  %-22s %14s %14s %9s' % ('listings', 'query', 'indexed (us)', 'no index (us)', 'speedup'))
+    for size in sizes:
+        fill_tickets(size)
+        # full scans get slow at 1M rows, so sample fewer keys there
+        samples = max(20, 2000000 // size)
+        names = ['ticket%d' % random.randrange(size) for _ in range(samples)]
+        sellers = ['seller%d@test.com' % random.randrange(SELLERS) for _ in range(samples)]
+        queries = [('find_ticket(name)', bn.find_ticket, names),
+                   ('get_tickets_by_seller', bn.get_tickets_by_seller, sellers)]
+
+        indexed = [time_lookups(lookup, keys) for _, lookup, keys in queries]
+        drop_ticket_indexes()
+        scanned = [time_lookups(lookup, keys) for _, lookup, keys in queries]
+        create_missing_indexes()
+
+        for (label, _, _), fast, slow in zip(queries, indexed, scanned):
+            print('%10d  %-22s %14.1f %14.1f %8.1fx' % (size, label, fast, slow, slow / fast))
+
+        # names that were never listed: answered by the filter, or by an index lookup
+        missing = ['missing%d' % i for i in range(samples)]
+        bn.get_state()['inventory_version'].bump()
+        bn.get_ticket(missing[0])   # build the filter before timing
+        filtered = time_lookups(bn.get_ticket, missing)
+        queried = time_lookups(bn.find_ticket, missing)
+        print('%10d  %-22s %14.1f %14.1f %8.1fx' % (size, 'get_ticket(missing)', filtered, queried,
+                                                     queried / filtered))
+
+
+if __name__ == '__main__':
+    try:
+        with app.app_context():
+            init_db()
+            run([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
@@ -0,0 +1,240 @@
+import os
+import random
+import string
+import sys
+import time
+
+"""
+Benchmark for form validation.
+
+Times the compiled rules of qa327.validation, on single forms and in
+batch mode, against the hand written check functions the routes used
+before (copied below as reference). Each time is the best of a few runs.
+
+The legacy checks and validate() stop at the first error. Batch mode
+reports every failing field, so it runs every rule of a record: compare
+it with validate(first_error=False), in the "all errors" column.
+
+Usage (from the CI-Python folder):
+
+    python benchmarks/bench_validation.py [N]
+
+N is the number of records per form, 10000 by default.
+"""
+
+DEFAULT_SIZE = 10000
+RUNS = 5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import functools  # noqa: E402
+
+from qa327 import validation  # noqa: E402
+from qa327.backend import parse_ticket_date  # noqa: E402
+
+
+# -- the previous checks, as they were in qa327/frontend.py --
+
+def check_special_pass(password):
+    specialChar = "!@#$%^&*()_-+=/"
+    special = False
+    upper = False
+    lower = False
+    for i in range(len(password)):
+        if password[i].isupper():
+            upper = True
+        if password[i].islower():
+            lower = True
+        if any(password[i] in word for word in specialChar):
+            special = True
+    if not upper or not lower or not special or (len(password) < 6):
+        return False
+    else:
+        return True
+
+
+def check_email_format(email):
+    regex = r'^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$'
+    if not re_search(regex, email) or len(email) < 3:
+        return False
+    else:
+        return True
+
+
+def check_spaces(word):
+    if word[0] == " " or word[-1] == " ":
+        return False
+    else:
+        return True
+
+
+def check_alnum(word):
+    for char in range(len(word)):
+        if not (word[char].isalnum() or word[char].isspace()):
+            return False
+    return True
+
+
+def check_quantity(low, high, item):
+    if item <= low or item >= high:
+        return False
+    else:
+        return True
+
+
+def legacy_register(form):
+    if form['password'] != form['password2']:
+        return "The passwords do not match"
+    if not check_email_format(form['email']):
+        return "Email format is incorrect"
+    if not check_special_pass(form['password']):
+        return "Password format is incorrect"
+    if len(form['name']) <= 2 or len(form['name']) >= 20:
+        return "Name length formatting error"
+    if not check_alnum(form['name']):
+        return "Name contains special characters"
+    if not check_spaces(form['name']):
+        return "Invalid spaces found in word"
+    return None
+
+
+def legacy_sell(form):
+    quantity = int(float(form['quantity']))
+    price = float(form['price'])
+    if not check_spaces(form['name']):
+        return "Invalid spaces found in word"
+    if len(form['name']) > 60:
+        return "Ticket name is too long"
+    if not check_quantity(0, 101, quantity):
+        return "Invalid quantity of tickets"
+    if price > 100 or price < 10:
+        return "Ticket price outside of valid range"
+    date = parse_ticket_date(form['exp_date'])
+    if date is None or date.year < 2020:
+        return "Invalid ticket date"
+    return None
+
+
+def legacy_buy(form):
+    if not check_spaces(form['name']):
+        return "Invalid spaces found in word"
+    if not check_alnum(form['name']):
+        return "Name contains invalid characters"
+    if len(form['name']) > 60:
+        return "Ticket name is too long"
+    if not check_quantity(1, 101, int(form['quantity'])):
+        return "Invalid quantity of tickets"
+    return None
+
+
+def legacy_update(form):
+    quantity = int(form['quantity'])
+    price = int(form['price'])
+    if not check_spaces(form['name']):
+        return "Invalid spaces found in ticket name"
+    if not check_alnum(form['name']):
+        return "Name contains special characters"
+    if len(form['name']) > 60:
+        return "Ticket name is too long"
+    if not check_quantity(1, 101, quantity):
+        return "Invalid quantity of tickets"
+    if not check_quantity(9, 101, price):
+        return "Invalid ticket price"
+    date = parse_ticket_date(form['exp_date'])
+    if date is None or date.year < 2020:
+        return "Invalid ticket date"
+    return None
+
+
+def re_search(pattern, text):
+    # re.search, as the old code called it: with the pattern compiled
+    # (or found in re's cache) on every call
+    import re
+    return re.search(pattern, text)
+
+
+LEGACY = {
+    'register': legacy_register,
+    'sell': legacy_sell,
+    'buy': legacy_buy,
+    'update': legacy_update,
+}
+
+
+def random_name(rng):
+    length = rng.choice([5, 20, 40, 70])
+    name = ''.join(rng.choice(string.ascii_letters + ' ') for _ in range(length))
+    if rng.random() < 0.1:
+        name += '!'
+    return name
+
+
+def make_records(form, size, rng):
+    """Mostly valid records, with a share of every kind of mistake"""
+    records = []
+    for i in range(size):
+        if form == 'register':
+            password = rng.choice(['Password!', 'password', 'Pass!1'])
+            records.append(dict(email=rng.choice(['user%d@test.com' % i, 'user%d.test' % i]),
+                                name=random_name(rng)[:rng.choice([2, 10, 25])],
+                                password=password,
+                                password2=password if rng.random() < 0.95 else 'x'))
+        else:
+            records.append(dict(name=random_name(rng),
+                                quantity=str(rng.randint(-5, 120)),
+                                price=str(rng.randint(0, 120)),
+                                exp_date=rng.choice(['20301231', '20191231', '20300231'])))
+    return records
+
+
+def time_calls(function, records):
+    """Average time of function(record) over records, in microseconds"""
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for record in records:
+            function(record)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(records) * 1e6
+
+
+def time_batch(form, records):
+    """Average time per record of validate_batch(form, records), in microseconds"""
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        validation.validate_batch(form, records)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(records) * 1e6
+
+
+def main(argv):
+    size = int(argv[0]) if argv else DEFAULT_SIZE
+    rng = random.Random(327)
+
+    print('%-10s %14s %14s %14s %14s' % ('form', 'legacy us', 'compiled us', 'all errors us', 'batch us'))
+    for form, legacy in LEGACY.items():
+        records = make_records(form, size, rng)
+
+        # both must report the same first error for every record, except
+        # for buying or updating a single ticket, which the old checks
+        # wrongly rejected
+        for record in records:
+            if form in ('buy', 'update') and record['quantity'] == '1':
+                continue
+            values, errors = validation.validate(form, record)
+            message = errors[0]['message'] if errors else None
+            if message != legacy(record):
+                raise AssertionError('%s: %r gives %r, expected %r' % (form, record, message, legacy(record)))
+
+        legacy_us = time_calls(legacy, records)
+        compiled_us = time_calls(functools.partial(validation.validate, form), records)
+        all_errors_us = time_calls(functools.partial(validation.validate, form, first_error=False), records)
+        batch_us = time_batch(form, records)
+        print('%-10s %14.2f %14.2f %14.2f %14.2f' % (form, legacy_us, compiled_us, all_errors_us, batch_us))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,8 +1,15 @@
-from flask import Flask
 import os
+import threading
 
 """
-This file defines global variables and config values
+This file defines global variables and config values, and the
+application factory.
+
+Importing the package is cheap: Flask, SQLAlchemy and the rest of the
+application are only imported by create_app(), and the database schema
+is only created or migrated by qa327.models.init_db(). `qa327.app` is
+the application configured from the environment, created at its first
+use.
 """
 
 
@@ -14,21 +21,158 @@ templates = os.path.join(
     package_dir, "templates"
 )
 
-app = Flask('this is a simple web application', template_folder=templates)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = '69cae04b04756f65eabcd2c5a11c8c24'
-# if the user supplies a database file name, we use
-# that instead, and it should an absolute path
-# for windows user, C:\ is the root directory, so it
-# should not be included. e.g. Users/xxx/Document/db.sqlite
-db_name = os.getenv('DB_NAME')
-db_string = os.getenv('db_string')
-if db_name:
-    database_url = "sqlite:////" + db_name
-elif db_string:
-    database_url = db_string
-else:
-    # default:
-    # db.sqlite at the working directory
-    database_url = 'sqlite:///db.sqlite'
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+
+def load_config(environ=os.environ):
+    """
+    Read the configuration from environment variables
+    :param environ: the environment to read
+    :return: dict of config values
+    """
+    config = {}
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    config['SECRET_KEY'] = '69cae04b04756f65eabcd2c5a11c8c24'
+    # if the user supplies a database file name, we use
+    # that instead, and it should an absolute path
+    # for windows user, C:\ is the root directory, so it
+    # should not be included. e.g. Users/xxx/Document/db.sqlite
+    db_name = environ.get('DB_NAME')
+    db_string = environ.get('db_string')
+    if db_name:
+        database_url = "sqlite:////" + db_name
+    elif db_string:
+        database_url = db_string
+    else:
+        # default:
+        # db.sqlite at the working directory
+        database_url = 'sqlite:///db.sqlite'
+    config['SQLALCHEMY_DATABASE_URI'] = database_url
+    # read replicas: comma separated database URLs, queries of read-only backend
+    # functions go to them, and for REPLICA_LAG seconds after a client writes,
+    # that client reads from the primary again
+    replica_urls = environ.get('DB_REPLICAS')
+    config['SQLALCHEMY_REPLICA_URIS'] = replica_urls.split(',') if replica_urls else []
+    config['SQLALCHEMY_REPLICA_LAG'] = float(environ.get('REPLICA_LAG', 5))
+    # users are cached by email for USER_CACHE_TTL seconds, at most USER_CACHE_SIZE of them
+    config['USER_CACHE_SIZE'] = int(environ.get('USER_CACHE_SIZE', 10000))
+    config['USER_CACHE_TTL'] = float(environ.get('USER_CACHE_TTL', 60))
+    # rendered pages of the ticket list, at most FRAGMENT_CACHE_SIZE of them,
+    # each kept FRAGMENT_CACHE_TTL seconds
+    config['FRAGMENT_CACHE_SIZE'] = int(environ.get('FRAGMENT_CACHE_SIZE', 1000))
+    config['FRAGMENT_CACHE_TTL'] = float(environ.get('FRAGMENT_CACHE_TTL', 600))
+    # with SHARED_CACHE_PATH set, the caches and the inventory version live in
+    # that memory mapped file, shared by all the workers of the host, instead of
+    # in each worker. SHARED_CACHE_SLOTS slots of SHARED_CACHE_SLOT_SIZE bytes.
+    # `serve` with more than one worker uses a temporary file when it is not set
+    config['SHARED_CACHE_PATH'] = environ.get('SHARED_CACHE_PATH')
+    config['SHARED_CACHE_SLOTS'] = int(environ.get('SHARED_CACHE_SLOTS', 4096))
+    config['SHARED_CACHE_SLOT_SIZE'] = int(environ.get('SHARED_CACHE_SLOT_SIZE', 16384))
+    # lookups of ticket names that were never listed are answered from a Bloom
+    # filter sized for TICKET_FILTER_CAPACITY names, which sees the tickets
+    # listed by other workers within TICKET_FILTER_REFRESH seconds
+    config['TICKET_FILTER_ENABLED'] = environ.get('TICKET_FILTER_ENABLED', '1') == '1'
+    config['TICKET_FILTER_CAPACITY'] = int(environ.get('TICKET_FILTER_CAPACITY', 100000))
+    config['TICKET_FILTER_REFRESH'] = float(environ.get('TICKET_FILTER_REFRESH', 1))
+    # passwords are hashed with pbkdf2 in PASSWORD_HASH_WORKERS processes (0 to
+    # hash on the request thread), with the iterations calibrated so a hash
+    # takes about PASSWORD_HASH_TARGET_MS. Past PASSWORD_HASH_QUEUE waiting
+    # passwords, logins and registrations are turned away. Every worker of
+    # `serve` has its own PASSWORD_HASH_WORKERS processes, so there it defaults
+    # to the number of CPUs divided by the number of workers
+    config['PASSWORD_HASH_WORKERS'] = int(environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    config['PASSWORD_HASH_QUEUE'] = int(environ.get('PASSWORD_HASH_QUEUE', 64))
+    config['PASSWORD_HASH_TARGET_MS'] = float(environ.get('PASSWORD_HASH_TARGET_MS', 100))
+    config['PASSWORD_HASH_MIN_ITERATIONS'] = int(environ.get('PASSWORD_HASH_MIN_ITERATIONS', 50000))
+    # the iterations to use instead of calibrating them, set by `serve` for the
+    # processes it starts, which then hash like the ones it forked
+    config['PASSWORD_HASH_ITERATIONS'] = int(environ.get('PASSWORD_HASH_ITERATIONS') or 0) or None
+    # attempts at the login and register forms allowed per minute from one
+    # client IP and for one email (0 for no limit), the client IP is taken from
+    # X-Forwarded-For when RATE_LIMIT_TRUST_PROXY is 1
+    config['RATE_LIMIT_IP_PER_MINUTE'] = float(environ.get('RATE_LIMIT_IP_PER_MINUTE', 120))
+    config['RATE_LIMIT_EMAIL_PER_MINUTE'] = float(environ.get('RATE_LIMIT_EMAIL_PER_MINUTE', 30))
+    config['RATE_LIMIT_TRUST_PROXY'] = environ.get('RATE_LIMIT_TRUST_PROXY', '0') == '1'
+    # under ASGI (qa327.asgi), the profile and search pages run at most
+    # ASGI_DB_POOL_SIZE queries at once, and the other requests are served by
+    # ASGI_WSGI_THREADS threads
+    config['ASGI_DB_POOL_SIZE'] = int(environ.get('ASGI_DB_POOL_SIZE', 20))
+    config['ASGI_WSGI_THREADS'] = int(environ.get('ASGI_WSGI_THREADS', 8))
+    # the built, fingerprinted assets (python -m qa327 assets)
+    config['ASSETS_BUILD_DIR'] = environ.get('ASSETS_BUILD_DIR', os.path.join(package_dir, 'static', 'build'))
+    # responses of at least COMPRESSION_MIN_SIZE bytes are compressed with
+    # brotli (when installed) or gzip, at COMPRESSION_BROTLI_QUALITY (0-11) and
+    # COMPRESSION_GZIP_LEVEL (1-9)
+    config['COMPRESSION_ENABLED'] = environ.get('COMPRESSION_ENABLED', '1') == '1'
+    config['COMPRESSION_MIN_SIZE'] = int(environ.get('COMPRESSION_MIN_SIZE', 1024))
+    config['COMPRESSION_GZIP_LEVEL'] = int(environ.get('COMPRESSION_GZIP_LEVEL', 6))
+    config['COMPRESSION_BROTLI_QUALITY'] = int(environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+    # the listing of all tickets (/?view=all) is streamed: the rows are read
+    # LISTING_STREAM_BATCH at a time and sent in chunks of STREAM_CHUNK_SIZE bytes
+    config['LISTING_STREAM_BATCH'] = int(environ.get('LISTING_STREAM_BATCH', 500))
+    config['STREAM_CHUNK_SIZE'] = int(environ.get('STREAM_CHUNK_SIZE', 8192))
+    # the JSON API (/api/v1) takes bearer tokens valid for API_TOKEN_TTL
+    # seconds, and lists at most API_MAX_PAGE_SIZE tickets per request
+    config['API_TOKEN_TTL'] = int(environ.get('API_TOKEN_TTL', 24 * 3600))
+    config['API_MAX_PAGE_SIZE'] = int(environ.get('API_MAX_PAGE_SIZE', 100))
+    # connection pool of client/server databases (MySQL), see qa327/pool.py
+    config['DB_POOL_SIZE'] = int(environ.get('DB_POOL_SIZE', 5))
+    config['DB_POOL_MAX_OVERFLOW'] = int(environ.get('DB_POOL_MAX_OVERFLOW', 10))
+    config['DB_POOL_TIMEOUT'] = float(environ.get('DB_POOL_TIMEOUT', 30))
+    config['DB_POOL_RECYCLE'] = int(environ.get('DB_POOL_RECYCLE', 3600))
+    config['DB_POOL_PRE_PING'] = environ.get('DB_POOL_PRE_PING', '1') not in ('0', 'false', 'False')
+    # serve live statistics (e.g. the connection pool) under /stats. They
+    # show the internals of the service, so they are off unless asked for
+    config['STATS_ENABLED'] = environ.get('STATS_ENABLED', '0') == '1'
+    return config
+
+
+def create_app(config=None):
+    """
+    Create and configure an application. The extensions are bound to it
+    without connecting to anything: the database and the password hashing
+    processes are set up at their first use, the ticket name filter before
+    the first request. The pbkdf2 iterations are calibrated here, unless
+    PASSWORD_HASH_ITERATIONS is given
+    :param config: dict of config values, over the ones read from the environment
+    :return: the Flask application
+    """
+    from flask import Flask
+    from qa327 import pool
+
+    # the assets are served by the frontend, see qa327/assets.py
+    app = Flask('this is a simple web application', template_folder=templates, static_folder=None)
+    app.config.update(load_config())
+    app.config.update(config or {})
+    # connection pool settings (DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    # DB_POOL_RECYCLE, DB_POOL_PRE_PING), sqlite connections are not pooled
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', pool.engine_options(app.config))
+
+    from qa327 import models, backend, frontend, api
+    models.db.init_app(app)
+    backend.init_app(app)
+    frontend.init_app(app)
+    app.register_blueprint(frontend.bp)
+    app.register_blueprint(api.bp)
+    if app.config['COMPRESSION_ENABLED']:
+        from qa327.compression import CompressionMiddleware
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app, app.config['COMPRESSION_MIN_SIZE'],
+                                             app.config['COMPRESSION_GZIP_LEVEL'],
+                                             app.config['COMPRESSION_BROTLI_QUALITY'])
+        app.extensions['compression'] = app.wsgi_app
+    return app
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # qa327.app is created at its first use, once per process
+    global _app
+    if name != 'app':
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
@@ -1,10 +1,206 @@
-from qa327 import app, frontend
+from qa327 import server
+import qa327
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
 
 """
-This file runs the server at a given port
+This file runs the server at a given port, or one of the
+maintenance commands:
+
+    python -m qa327              run the development server
+    python -m qa327 serve        run the production server
+    python -m qa327 reconcile    check the balances against the ledger
+    python -m qa327 archive      move expired tickets to the archive table
+    python -m qa327 initdb       create and migrate the database tables
+    python -m qa327 startup      report the startup time of a new process
+    python -m qa327 assets       build the fingerprinted static assets
 """
 
 FLASK_PORT = 8081
 
-if __name__ == "__main__":
+# the shared cache file `serve` made itself, removed by the master when it
+# stops, also after it executed itself again on a reload
+TEMP_CACHE_ENV = 'QA327_TEMP_SHARED_CACHE'
+
+
+def init_db(app):
+    """
+    Create and migrate the database tables of an app
+    """
+    from qa327.models import init_db
+    with app.app_context():
+        init_db()
+
+
+def build_assets(app, force=False):
+    """
+    Build the static assets of an app, when their sources changed since
+    the last build or force is set
+    """
+    from qa327 import assets
+    if force or assets.is_stale(assets.STATIC_DIR, app.config['ASSETS_BUILD_DIR']):
+        manifest = assets.build(assets.STATIC_DIR, app.config['ASSETS_BUILD_DIR'])
+        print(' * Built %d asset(s)' % len(manifest['assets']))
+
+
+def reconcile(args):
+    """
+    Check every user's balance against the sum of their ledger entries
+    :return: exit status, 1 if any balance does not match
+    """
+    import qa327.backend as bn
+    app = qa327.app
+    init_db(app)
+    with app.app_context():
+        mismatches = bn.reconcile_balances()
+    for user_id, balance_cents, ledger_cents in mismatches:
+        print('user %d: balance %d cents, ledger %d cents' % (user_id, balance_cents, ledger_cents))
+    print('%d mismatched balance(s)' % len(mismatches))
+    return 1 if mismatches else 0
+
+
+def archive(args):
+    """
+    Move the expired tickets to the archive table
+    :return: exit status
+    """
+    import qa327.backend as bn
+    app = qa327.app
+    init_db(app)
+    with app.app_context():
+        archived = bn.archive_expired_tickets(args.batch_size, args.pause)
+    print('%d ticket(s) archived' % archived)
+    return 0
+
+
+def hash_workers_per_worker(workers):
+    """
+    :param workers: the number of worker processes of the server
+    :return: the default PASSWORD_HASH_WORKERS of each worker, so the host
+        runs about one hashing process per CPU in all
+    """
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def serve(args):
+    """
+    Run the production server: pre-forked workers serving with threads
+    :return: exit status
+    """
+    import qa327.backend as bn
+    # every worker starts its own pool of hashing processes: the CPUs are
+    # split between them, or a login burst runs cpu * cpu hashes at once,
+    # each far slower than the calibrated target
+    os.environ.setdefault('PASSWORD_HASH_WORKERS', str(hash_workers_per_worker(args.workers)))
+    if args.workers > 1 and not os.environ.get('SHARED_CACHE_PATH'):
+        # with caches in each process, a purchase in one worker would leave
+        # the others showing the old balances and ticket list until they expire
+        fd, path = tempfile.mkstemp(prefix='qa327-', suffix='.cache')
+        os.close(fd)
+        os.environ['SHARED_CACHE_PATH'] = os.environ[TEMP_CACHE_ENV] = path
+    app = qa327.app
+    # once, in the master, rather than by every worker
+    init_db(app)
+    build_assets(app)
+    # the workers inherit the ticket name filter, and only load the tickets
+    # listed since
+    with app.app_context():
+        bn.build_ticket_names()
+    # the forked workers inherit the calibrated password hashing iterations,
+    # and the master started again on a reload gets them from the environment
+    os.environ['PASSWORD_HASH_ITERATIONS'] = str(bn.get_state(app)['password_hasher'].iterations)
+
+    def close_connections():
+        with app.app_context():
+            bn.dispose_connections()
+
+    try:
+        return server.serve(app, args.host, args.port, args.workers, args.threads, args.backlog,
+                            args.keepalive, args.max_requests, args.max_requests_jitter,
+                            before_fork=close_connections,
+                            argv=[sys.executable, '-m', 'qa327'] + sys.argv[1:])
+    finally:
+        temporary = os.environ.get(TEMP_CACHE_ENV)
+        if temporary and os.path.exists(temporary):
+            os.unlink(temporary)
+
+
+def assets(args):
+    """
+    Build the static assets
+    :return: exit status
+    """
+    build_assets(qa327.app, force=True)
+    return 0
+
+
+def startup(args):
+    """
+    Report the startup time of a new process, the process this command
+    runs in already imported too much to measure it
+    :return: exit status, 1 if the cold start took longer than the budget
+    """
+    command = [sys.executable, '-m', 'qa327.startup', '--path', args.path,
+               '--budget-ms', str(args.budget_ms)]
+    return subprocess.call(command)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m qa327')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('reconcile', help='check the balances against the ledger')
+    archive_parser = commands.add_parser('archive', help='move expired tickets to the archive table')
+    archive_parser.add_argument('--batch-size', type=int, default=500,
+                                help='tickets moved per transaction (default: 500)')
+    archive_parser.add_argument('--pause', type=float, default=0,
+                                help='seconds to wait between batches (default: 0)')
+    serve_parser = commands.add_parser('serve', help='run the production server')
+    serve_parser.add_argument('--host', default='0.0.0.0', help='address to listen on (default: 0.0.0.0)')
+    serve_parser.add_argument('--port', type=int, default=FLASK_PORT,
+                              help='port to listen on (default: %d)' % FLASK_PORT)
+    serve_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                              help='worker processes (default: one per CPU)')
+    serve_parser.add_argument('--threads', type=int, default=8,
+                              help='threads of each worker (default: 8)')
+    serve_parser.add_argument('--backlog', type=int, default=2048,
+                              help='connections waiting to be accepted (default: 2048)')
+    serve_parser.add_argument('--keepalive', type=float, default=2,
+                              help='seconds an idle connection is kept open (default: 2)')
+    serve_parser.add_argument('--max-requests', type=int, default=0,
+                              help='requests a worker serves before it is replaced (default: 0, no limit)')
+    serve_parser.add_argument('--max-requests-jitter', type=int, default=0,
+                              help='largest random number of requests added to --max-requests (default: 0)')
+    commands.add_parser('initdb', help='create and migrate the database tables')
+    startup_parser = commands.add_parser('startup', help='report the startup time of a new process')
+    startup_parser.add_argument('--path', default='/login',
+                                help='page of the first requests (default: /login)')
+    startup_parser.add_argument('--budget-ms', type=float, default=0,
+                                help='fail if the startup takes longer (default: 0, no budget)')
+    commands.add_parser('assets', help='build the fingerprinted static assets')
+    args = parser.parse_args(argv)
+
+    if args.command == 'reconcile':
+        return reconcile(args)
+    if args.command == 'archive':
+        return archive(args)
+    if args.command == 'serve':
+        return serve(args)
+    if args.command == 'initdb':
+        init_db(qa327.app)
+        return 0
+    if args.command == 'startup':
+        return startup(args)
+    if args.command == 'assets':
+        return assets(args)
+    app = qa327.app
+    init_db(app)
+    build_assets(app)
     app.run(debug=True, port=FLASK_PORT, host='0.0.0.0')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+from flask import Blueprint, current_app, request, jsonify
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from werkzeug.http import is_resource_modified
+from qa327 import validation
+import qa327.backend as bn
+import qa327.frontend as fe
+import datetime
+import decimal
+import functools
+import hashlib
+import math
+
+"""
+This file defines the JSON API of the service, for machine clients.
+It calls the same backend functions as the pages, without rendering
+any HTML. Every route but /api/v1/tokens takes a bearer token:
+
+    POST  /api/v1/tokens                        {"email", "password"} -> {"token", "expires_in"}
+    GET   /api/v1/tickets?sort=&after=&limit=   one page of tickets, and the cursor of the next
+    POST  /api/v1/tickets                       {"name", "quantity", "price", "date"}
+    GET   /api/v1/tickets/<name>
+    PATCH /api/v1/tickets/<name>                any of {"quantity", "price", "date"}
+    POST  /api/v1/tickets/<name>/purchases      {"quantity"}
+    GET   /api/v1/users/me
+
+The GET routes take ?fields=name,price to return only the fields asked
+for. Dates are given and returned as YYYYMMDD, money as decimal strings.
+Errors are returned as {"error": message}, with the field at fault for
+the ones of the submitted values.
+"""
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class ApiError(Exception):
+    """
+    Ends a request with a JSON error response
+    """
+
+    def __init__(self, status, message, field=None, headers=None):
+        super(ApiError, self).__init__(message)
+        self.status = status
+        self.message = message
+        self.field = field
+        self.headers = headers or {}
+
+
+@bp.errorhandler(ApiError)
+def api_error(error):
+    body = {'error': error.message}
+    if error.field is not None:
+        body['field'] = error.field
+    response = jsonify(body)
+    response.status_code = error.status
+    response.headers.extend(error.headers)
+    return response
+
+
+def format_date(date):
+    return date.strftime('%Y%m%d') if date is not None else None
+
+
+# the fields of each kind of object, and how they are read. Holdings are
+# only queried when they are asked for
+TICKET_FIELDS = {
+    'id': lambda ticket: ticket.id,
+    'name': lambda ticket: ticket.name,
+    'price': lambda ticket: ticket.price,
+    'quantity': lambda ticket: ticket.quantity,
+    'seller': lambda ticket: ticket.email,
+    'date': lambda ticket: format_date(ticket.date),
+}
+
+HOLDING_FIELDS = {
+    'name': lambda holding: holding.name,
+    'quantity': lambda holding: holding.quantity,
+    'price': lambda holding: (str(decimal.Decimal(holding.price_cents) / 100)
+                              if holding.price_cents is not None else None),
+    'date': lambda holding: format_date(holding.date),
+}
+
+USER_FIELDS = {
+    'email': lambda user: user.email,
+    'name': lambda user: user.name,
+    'balance': lambda user: str(user.balance),
+    'holdings': lambda user: [serialize(holding, HOLDING_FIELDS) for holding in bn.get_user_holdings(user)],
+}
+
+
+def requested_fields(available):
+    """
+    Read the sparse fieldset of the request
+    :param available: the fields of the objects returned
+    :return: the names of the fields to return, all of them if ?fields= is not given
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(400, 'Unknown field: %s' % unknown[0], field='fields')
+    return names
+
+
+def serialize(item, available, fields=None):
+    """
+    :param item: the object to return
+    :param available: the fields it has, e.g. TICKET_FIELDS
+    :param fields: the names of the fields to return, all of them if None
+    :return: dict of the fields
+    """
+    return dict((name, available[name](item)) for name in (fields or available))
+
+
+def submitted_values(renamed=None):
+    """
+    Read the JSON object of the request, in the form the validation
+    rules of the pages expect
+    :param renamed: dict of the API names of fields to their names in the form
+    :return: dict of the submitted values, as strings
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Expected a JSON object')
+    values = {}
+    for name, value in body.items():
+        # the forms are validated as text, like the pages submit them
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ApiError(400, 'Invalid value', field=name)
+        values[(renamed or {}).get(name, name)] = str(value)
+    return values
+
+
+def validate(form, values, renamed=None):
+    """
+    :return: the converted values
+    :raise ApiError: with the first error of the form
+    """
+    converted, errors = validation.validate(form, values)
+    if errors:
+        names = dict((form_name, name) for name, form_name in (renamed or {}).items())
+        raise ApiError(400, errors[0]['message'], field=names.get(errors[0]['field'], errors[0]['field']))
+    return converted
+
+
+def token_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='qa327-api-token')
+
+
+def authenticate(inner_function):
+    """
+    Wrap an API route that needs a user: the route is called with the
+    user of the bearer token of the request
+    """
+
+    @functools.wraps(inner_function)
+    def wrapped_inner(*args, **kwargs):
+        unauthorized = {'WWW-Authenticate': 'Bearer'}
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            raise ApiError(401, 'Missing token', headers=unauthorized)
+        try:
+            email = token_serializer().loads(token, max_age=current_app.config['API_TOKEN_TTL'])
+        except SignatureExpired:
+            raise ApiError(401, 'Token expired', headers=unauthorized)
+        except BadSignature:
+            raise ApiError(401, 'Invalid token', headers=unauthorized)
+        user = bn.get_cached_user(email)
+        if user is None:
+            raise ApiError(401, 'Invalid token', headers=unauthorized)
+        return inner_function(user, *args, **kwargs)
+
+    return wrapped_inner
+
+
+def find_ticket(name):
+    ticket = bn.get_ticket(name)
+    if ticket is None:
+        raise ApiError(404, 'Ticket does not exist')
+    return ticket
+
+
+@bp.route('/tokens', methods=['POST'])
+def create_token():
+    values = submitted_values()
+    # the same limits as the login form: a password can not be guessed
+    # faster by trying it on both
+    email = values.get('email', '').lower()
+    state = bn.get_state()
+    for limiter, key in ((state['ip_limiter'], ('login', fe.client_address())),
+                         (state['email_limiter'], ('login', email))):
+        if limiter is not None and not limiter.allow(key):
+            raise ApiError(429, fe.RATE_LIMIT_MESSAGE,
+                           headers={'Retry-After': str(max(1, int(math.ceil(limiter.retry_after(key)))))})
+    validate('login', values)
+
+    try:
+        user = bn.login_user(values['email'], values['password'])
+    except bn.HasherBusy:
+        raise ApiError(503, fe.BUSY_MESSAGE)
+    if not user:
+        raise ApiError(401, 'login failed')
+    return jsonify(token=token_serializer().dumps(user.email), expires_in=current_app.config['API_TOKEN_TTL'])
+
+
+@bp.route('/tickets', methods=['GET'])
+@authenticate
+def list_tickets(user):
+    fields = requested_fields(TICKET_FIELDS)
+    sort = request.args.get('sort', 'id')
+    if sort not in bn.TICKET_SORTS:
+        raise ApiError(400, 'Unknown sort: %s' % sort, field='sort')
+    limit = request.args.get('limit', fe.TICKETS_PER_PAGE, type=int)
+    if not 1 <= limit <= current_app.config['API_MAX_PAGE_SIZE']:
+        raise ApiError(400, 'Limit must be between 1 and %d' % current_app.config['API_MAX_PAGE_SIZE'],
+                       field='limit')
+    after = request.args.get('after')
+    if after is not None:
+        try:
+            bn.decode_cursor(after, sort)
+        except ValueError:
+            raise ApiError(400, 'Invalid cursor', field='after')
+
+    # the list only changes with the inventory (and the date, as tickets
+    # expire), so clients polling it get an empty 304 until it does
+    etag = hashlib.sha1(('%s:%s:%s' % (bn.get_inventory_version(), datetime.date.today(),
+                                       request.query_string.decode('latin1'))).encode()).hexdigest()
+    if not is_resource_modified(request.environ, etag=etag):
+        response = current_app.response_class(status=304)
+    else:
+        tickets, next_after = bn.get_tickets_page(after, limit, sort)
+        response = jsonify(tickets=[serialize(ticket, TICKET_FIELDS, fields) for ticket in tickets],
+                           next_after=next_after)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/tickets', methods=['POST'])
+@authenticate
+def sell_ticket(user):
+    renamed = {'date': 'exp_date'}
+    values = validate('sell', submitted_values(renamed), renamed)
+    bn.sell_ticket(values['name'], values['quantity'], values['price'], values['exp_date'], user.email)
+    ticket = {'name': values['name'], 'price': values['price'], 'quantity': values['quantity'],
+              'seller': user.email, 'date': format_date(values['exp_date'])}
+    response = jsonify(ticket)
+    response.status_code = 201
+    response.headers['Location'] = '/api/v1/tickets/' + values['name']
+    return response
+
+
+@bp.route('/tickets/<name>', methods=['GET'])
+@authenticate
+def get_ticket(user, name):
+    fields = requested_fields(TICKET_FIELDS)
+    return jsonify(serialize(find_ticket(name), TICKET_FIELDS, fields))
+
+
+@bp.route('/tickets/<name>', methods=['PATCH'])
+@authenticate
+def update_ticket(user, name):
+    ticket = find_ticket(name)
+    if ticket.email != user.email:
+        raise ApiError(403, 'Only the seller can update a ticket')
+    renamed = {'date': 'exp_date'}
+    # the fields not given keep their values
+    values = {'name': name, 'quantity': str(ticket.quantity), 'price': str(ticket.price),
+              'exp_date': format_date(ticket.date)}
+    values.update(submitted_values(renamed))
+    values['name'] = name
+    values = validate('update', values, renamed)
+    bn.update_ticket(ticket, values['quantity'], values['price'], values['exp_date'])
+    return jsonify(serialize(ticket, TICKET_FIELDS))
+
+
+@bp.route('/tickets/<name>/purchases', methods=['POST'])
+@authenticate
+def buy_ticket(user, name):
+    values = submitted_values()
+    values['name'] = name
+    values = validate('buy', values)
+    ticket = find_ticket(name)
+    # the backend checks the quantity and the balance in the purchase transaction
+    error_message = bn.buy_ticket(user, ticket, values['quantity'])
+    if error_message:
+        raise ApiError(409, error_message)
+    response = jsonify(name=name, quantity=values['quantity'], balance=str(bn.get_user(user.email).balance))
+    response.status_code = 201
+    return response
+
+
+@bp.route('/users/me', methods=['GET'])
+@authenticate
+def current_user(user):
+    fields = requested_fields(USER_FIELDS)
+    return jsonify(serialize(user, USER_FIELDS, fields))
@@ -0,0 +1,582 @@
+import asyncio
+import datetime
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from markupsafe import Markup
+from sqlalchemy import select, text
+from werkzeug.urls import url_decode
+import qa327
+from qa327.models import db, init_db, User, Ticket, Holding
+import qa327.backend as bn
+import qa327.frontend as fe
+
+try:
+    import aiosqlite
+except ImportError:     # sqlite is read on threads
+    aiosqlite = None
+
+try:
+    import aiomysql
+except ImportError:     # MySQL is read on threads
+    aiomysql = None
+
+"""
+This file defines the ASGI entry point of the service, for an ASGI
+server such as uvicorn:
+
+    uvicorn qa327.asgi:application --workers 4
+
+The read-heavy pages, the profile page with the ticket listing and the
+search, are served by coroutines that wait on the database without
+holding a thread, so one worker keeps many of them in flight. They are
+read with aiosqlite or aiomysql when the package is installed, and on a
+bounded pool of threads otherwise. They read the primary database.
+
+Every other request, including all the forms that write, is handed to
+the Flask application on a pool of threads, as a WSGI server would.
+"""
+
+
+def compile_statement(statement, dialect):
+    """
+    Compile a SQLAlchemy statement for a DB-API driver
+    :param statement: a select or text statement with its parameters bound
+    :param dialect: the SQLAlchemy dialect of the database
+    :return: tuple of (SQL string, parameters in the paramstyle of the dialect)
+    """
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    for name, value in params.items():
+        # dates are stored and compared as ISO strings by sqlite, MySQL takes them too
+        if isinstance(value, datetime.date):
+            params[name] = value.isoformat()
+    if dialect.positional:
+        return str(compiled), tuple(params[name] for name in compiled.positiontup)
+    return str(compiled), params
+
+
+class RowConverter(object):
+    """
+    Turns the rows a DB-API driver returns into model instances, the
+    column values converted the way SQLAlchemy would (e.g. the dates
+    sqlite returns as strings)
+    """
+
+    def __init__(self, model, dialect):
+        self.model = model
+        self.processors = {}
+        for column in model.__table__.columns:
+            processor = column.type.dialect_impl(dialect).result_processor(dialect, None)
+            self.processors[column.key] = processor
+
+    def values(self, row):
+        """
+        :param row: dict of column values, some columns may be missing
+        :return: dict of the converted values of the model's columns
+        """
+        values = {}
+        for key, value in row.items():
+            if key in self.processors:
+                processor = self.processors[key]
+                values[key] = processor(value) if processor is not None else value
+        return values
+
+    def __call__(self, row):
+        return self.model(**self.values(row))
+
+
+class ThreadedDatabase(object):
+    """
+    Reads with the synchronous driver of the app's engine on a bounded
+    pool of threads, when there is no async driver for the database
+    """
+
+    driver = 'threads'
+
+    def __init__(self, engine, size):
+        self.engine = engine
+        self.dialect = engine.dialect
+        self._executor = ThreadPoolExecutor(size, thread_name_prefix='qa327-db')
+
+    def _fetch_all(self, sql, params):
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+            cursor.close()
+            return rows
+        finally:
+            connection.close()
+
+    async def fetch_all(self, statement):
+        """
+        :param statement: the statement to run
+        :return: list of dicts of the raw column values
+        """
+        sql, params = compile_statement(statement, self.dialect)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self._fetch_all, sql, params)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class AioSqliteDatabase(object):
+    """
+    Reads a sqlite database with aiosqlite, on at most size connections
+    """
+
+    driver = 'aiosqlite'
+
+    def __init__(self, path, dialect, size):
+        self.path = path
+        self.dialect = dialect
+        self.size = size
+        self._idle = []
+        self._slots = None
+
+    async def fetch_all(self, statement):
+        sql, params = compile_statement(statement, self.dialect)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await aiosqlite.connect(self.path)
+            try:
+                async with connection.execute(sql, params) as cursor:
+                    names = [column[0] for column in cursor.description]
+                    rows = [dict(zip(names, row)) for row in await cursor.fetchall()]
+            except Exception:
+                await connection.close()
+                raise
+            self._idle.append(connection)
+            return rows
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
+
+
+class AioMySQLDatabase(object):
+    """
+    Reads a MySQL database with aiomysql, on a pool of at most size connections
+    """
+
+    driver = 'aiomysql'
+
+    def __init__(self, url, dialect, size):
+        self.url = url
+        self.dialect = dialect
+        self.size = size
+        self._pool = None
+        self._lock = None
+
+    async def _get_pool(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._pool is None:
+                url = self.url
+                self._pool = await aiomysql.create_pool(
+                    host=url.host or 'localhost', port=url.port or 3306, user=url.username,
+                    password=url.password or '', db=url.database, maxsize=self.size,
+                    charset=url.query.get('charset', 'utf8mb4'), autocommit=True)
+            return self._pool
+
+    async def fetch_all(self, statement):
+        sql, params = compile_statement(statement, self.dialect)
+        pool = await self._get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(sql, params)
+                names = [column[0] for column in cursor.description]
+                return [dict(zip(names, row)) for row in await cursor.fetchall()]
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+def connect(app, size):
+    """
+    Pick how the coroutines read the database of an app
+    :param app: the Flask application
+    :param size: the most queries run at once
+    :return: an AioSqliteDatabase, AioMySQLDatabase or ThreadedDatabase
+    """
+    engine = db.get_engine(app)
+    dialect = engine.dialect
+    if dialect.name == 'sqlite' and aiosqlite is not None and engine.url.database not in (None, '', ':memory:'):
+        return AioSqliteDatabase(engine.url.database, dialect, size)
+    if dialect.name == 'mysql' and aiomysql is not None:
+        return AioMySQLDatabase(engine.url, dialect, size)
+    return ThreadedDatabase(engine, size)
+
+
+def make_environ(scope, body):
+    """
+    :param scope: the scope of an ASGI http request
+    :param body: file with the request body
+    :return: the WSGI environ of the request
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').lower()
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+async def read_body(receive):
+    """
+    :return: the whole request body, or None if the client disconnected
+    """
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def respond(send, status, headers, body=b''):
+    headers = list(headers) + [('Content-Length', str(len(body)))]
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.encode('latin1'), value.encode('latin1')) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AsgiApp(object):
+    """
+    Serves the read-heavy pages with coroutines, and hands the other
+    requests to the Flask application on a pool of threads
+    """
+
+    def __init__(self, app, pool_size, threads):
+        """
+        :param app: the Flask application
+        :param pool_size: the most database queries the coroutines run at once
+        :param threads: number of threads serving the requests handed to Flask
+        """
+        self.app = app
+        self.pool_size = pool_size
+        self.threads = threads
+        self.database = None
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='qa327-wsgi')
+        self.routes = {'/': self.profile, '/search': self.search, '/stats/asgi': self.stats}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.served_async = 0
+        self.served_wsgi = 0
+        self._users = None
+        self._tickets = None
+        self._holdings = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        handler = self.routes.get(scope['path']) if scope['method'] == 'GET' else None
+        if handler is self.profile and url_decode(scope.get('query_string', b'')).get('view') == 'all':
+            # the listing of all tickets is streamed by the Flask application
+            handler = None
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if handler is None:
+                self.served_wsgi += 1
+                return await self.call_wsgi(scope, receive, send)
+            self.served_async += 1
+            environ = make_environ(scope, io.BytesIO())
+            try:
+                status, headers, body = await handler(environ)
+            except Exception:
+                self.app.logger.exception('Exception on %s [GET]', scope['path'])
+                status, headers, body = 500, [('Content-Type', 'text/plain')], b'Internal Server Error'
+            # compressed like the Flask responses, by the same middleware
+            compression = self.app.extensions.get('compression')
+            if compression is not None:
+                headers, body = compression.compress_body(status, headers, body, environ.get('HTTP_ACCEPT_ENCODING'))
+            await respond(send, status, headers, body)
+        finally:
+            self.in_flight -= 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as error:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(error)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        """
+        Create and migrate the tables, and connect the async database
+        """
+        def init():
+            with self.app.app_context():
+                init_db()
+        await asyncio.get_event_loop().run_in_executor(self.executor, init)
+        self.get_database()
+
+    async def shutdown(self):
+        if self.database is not None:
+            await self.database.close()
+        self.executor.shutdown(wait=True)
+
+    def get_database(self):
+        """
+        :return: the database the coroutines read, connected at the first use
+        """
+        if self.database is None:
+            with self.app.app_context():
+                database = connect(self.app, self.pool_size)
+            self._users = RowConverter(User, database.dialect)
+            self._tickets = RowConverter(Ticket, database.dialect)
+            self._holdings = RowConverter(Holding, database.dialect)
+            self.database = database
+        return self.database
+
+    def render(self, name, **context):
+        # the templates only use their own variables, so they are rendered
+        # without the request context render_template needs
+        return self.app.jinja_env.get_template(name).render(**context)
+
+    async def get_user(self, email):
+        """
+        Get a user by email through the user cache, like bn.get_cached_user
+        :return: a user instance that is not attached to a session, or None
+        """
+        values = bn.get_cached_user_values(email, self.app)
+        if values is not None:
+            return User(**values)
+        table = User.__table__
+        rows = await self.get_database().fetch_all(select([table]).where(table.c.email == email).limit(1))
+        if not rows:
+            return None
+        user = self._users(rows[0])
+        bn.cache_user(user, self.app)
+        return user
+
+    async def get_user_holdings(self, user):
+        table = Holding.__table__
+        rows = await self.get_database().fetch_all(
+            select([table]).where(table.c.buyer_id == user.id).order_by(table.c.id.desc()))
+        return [self._holdings(row) for row in rows]
+
+    async def get_tickets_page(self, after=None, limit=20, sort='id'):
+        """
+        Get one page of tickets using keyset pagination, like bn.get_tickets_page
+        :return: tuple of (list of ticket instances, cursor for the next page or None)
+        """
+        rows = await self.get_database().fetch_all(bn.get_tickets_page_statement(after, limit, sort))
+        return bn.split_tickets_page([self._tickets(row) for row in rows], limit, sort)
+
+    async def render_ticket_list(self, after, sort):
+        # shares the fragment cache, and its keys, with the Flask pages
+        fragment_cache = bn.get_state(self.app)['fragment_cache']
+        key = fe.ticket_list_key(after, sort, self.app)
+        fragment = fragment_cache.get(key)
+        if fragment is None:
+            tickets, next_after = await self.get_tickets_page(after, fe.TICKETS_PER_PAGE, sort)
+            fragment = Markup(self.render('ticket_list.html', tickets=tickets,
+                                          next_after=next_after, sort=sort))
+            fragment_cache.set(key, fragment)
+        return fragment
+
+    async def authenticate(self, environ):
+        """
+        :return: the logged in user, or None
+        """
+        session = self.app.session_interface.open_session(self.app, self.app.request_class(environ))
+        if not session or 'logged_in' not in session:
+            return None
+        return await self.get_user(session['logged_in'])
+
+    async def profile(self, environ):
+        user = await self.authenticate(environ)
+        if user is None:
+            return 302, [('Location', '/login')], b''
+        after, sort = fe.read_page_args(url_decode(environ['QUERY_STRING']))
+        modified, headers = fe.check_page(environ, user, after, sort, app=self.app)
+        if not modified:
+            return 304, headers, b''
+        holdings, ticket_list = await asyncio.gather(self.get_user_holdings(user),
+                                                     self.render_ticket_list(after, sort))
+        body = self.render('index.html', user=user, holdings=holdings, ticket_list=ticket_list)
+        return 200, [('Content-Type', 'text/html; charset=utf-8')] + headers, body.encode('utf-8')
+
+    async def search(self, environ):
+        user = await self.authenticate(environ)
+        if user is None:
+            return 302, [('Location', '/login')], b''
+        args = url_decode(environ['QUERY_STRING'])
+        query = args.get('q', '')
+        page = args.get('page', 1, type=int)
+        database = self.get_database()
+        tickets, next_page = [], None
+        statement = bn.get_search_statement(query, page, fe.TICKETS_PER_PAGE, database.dialect.name)
+        if statement is not None:
+            sql, params = statement
+            rows = await database.fetch_all(text(sql).bindparams(**params))
+            tickets = [self._tickets(row) for row in rows]
+            if len(tickets) > fe.TICKETS_PER_PAGE:
+                tickets, next_page = tickets[:fe.TICKETS_PER_PAGE], page + 1
+        body = self.render('search.html', user=user, query=query, tickets=tickets,
+                           page=page, next_page=next_page)
+        return 200, [('Content-Type', 'text/html; charset=utf-8')], body.encode('utf-8')
+
+    async def stats(self, environ):
+        # requests in flight and how they were served
+        if not self.app.config['STATS_ENABLED']:
+            return 404, [('Content-Type', 'text/plain')], b'Not Found'
+        stats = {'driver': self.get_database().driver, 'pool_size': self.pool_size,
+                 'threads': self.threads, 'in_flight': self.in_flight,
+                 'peak_in_flight': self.peak_in_flight, 'served_async': self.served_async,
+                 'served_wsgi': self.served_wsgi}
+        return 200, [('Content-Type', 'application/json')], json.dumps(stats).encode()
+
+    async def call_wsgi(self, scope, receive, send):
+        """
+        Serve a request with the Flask application, on one of the threads.
+        The response is streamed: its chunks are sent as the thread makes them
+        """
+        body = await read_body(receive)
+        if body is None:
+            return
+        environ = make_environ(scope, io.BytesIO(body))
+        loop = asyncio.get_event_loop()
+        # a few chunks ahead at most, the thread waits for slow clients
+        queue = asyncio.Queue(maxsize=8)
+        cancelled = threading.Event()
+        future = loop.run_in_executor(self.executor, self.run_wsgi, environ, loop, queue, cancelled)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == 'start':
+                    status, headers = value
+                    await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                                'headers': [(name.encode('latin1'), value.encode('latin1'))
+                                            for name, value in headers]})
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+                else:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+        finally:
+            # let the thread finish, e.g. after the client went away
+            cancelled.set()
+            while not future.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.wait([future], timeout=0.05)
+
+    def run_wsgi(self, environ, loop, queue, cancelled):
+        # runs on a thread of the executor
+        def put(kind, value=None):
+            if not cancelled.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put((kind, value)), loop).result()
+
+        response = []
+        sent = []
+
+        def send_start():
+            if not sent:
+                sent.append(True)
+                put('start', response)
+
+        def write(data):
+            send_start()
+            if data:
+                put('body', bytes(data))
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and sent:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, headers]
+            return write
+
+        try:
+            iterable = self.app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if cancelled.is_set():
+                        break
+                    write(chunk)
+                send_start()
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        except Exception:
+            self.app.logger.exception('Exception on %s [%s]', environ['PATH_INFO'], environ['REQUEST_METHOD'])
+            if not sent:
+                response[:] = ['500 INTERNAL SERVER ERROR', [('Content-Type', 'text/plain')]]
+                write(b'Internal Server Error')
+        put('end')
+
+
+def create_asgi_app(app=None):
+    """
+    :param app: the Flask application, qa327.app by default
+    :return: the ASGI application serving it
+    """
+    app = app or qa327.app
+    return AsgiApp(app, app.config['ASGI_DB_POOL_SIZE'], app.config['ASGI_WSGI_THREADS'])
+
+
+_application = None
+_application_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # qa327.asgi.application is created at its first use, once per process
+    global _application
+    if name != 'application':
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    if _application is None:
+        with _application_lock:
+            if _application is None:
+                _application = create_asgi_app()
+    return _application
@@ -0,0 +1,232 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+from qa327 import package_dir
+
+try:
+    import brotli
+except ImportError:     # only the gzip variants are built
+    brotli = None
+
+"""
+This file builds the CSS, JS, fonts and images of the pages, which are
+bundled with the package (qa327/static/vendor, see the README there),
+so pages load them from the service itself rather than from third
+party hosts.
+
+The sources are the files under qa327/static. The build step, which
+needs no network, copies each of them to qa327/static/build under a
+name with a hash of its content, e.g. css/demo.3f2a9c0d1b7e.css, with
+gzip (and brotli, when the brotli package is installed) variants next
+to it, and writes manifest.json, the table from source to built names.
+A built file never changes, so it is served with immutable cache
+headers, and a new version of an asset gets a new URL.
+
+    python -m qa327 assets            build the assets
+"""
+
+STATIC_DIR = os.path.join(package_dir, 'static')
+BUILD_DIR = os.path.join(STATIC_DIR, 'build')
+MANIFEST = 'manifest.json'
+
+# files kept with the sources that are not assets, e.g. the README and licenses
+NOT_ASSETS = ('.md', '.txt')
+
+# files smaller than this are not worth a compressed variant
+COMPRESS_MIN_SIZE = 256
+
+# formats that are compressed already
+COMPRESSED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.woff', '.woff2')
+
+# the url(...) references of a stylesheet
+CSS_URL = re.compile(rb'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+# the Content-Encoding of each compressed variant, by file suffix, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def write_file(path, data):
+    # written next to the target and renamed, readers never see half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+def is_relative(reference):
+    return not (reference.startswith(b'data:') or reference.startswith(b'/') or reference.startswith(b'#')
+                or b'://' in reference)
+
+
+def list_sources(static_dir, build_dir):
+    """
+    :return: sorted list of the asset sources, as paths relative to static_dir
+    """
+    build_dir = os.path.abspath(build_dir)
+    sources = []
+    for folder, folders, files in os.walk(static_dir):
+        if os.path.abspath(folder) == build_dir:
+            folders[:] = []
+            continue
+        folders[:] = [child for child in folders if os.path.abspath(os.path.join(folder, child)) != build_dir]
+        for filename in files:
+            if not filename.startswith('.') and not filename.endswith(('.tmp',) + NOT_ASSETS):
+                sources.append(os.path.relpath(os.path.join(folder, filename), static_dir).replace(os.sep, '/'))
+    return sorted(sources)
+
+
+def fingerprint(name, data):
+    """
+    :return: the name with a hash of the data before the extension
+    """
+    root, extension = posixpath.splitext(name)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:12], extension)
+
+
+def rewrite_css(data, name, built):
+    """
+    Point the relative url(...) references of a stylesheet to the built names
+    :param data: the stylesheet
+    :param name: its path among the sources
+    :param built: dict of the sources built so far to their built names
+    :return: the rewritten stylesheet
+    """
+    folder = posixpath.dirname(name)
+
+    def replace(match):
+        reference = match.group(2).strip()
+        if not is_relative(reference):
+            return match.group(0)
+        # keep the query and fragment, e.g. nucleo.eot?#iefix
+        split = re.search(rb'[?#]', reference)
+        path, suffix = (reference[:split.start()], reference[split.start():]) if split else (reference, b'')
+        target = posixpath.normpath(posixpath.join(folder, path.decode()))
+        if target not in built:
+            return match.group(0)
+        relative = posixpath.relpath(built[target], folder).encode()
+        return b'url(' + relative + suffix + b')'
+    return CSS_URL.sub(replace, data)
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        # no timestamp, so a build gives the same bytes every time
+        output = io.BytesIO()
+        with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=9, mtime=0) as compressed:
+            compressed.write(data)
+        return output.getvalue()
+    return brotli.compress(data, quality=11)
+
+
+def build(static_dir=STATIC_DIR, build_dir=BUILD_DIR):
+    """
+    Build the fingerprinted and compressed assets and their manifest.
+    Files of earlier builds are kept, pages rendered before a reload
+    still link them
+    :param static_dir: the folder of the asset sources
+    :param build_dir: the folder the built assets are written to
+    :return: the manifest
+    """
+    encodings = [(encoding, suffix) for encoding, suffix in ENCODINGS if encoding != 'br' or brotli is not None]
+    built = {}
+    variants = {}
+    # stylesheets last, the files they refer to must have their built names
+    for name in sorted(list_sources(static_dir, build_dir), key=lambda name: (name.endswith('.css'), name)):
+        with open(os.path.join(static_dir, *name.split('/')), 'rb') as source:
+            data = source.read()
+        if name.endswith('.css'):
+            data = rewrite_css(data, name, built)
+        built_name = fingerprint(name, data)
+        path = os.path.join(build_dir, *built_name.split('/'))
+        write_file(path, data)
+        variants[built_name] = []
+        if len(data) >= COMPRESS_MIN_SIZE and not name.lower().endswith(COMPRESSED_EXTENSIONS):
+            for encoding, suffix in encodings:
+                compressed = compress(data, encoding)
+                if len(compressed) < len(data):
+                    write_file(path + suffix, compressed)
+                    variants[built_name].append(encoding)
+        built[name] = built_name
+    manifest = {'assets': built, 'encodings': variants}
+    write_file(os.path.join(build_dir, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return manifest
+
+
+def is_stale(static_dir=STATIC_DIR, build_dir=BUILD_DIR):
+    """
+    :return: True if a source changed since the last build, or there is no build
+    """
+    try:
+        built = os.path.getmtime(os.path.join(build_dir, MANIFEST))
+    except OSError:
+        return True
+    return any(os.path.getmtime(os.path.join(static_dir, *name.split('/'))) > built
+               for name in list_sources(static_dir, build_dir))
+
+
+class Assets(object):
+    """
+    The built assets, as the pages link them and the service serves them
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, build_dir=BUILD_DIR, url_path='/static/'):
+        """
+        :param static_dir: the folder of the asset sources
+        :param build_dir: the folder of the built assets
+        :param url_path: the URL the assets are served under
+        """
+        self.static_dir = static_dir
+        self.build_dir = build_dir
+        self.url_path = url_path
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        """
+        :return: the manifest of the build, read at the first use
+        """
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.build_dir, MANIFEST)) as manifest:
+                    self._manifest = json.load(manifest)
+            except (OSError, ValueError):
+                self._manifest = {'assets': {}, 'encodings': {}}
+        return self._manifest
+
+    def reload(self):
+        """
+        Read the manifest again, after a build
+        """
+        self._manifest = None
+
+    def url(self, name):
+        """
+        :param name: path of an asset among the sources, e.g. 'vendor/js/jquery.min.js'
+        :return: the URL of its built file, or of its source before a build
+        """
+        built_name = self.manifest['assets'].get(name)
+        if built_name is not None:
+            return self.url_path + built_name
+        return self.url_path + name
+
+    def find(self, filename, accept_encodings):
+        """
+        Find the file to send for a URL
+        :param filename: the path of the URL under url_path
+        :param accept_encodings: the encodings the client accepts, e.g. request.accept_encodings
+        :return: tuple of (folder, file under it, content encoding or None, whether the
+            file is immutable, whether it has compressed variants)
+        """
+        encodings = self.manifest['encodings'].get(filename)
+        if encodings is not None:
+            for encoding, suffix in ENCODINGS:
+                if encoding in encodings and accept_encodings[encoding]:
+                    return self.build_dir, filename + suffix, encoding, True, True
+            return self.build_dir, filename, None, True, bool(encodings)
+        # a source, linked before it was built
+        return self.static_dir, filename, None, False, False
@@ -1,12 +1,33 @@
-from qa327.models import db, User, Ticket
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask import request, redirect
+from qa327 import pool
+from qa327.bloom import NameFilter
+from qa327.hashing import PasswordHasher, HasherBusy
+from qa327.cache import TTLCache, VersionCounter, SharedMemory, SharedCache, SharedVersionCounter
+from qa327.models import db, User, Ticket, ArchivedTicket, LedgerEntry, Holding
+from qa327.routing import read_only, get_replica_engines
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import make_transient_to_detached
+from flask import request, redirect, g, has_app_context, current_app
+import base64
+import datetime
+import json
+import re
+import time
+import uuid
 
 """
 This file defines all backend logic that interacts with database and other services
 """
 
 
+def get_pool_stats():
+    """
+    Get live statistics of the database connection pool
+    :return: dict of pool statistics
+    """
+    return pool.get_pool_stats(db.engine)
+
+
+@read_only
 def get_user(email):
     """
     Get a user by a given email
@@ -17,18 +38,185 @@ def get_user(email):
     return user
 
 
+def get_state(app=None):
+    """
+    Get what init_app set up for an app, kept in app.extensions['qa327']:
+
+        shared_memory       the memory mapped file shared by the workers, when configured
+        user_cache          column values of recently used users, by email
+        inventory_version   bumped whenever a ticket is listed, bought, updated or
+                            archived. Shared by the workers, a sale in one of them
+                            makes every worker's cached fragments out of date at once
+        password_hasher     hashes and checks the passwords in worker processes
+        ticket_names        Bloom filter of the listed ticket names, or None
+
+    and, by the frontend, its rate limiters, fragment cache and assets
+    :param app: the Flask application, the current one by default
+    :return: dict of the state of the app
+    """
+    return (app or current_app).extensions['qa327']
+
+
+def make_cache(app, name, maxsize, ttl):
+    """
+    Create a cache, shared by the workers when SHARED_CACHE_PATH is set
+    :param app: the Flask application the cache is for
+    :param name: name of the cache, unique among the caches
+    :param maxsize: the maximum number of entries of an in-process cache
+    :param ttl: seconds an entry stays valid
+    :return: a TTLCache or a SharedCache
+    """
+    shared_memory = get_state(app)['shared_memory']
+    if shared_memory is not None:
+        return SharedCache(shared_memory, name, ttl)
+    return TTLCache(maxsize, ttl)
+
+
+def make_version_counter(app, name):
+    """
+    Create a version counter, shared by the workers when SHARED_CACHE_PATH is set
+    :param app: the Flask application the counter is for
+    :param name: name of the counter, unique among the counters
+    :return: a VersionCounter or a SharedVersionCounter
+    """
+    shared_memory = get_state(app)['shared_memory']
+    if shared_memory is not None:
+        return SharedVersionCounter(shared_memory, name)
+    return VersionCounter()
+
+
+def get_inventory_version(app=None):
+    """
+    Get the version of the ticket inventory, anything rendered from an
+    older version of the tickets is out of date
+    :param app: the Flask application, the current one by default
+    :return: the inventory version
+    """
+    return get_state(app)['inventory_version'].value
+
+
+def get_page_validators(user, app=None):
+    """
+    Get what tells whether a page showing the tickets and a user's
+    balance changed, for conditional GET requests
+    :param user: the user the page is for
+    :param app: the Flask application, the current one by default
+    :return: tuple of (version tag, last modified datetime in UTC)
+    """
+    inventory_version = get_state(app)['inventory_version']
+    tag = '%s:%s:%s' % (inventory_version.tag, user.id, user.balance_version or 0)
+    last_modified = datetime.datetime.utcfromtimestamp(int(inventory_version.modified))
+    if user.balance_updated is not None:
+        last_modified = max(last_modified, user.balance_updated.replace(microsecond=0))
+    return tag, last_modified
+
+
+def get_cached_user(email):
+    """
+    Get a user by a given email, through the user identity caches: the
+    same email always gives the same user object within a request, and
+    users seen in the last USER_CACHE_TTL seconds are rebuilt without a
+    database query
+    :param email: the email of the user
+    :return: a user that has the matched email address
+    """
+    identity_map = g.setdefault('identity_map', {}) if has_app_context() else {}
+    if email in identity_map:
+        return identity_map[email]
+
+    values = get_cached_user_values(email)
+    if values is not None:
+        user = User(**values)
+        # attach the rebuilt user to the session as if it had been loaded
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+    else:
+        user = get_user(email)
+        cache_user(user)
+    identity_map[email] = user
+    return user
+
+
+def get_cached_user_values(email, app=None):
+    """
+    Get the column values of a user seen in the last USER_CACHE_TTL seconds
+    :param email: the email of the user
+    :param app: the Flask application, the current one by default
+    :return: dict of the column values of the user, or None if not cached
+    """
+    return get_state(app)['user_cache'].get(email)
+
+
+def cache_user(user, app=None):
+    """
+    Keep the column values of a user read from the database in the user
+    cache, for get_cached_user_values
+    :param user: the user, or None if there is no such user
+    :param app: the Flask application, the current one by default
+    """
+    if user is not None and user.id is not None:
+        get_state(app)['user_cache'].set(user.email, dict((column.key, getattr(user, column.key))
+                                                          for column in User.__mapper__.column_attrs))
+
+
+def invalidate_user(email):
+    """
+    Drop a user from the identity caches, after the user's data changed
+    :param email: the email of the user
+    """
+    get_state()['user_cache'].invalidate(email)
+    if has_app_context():
+        g.setdefault('identity_map', {}).pop(email, None)
+
+
+def dispose_connections():
+    """
+    Close the pooled database connections, before worker processes are
+    forked: a connection must not be shared by two processes
+    """
+    db.get_engine().dispose()
+    engines, _ = get_replica_engines(current_app)
+    for engine in engines:
+        engine.dispose()
+
+
+def get_cache_stats():
+    """
+    Get the hit and miss counters of the user cache, and the size of the
+    ticket name filter
+    :return: dict of cache statistics
+    """
+    state = get_state()
+    stats = {'users': state['user_cache'].stats()}
+    if state['ticket_names'] is not None:
+        stats['ticket_names'] = state['ticket_names'].stats()
+    return stats
+
+
 def login_user(email, password):
     """
-    Check user authentication by comparing the password
+    Check user authentication by comparing the password. Passwords
+    hashed with an older method are hashed again with the current one
     :param email: the email of the user
     :param password: the password input
     :return: the user if login succeeds
+    :raise HasherBusy: if too many passwords are waiting to be checked
     """
+    password_hasher = get_state()['password_hasher']
     # if this returns a user, then the name already exists in database
     user = get_user(email)
 
-    if not user or not check_password_hash(user.password, password):
+    if not user or not password_hasher.check(user.password, password):
         return None
+
+    if password_hasher.needs_rehash(user.password):
+        try:
+            user.password = password_hasher.hash(password)
+        except HasherBusy:
+            return user     # the password is hashed again at a later login
+        db.session.commit()
+        invalidate_user(email)
+        password_hasher.rehashed += 1
     return user
 
 
@@ -42,48 +230,284 @@ def register_user(email, name, password, password2):
     :param password: the password of user
     :param password2: another password input to make sure the input is correct
     :return: an error message if there is any, or None if register succeeds
+    :raise HasherBusy: if too many passwords are waiting to be hashed
     """
 
-    hashed_pw = generate_password_hash(password, method='sha256')
+    hashed_pw = get_state()['password_hasher'].hash(password)
     # store the encrypted password rather than the plain password
-    new_user = User(email=email, name=name, password=hashed_pw, balance=5000)
+    new_user = User(email=email, name=name, password=hashed_pw, balance_cents=0)
 
     db.session.add(new_user)
+    db.session.flush()  # assigns new_user.id for the ledger entry
+    post_ledger_entry(new_user.id, uuid.uuid4().hex, 'signup', OPENING_BALANCE_CENTS)
     db.session.commit()
     return None
 
+def parse_ticket_date(value):
+    """Parse a ticket expiry date
+    :param value: a date in the form YYYYMMDD, or a date object
+    :return: the date object, or None if the value is not a valid date
+    """
+    if isinstance(value, datetime.date):
+        return value
+    # strptime alone would also accept dates without zero padding, like 2020121
+    if not isinstance(value, str) or len(value) != 8 or not value.isdigit():
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%Y%m%d').date()
+    except (TypeError, ValueError):
+        return None
+
 def get_ticket(name):
     """Get a ticket by a given ticket name
     :param name: name of the ticket desired
     :return: ticket object with name: name """
 
+    # names that were never listed are answered by the filter, without a query
+    state = get_state()
+    ticket_names = state['ticket_names']
+    if ticket_names is not None and not ticket_names.might_exist(name, state['inventory_version'].value):
+        return None
+    return find_ticket(name)
+
+@read_only
+def find_ticket(name):
+    """Query a ticket by a given ticket name
+    :param name: name of the ticket desired
+    :return: ticket object with name: name """
+
+    # ticket.name is indexed, so this is an index lookup rather than a table scan
     ticket = Ticket.query.filter_by(name=name).first()
     return ticket
 
+def load_ticket_names(after_id):
+    """Get the names of the tickets listed after a given one, for the ticket name filter
+    :param after_id: id of the last ticket already loaded, 0 for all tickets
+    :return: iterable of (id, name) pairs """
+
+    # not read-only: a lagging replica could hide new tickets from the filter
+    return db.session.query(Ticket.id, Ticket.name).filter(Ticket.id > after_id) \
+        .order_by(Ticket.id).yield_per(10000)
+
+def build_ticket_names():
+    """
+    Build the ticket name filter from the whole ticket table, if it is enabled
+    """
+    state = get_state()
+    if state['ticket_names'] is not None:
+        state['ticket_names'].refresh(state['inventory_version'].value)
+
+
+def init_app(app):
+    """
+    Set up the caches, the password hasher and the ticket name filter
+    from the config of an app. Nothing is connected or started here,
+    they do that at their first use, but for the ticket name filter,
+    built before the app serves its first request. The password hashing
+    iterations are calibrated here, not by a request. Each app has its
+    own, see get_state()
+    :param app: the Flask application
+    """
+    config = app.config
+    state = app.extensions['qa327'] = {'shared_memory': None, 'ticket_names': None}
+    if config['SHARED_CACHE_PATH']:
+        state['shared_memory'] = SharedMemory(config['SHARED_CACHE_PATH'], config['SHARED_CACHE_SLOTS'],
+                                              config['SHARED_CACHE_SLOT_SIZE'])
+    state['user_cache'] = make_cache(app, 'users', config['USER_CACHE_SIZE'], config['USER_CACHE_TTL'])
+    state['inventory_version'] = make_version_counter(app, 'inventory')
+    state['password_hasher'] = PasswordHasher(config['PASSWORD_HASH_WORKERS'], config['PASSWORD_HASH_QUEUE'],
+                                              config['PASSWORD_HASH_TARGET_MS'] / 1000,
+                                              config['PASSWORD_HASH_MIN_ITERATIONS'],
+                                              iterations=config['PASSWORD_HASH_ITERATIONS'])
+    if config['TICKET_FILTER_ENABLED']:
+        # it checks for new tickets when the inventory version changes, and at
+        # least every TICKET_FILTER_REFRESH seconds for those listed by other workers
+        state['ticket_names'] = NameFilter(load_ticket_names, config['TICKET_FILTER_CAPACITY'],
+                                           refresh_after=config['TICKET_FILTER_REFRESH'])
+        # the table is read once the app serves, not by the lookup of a request
+        app.before_first_request(build_ticket_names)
+
+@read_only
+def get_tickets_by_seller(email):
+    """Get all tickets listed by a given seller
+    :param email: the email of the seller
+    :return: list of ticket instances owned by the seller
+    """
+
+    tickets = Ticket.query.filter_by(email=email).order_by(Ticket.id).all()
+    return tickets
+
+@read_only
 def get_all_tickets():
     """Get all instances of tickets available
     :param: none
-    :return: list of all ticket instances
+    :return: list of all ticket instances that have not expired
     """
 
-    tickets = Ticket.query.all()
+    # expired tickets are dropped by the database, using the index on ticket.date
+    tickets = Ticket.query.filter(Ticket.date >= datetime.date.today()).all()
     return tickets
 
-def register_ticket(owner, name, quantity, price, date):
-    """Register the ticket in the database
-    :param owner: The user selling the ticket
-    :param name: the name of the ticket
-    :param quantity: quantity available of the ticket
-    :param price: the price of each ticket
-    :param date: the date for ticket use
-    :return: an error message if there is any, or None if action succeeds."""
+# columns the ticket listing can be sorted by, every one of them is indexed
+TICKET_SORTS = {
+    'id': Ticket.id,
+    'name': Ticket.name,
+    'price': Ticket.price,
+    'date': Ticket.date,
+}
 
-    new_ticket = Ticket(owner=owner, name=name, quantity=quantity, price=price, date=date)
+def encode_cursor(ticket, sort='id'):
+    """Make the cursor of the page that follows a ticket
+    :param ticket: the last ticket of a page
+    :param sort: name of the column the tickets are sorted by, one of TICKET_SORTS
+    :return: the cursor, safe to put in a URL as it is
+    """
+    value = getattr(ticket, sort)
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    # the sort value travels with the id, so the next page does not depend
+    # on the ticket still being there
+    return base64.urlsafe_b64encode(json.dumps([value, ticket.id]).encode()).decode().rstrip('=')
 
-    db.session.add(new_ticket)
-    db.session.commit()
+def decode_cursor(cursor, sort='id'):
+    """Read a cursor made by encode_cursor
+    :param cursor: the cursor
+    :param sort: name of the column the tickets are sorted by, one of TICKET_SORTS
+    :return: tuple of (sort value, ticket id) of the last ticket of the previous page
+    :raise ValueError: if the cursor was not made for this sort
+    """
+    try:
+        value, ticket_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+        python_type = TICKET_SORTS[sort].type.python_type
+        if python_type is datetime.date:
+            value = datetime.date.fromisoformat(value)
+        if type(value) is not python_type or type(ticket_id) is not int:
+            raise ValueError(cursor)
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Invalid ticket cursor: %s' % cursor)
+    return value, ticket_id
+
+def get_tickets_page_statement(after=None, limit=20, sort='id'):
+    """Build the select of one page of tickets using keyset (cursor) pagination
+    :param after: cursor of the previous page, or None for the first page
+    :param limit: maximum number of tickets on the page
+    :param sort: name of the column to sort by, one of TICKET_SORTS
+    :return: select of the ticket rows of the page, and of one more if there is a next page
+    :raise ValueError: if the sort is unknown or the cursor invalid
+    """
+    if sort not in TICKET_SORTS:
+        raise ValueError('Unknown ticket sort: %s' % sort)
+    column = TICKET_SORTS[sort]
+
+    statement = db.select([Ticket.__table__]).where(Ticket.date >= datetime.date.today())
+    if after is not None:
+        # seek past the last ticket of the previous page instead of using OFFSET,
+        # so every page costs one index range scan no matter how deep it is
+        value, after_id = decode_cursor(after, sort)
+        if column is Ticket.id:
+            statement = statement.where(Ticket.id > after_id)
+        else:
+            statement = statement.where(db.or_(column > value,
+                                               db.and_(column == value, Ticket.id > after_id)))
+
+    # ticket id breaks ties so the order is total and no row is skipped or repeated
+    order = [column, Ticket.id] if column is not Ticket.id else [Ticket.id]
+    # one extra row tells whether there is a next page
+    return statement.order_by(*order).limit(limit + 1)
+
+def split_tickets_page(tickets, limit, sort='id'):
+    """Split the tickets read with get_tickets_page_statement into the page and the next cursor
+    :param tickets: the tickets read, one more than limit if there is a next page
+    :param limit: maximum number of tickets on the page
+    :param sort: name of the column the tickets are sorted by
+    :return: tuple of (list of ticket instances, cursor for the next page or None)
+    """
+    if len(tickets) > limit:
+        return tickets[:limit], encode_cursor(tickets[limit - 1], sort)
+    return tickets, None
+
+@read_only
+def get_tickets_page(after=None, limit=20, sort='id'):
+    """Get one page of tickets using keyset (cursor) pagination
+    :param after: cursor of the previous page, or None for the first page
+    :param limit: maximum number of tickets on the page
+    :param sort: name of the column to sort by, one of TICKET_SORTS
+    :return: tuple of (list of ticket instances, cursor for the next page or None)
+    :raise ValueError: if the sort is unknown or the cursor invalid
+    """
+    statement = get_tickets_page_statement(after, limit, sort)
+    return split_tickets_page(Ticket.query.from_statement(statement).all(), limit, sort)
+
+@read_only
+def iter_tickets(sort='id', batch_size=500):
+    """Get all available tickets as a stream, for listings too large to load at once
+    :param sort: name of the column to sort by, one of TICKET_SORTS
+    :param batch_size: number of rows fetched from the database at a time
+    :return: iterator of ticket rows with name, price, quantity, email and date
+    """
+    if sort not in TICKET_SORTS:
+        raise ValueError('Unknown ticket sort: %s' % sort)
+    column = TICKET_SORTS[sort]
+    order = [column, Ticket.id] if column is not Ticket.id else [Ticket.id]
+
+    # plain rows, not ticket instances: nothing is kept in the session, and
+    # yield_per reads them from a server-side cursor batch by batch, so the
+    # memory used does not grow with the number of tickets
+    query = db.session.query(Ticket.id, Ticket.name, Ticket.price, Ticket.quantity, Ticket.email, Ticket.date) \
+        .filter(Ticket.date >= datetime.date.today()).order_by(*order).yield_per(batch_size)
+    # iter() runs the query here, while read-only, the rows come as they are read
+    return iter(query)
+
+def get_search_statement(query, page, per_page, dialect):
+    """Build the SQL that searches the tickets that have not expired by name
+    :param query: the words to search for, the last word also matches as a prefix
+    :param page: the page of results, starting at 1
+    :param per_page: the number of tickets on a page
+    :param dialect: name of the database dialect, e.g. 'sqlite'
+    :return: tuple of (SQL selecting one more ticket than per_page, its parameters),
+        or None if nothing can match
+    """
+    words = re.findall(r'\w+', query or '')
+    if not words or page < 1:
+        return None
+    params = {'today': datetime.date.today(), 'limit': per_page + 1,
+              'offset': (page - 1) * per_page}
+
+    if dialect == 'sqlite':
+        # every word must match, quoted so user input is never FTS5 syntax
+        params['match'] = ' '.join('"%s"' % word for word in words) + '*'
+        sql = ("SELECT ticket.* FROM ticket_fts JOIN ticket ON ticket.id = ticket_fts.rowid"
+               " WHERE ticket_fts MATCH :match AND ticket.date >= :today"
+               " ORDER BY ticket_fts.rank, ticket.id LIMIT :limit OFFSET :offset")
+    elif dialect == 'mysql':
+        params['match'] = ' '.join('+' + word for word in words) + '*'
+        sql = ("SELECT * FROM ticket"
+               " WHERE MATCH (name) AGAINST (:match IN BOOLEAN MODE) AND date >= :today"
+               " ORDER BY MATCH (name) AGAINST (:match IN BOOLEAN MODE) DESC, id"
+               " LIMIT :limit OFFSET :offset")
+    else:
+        params['match'] = '%' + '%'.join(words) + '%'
+        sql = ("SELECT * FROM ticket WHERE name LIKE :match AND date >= :today"
+               " ORDER BY name, id LIMIT :limit OFFSET :offset")
+    return sql, params
+
+@read_only
+def search_tickets(query, page=1, per_page=20):
+    """Search the tickets that have not expired by name, best matches first
+    :param query: the words to search for, the last word also matches as a prefix
+    :param page: the page of results, starting at 1
+    :param per_page: the number of tickets on a page
+    :return: tuple of (list of ticket instances, number of the next page or None)
+    """
+    statement = get_search_statement(query, page, per_page, db.engine.dialect.name)
+    if statement is None:
+        return [], None
+    sql, params = statement
+    tickets = Ticket.query.from_statement(db.text(sql)).params(**params).all()
+    if len(tickets) > per_page:
+        return tickets[:per_page], page + 1
+    return tickets, None
 
-    return new_ticket
 """
 def get_buy_form(name,quantity):
     buy_form = Form(name=name,quantity=quantity)
@@ -114,8 +538,239 @@ def sell_ticket(name, quantity, price, date, email):
     ticket.name = name
     ticket.quantity = quantity
     ticket.price = price
-    ticket.date = date
+    ticket.date = parse_ticket_date(date)
     ticket.email = email
     db.session.add(ticket)
     db.session.commit()
-    return None
\ No newline at end of file
+    state = get_state()
+    if state['ticket_names'] is not None:
+        state['ticket_names'].add(name)
+    state['inventory_version'].bump()
+    return None
+
+def update_ticket(ticket, quantity, price, date):
+    """
+    Update the quantity, price and expiry date of a ticket
+    :param ticket: the ticket to be updated
+    :param quantity: the new amount of tickets for sale
+    :param price: the new price of the ticket
+    :param date: the new expiry date of the ticket
+    :return: an error message if there is any, or None if the update succeeds
+    """
+    ticket.quantity = quantity
+    ticket.price = price
+    ticket.date = parse_ticket_date(date)
+    db.session.commit()
+    get_state()['inventory_version'].bump()
+    return None
+
+# every new user starts with $5000
+OPENING_BALANCE_CENTS = 500000
+# service fee (35%) and tax (5%) the buyer pays on top of the ticket price, in percent
+SERVICE_FEE_PERCENT = 135
+TAX_PERCENT = 105
+# how many times a purchase is retried when the database reports a lock conflict
+PURCHASE_ATTEMPTS = 3
+
+def price_cents(price):
+    """
+    Convert a ticket price in dollars to integer cents
+    :param price: the price of one ticket
+    :return: the price in cents
+    """
+    return int(round(price * 100))
+
+def purchase_cost_cents(price, quantity):
+    """
+    Get the amount a buyer pays for tickets, fees and tax included
+    :param price: the price of one ticket in dollars
+    :param quantity: the amount of tickets bought
+    :return: the total cost of the purchase in cents, rounded half up
+    """
+    return (price_cents(price) * quantity * SERVICE_FEE_PERCENT * TAX_PERCENT + 5000) // 10000
+
+def post_ledger_entry(user_id, txn_id, kind, amount_cents, require_funds=False):
+    """
+    Append a ledger entry and apply it to the user's materialized balance.
+    Does not commit: the caller commits both together with the rest of
+    its transaction.
+    :param user_id: id of the user the money belongs to
+    :param txn_id: id of the transaction, shared by all of its entries
+    :param kind: what the money movement is for
+    :param amount_cents: positive to credit the user, negative to debit
+    :param require_funds: only debit if the balance covers the amount
+    :return: True if the entry was posted, False if the user is missing or lacks funds
+    """
+    update = (User.__table__.update()
+              .where(User.id == user_id)
+              .values(balance_cents=User.balance_cents + amount_cents,
+                      balance_version=User.balance_version + 1,
+                      balance_updated=datetime.datetime.utcnow()))
+    if require_funds:
+        update = update.where(User.balance_cents >= -amount_cents)
+    if db.session.execute(update).rowcount != 1:
+        return False
+    db.session.execute(LedgerEntry.__table__.insert().values(
+        user_id=user_id, txn_id=txn_id, kind=kind, amount_cents=amount_cents,
+        created=datetime.datetime.utcnow()))
+    return True
+
+@read_only
+def get_ledger(user):
+    """
+    Get the ledger entries of a user, newest first
+    :param user: the user
+    :return: list of ledger entry instances
+    """
+    return (LedgerEntry.query.filter_by(user_id=user.id)
+            .order_by(LedgerEntry.id.desc()).all())
+
+def reconcile_balances():
+    """
+    Compare every materialized balance with the sum of the user's ledger
+    entries, in a single aggregate query
+    :return: list of (user id, balance in cents, ledger sum in cents) that do not match
+    """
+    ledger_sum = db.func.coalesce(db.func.sum(LedgerEntry.amount_cents), 0)
+    rows = (db.session.query(User.id, User.balance_cents, ledger_sum)
+            .outerjoin(LedgerEntry, LedgerEntry.user_id == User.id)
+            .group_by(User.id, User.balance_cents)
+            .having(User.balance_cents != ledger_sum)
+            .all())
+    return [tuple(row) for row in rows]
+
+def buy_ticket(buyer, ticket, quantity):
+    """
+    Buy tickets in a single database transaction. The inventory is
+    decremented with a conditional UPDATE (... WHERE quantity >= n AND
+    price = p AND date >= today), the buyer is debited only if the balance
+    covers the cost and the seller is credited, each money movement going
+    through the ledger, so concurrent purchases can neither oversell a
+    ticket nor lose a balance update, and no one pays a price the seller
+    changed in the meantime or buys an expired ticket.
+    :param buyer: the user buying the tickets
+    :param ticket: the ticket being bought
+    :param quantity: the amount of tickets to buy
+    :return: an error message if there is any, or None if the purchase succeeds
+    """
+    buyer_id, buyer_email, ticket_id, seller_email = buyer.id, buyer.email, ticket.id, ticket.email
+    # the ticket was loaded before the transaction: the UPDATE only sells
+    # it if it still has the price the cost is computed from
+    price = ticket.price
+    cost = purchase_cost_cents(price, quantity)
+    proceeds = price_cents(price) * quantity
+    today = datetime.date.today()
+
+    for attempt in range(PURCHASE_ATTEMPTS):
+        try:
+            sold = db.session.execute(
+                Ticket.__table__.update()
+                .where(Ticket.id == ticket_id)
+                .where(Ticket.quantity >= quantity)
+                .where(Ticket.price == price)
+                .where(Ticket.date >= today)
+                .values(quantity=Ticket.quantity - quantity))
+            if sold.rowcount != 1:
+                current = db.session.query(Ticket.price, Ticket.date).filter_by(id=ticket_id).first()
+                db.session.rollback()
+                if current is None:
+                    return "Ticket does not exist"
+                if current.date < today:
+                    return "Ticket has expired"
+                if current.price != price:
+                    return "Ticket price changed, please try again"
+                return "Requested quantity larger than available tickets"
+
+            # the debit and the credit share a prefix but not their ids, a
+            # ledger transaction has at most one entry per user and the
+            # buyer may be the seller
+            txn_id = uuid.uuid4().hex[:30]
+            if not post_ledger_entry(buyer_id, txn_id + '-p', 'purchase', -cost, require_funds=True):
+                db.session.rollback()
+                return "User balance not enough for purchase"
+
+            seller_id = db.session.query(User.id).filter_by(email=seller_email).scalar()
+            if seller_id is not None:
+                post_ledger_entry(seller_id, txn_id + '-s', 'sale', proceeds)
+            record_purchase(buyer_id, ticket, quantity, txn_id + '-p')
+            db.session.commit()
+            # both balances changed
+            invalidate_user(buyer_email)
+            invalidate_user(seller_email)
+            get_state()['inventory_version'].bump()
+            return None
+        except OperationalError:
+            # lock timeout or deadlock: nothing was applied, so try again
+            db.session.rollback()
+            if attempt == PURCHASE_ATTEMPTS - 1:
+                raise
+
+def record_purchase(buyer_id, ticket, quantity, txn_id):
+    """
+    Add bought tickets to the buyer's holdings. Does not commit: it is
+    part of the purchase transaction.
+    :param buyer_id: id of the user who bought the tickets
+    :param ticket: the ticket that was bought
+    :param quantity: the amount of tickets bought
+    :param txn_id: id of the ledger transaction that paid for the tickets
+    """
+    db.session.execute(Holding.__table__.insert().values(
+        buyer_id=buyer_id, ticket_id=ticket.id, name=ticket.name, quantity=quantity,
+        price_cents=price_cents(ticket.price), date=ticket.date, txn_id=txn_id,
+        created=datetime.datetime.utcnow()))
+
+@read_only
+def get_user_holdings(user):
+    """
+    Get the tickets a user bought, newest purchase first
+    :param user: the user
+    :return: list of holding instances
+    """
+    # holding.buyer_id is indexed, so this is an index lookup
+    return (Holding.query.filter_by(buyer_id=user.id)
+            .order_by(Holding.id.desc()).all())
+
+def archive_expired_tickets(batch_size=500, pause=0, today=None):
+    """
+    Move tickets past their expiration date from the ticket table to the
+    archive table. Tickets are moved in batches of at most batch_size,
+    each in its own short transaction, so the job never holds locks on
+    the ticket table for long.
+    :param batch_size: the maximum number of tickets moved per transaction
+    :param pause: seconds to wait between batches, to leave room for other writers
+    :param today: tickets that expired before this date are archived, defaults to today
+    :return: the number of tickets archived
+    """
+    today = today or datetime.date.today()
+    columns = ['id', 'email', 'name', 'quantity', 'price', 'date']
+    archived = 0
+    while True:
+        # ticket.date is indexed, so finding a batch does not scan the table
+        ids = [row.id for row in db.session.query(Ticket.id)
+               .filter(Ticket.date < today).order_by(Ticket.id).limit(batch_size)]
+        if not ids:
+            return archived
+        rows = db.select([getattr(Ticket, column) for column in columns]
+                         + [db.literal(datetime.datetime.utcnow())]).where(Ticket.id.in_(ids))
+        db.session.execute(ArchivedTicket.__table__.insert().from_select(columns + ['archived'], rows))
+        db.session.execute(Ticket.__table__.delete().where(Ticket.id.in_(ids)))
+        db.session.commit()
+        get_state()['inventory_version'].bump()
+        archived += len(ids)
+        if pause:
+            time.sleep(pause)
+
+@read_only
+def get_archived_tickets(email=None, since=None):
+    """
+    Get archived tickets for reporting
+    :param email: only the tickets of this seller, or all sellers if None
+    :param since: only the tickets that expired on or after this date
+    :return: list of archived ticket instances, by expiration date
+    """
+    query = ArchivedTicket.query
+    if email is not None:
+        query = query.filter_by(email=email)
+    if since is not None:
+        query = query.filter(ArchivedTicket.date >= since)
+    return query.order_by(ArchivedTicket.date, ArchivedTicket.id).all()
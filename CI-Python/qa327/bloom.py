@@ -0,0 +1,198 @@
+import hashlib
+import math
+import threading
+import time
+
+"""
+This file defines the Bloom filter the backend keeps of the listed
+ticket names, so lookups of names that were never listed are answered
+without a query
+"""
+
+
+class BloomFilter(object):
+    """
+    A set that can only tell for sure that a value is NOT in it: a
+    value that was added is always found, a value that was not added
+    is found with probability error_rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        :param capacity: the number of values it is sized for, more values raise the error rate
+        :param error_rate: the false positive rate at capacity
+        """
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # double hashing: the k positions are h1 + i * h2
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self._bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class NameFilter(object):
+    """
+    A Bloom filter of the names in a table, kept up to date with the
+    rows added since it was built.
+
+    Rows are loaded by id: the filter remembers the highest id it has
+    seen and loads the rows above it (less an overlap, for inserts that
+    commit out of id order) when the data version changes, or when
+    refresh_after seconds passed, which bounds how late rows added by
+    other processes are seen. Names are never removed, a deleted name
+    is just one more false positive.
+
+    The rows are read without holding the lock of the filter, one
+    thread at a time: lookups that do not need a refresh never wait for
+    the database.
+    """
+
+    # rows below the highest id seen that are loaded again on a refresh
+    OVERLAP = 100
+
+    def __init__(self, load, capacity=100000, error_rate=0.01, refresh_after=1.0):
+        """
+        :param load: function(after_id) returning (id, name) pairs of the rows with a larger id
+        :param capacity: the number of names the first filter is sized for, it grows as needed
+        :param error_rate: the false positive rate at capacity
+        :param refresh_after: seconds after which the table is checked for new rows anyway
+        """
+        self.load = load
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_after = refresh_after
+        self.refreshes = 0
+        self.rejected = 0
+        self._filter = None
+        self._last_id = 0
+        self._version = None
+        self._checked = 0
+        # names added while a new filter is built, added to it once it is done
+        self._added = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @staticmethod
+    def key(name):
+        # MySQL compares names without case and trailing spaces, so the
+        # filter does too: it may only ever answer "maybe" too often
+        return str(name).lower().rstrip(' ')
+
+    def _stale(self, version):
+        return (self._filter is None or version != self._version
+                or time.monotonic() - self._checked > self.refresh_after)
+
+    def _build(self):
+        # the new filter is only seen by this thread until it is swapped in
+        with self._lock:
+            self._added = []
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        last_id = 0
+        for row_id, name in self.load(0):
+            bloom.add(self.key(name))
+            last_id = max(last_id, row_id)
+        with self._lock:
+            for key in self._added:
+                bloom.add(key)
+            self._added = None
+            self._filter = bloom
+            self._last_id = last_id
+
+    def _refresh(self, version):
+        # called with _refresh_lock held
+        if self._filter is None:
+            self._build()
+        else:
+            after_id = max(self._last_id - self.OVERLAP, 0) if self._last_id else 0
+            rows = list(self.load(after_id))
+            with self._lock:
+                for row_id, name in rows:
+                    key = self.key(name)
+                    # rows of the overlap were mostly seen already
+                    if key not in self._filter:
+                        self._filter.add(key)
+                    self._last_id = max(self._last_id, row_id)
+        if self._filter.count > self._filter.capacity:
+            # past capacity, the error rate climbs: rebuild with room to grow.
+            # The old filter answers the lookups until the new one is ready
+            self.capacity = self._filter.count * 2
+            self._build()
+        self._version = version
+        self._checked = time.monotonic()
+        self.refreshes += 1
+
+    def refresh(self, version):
+        """
+        Load the rows added since the last refresh, or build the filter
+        from the whole table if it was not built yet
+        :param version: the current version of the data
+        """
+        with self._refresh_lock:
+            self._refresh(version)
+
+    def add(self, name):
+        """
+        Add a name right away, e.g. after it was inserted by this process
+        """
+        key = self.key(name)
+        with self._lock:
+            if self._filter is not None and key not in self._filter:
+                self._filter.add(key)
+            if self._added is not None:
+                self._added.append(key)
+
+    def might_exist(self, name, version):
+        """
+        :param name: the name looked up
+        :param version: the current version of the data
+        :return: False if the name is certainly not in the table
+        """
+        if self._stale(version):
+            with self._refresh_lock:
+                # another thread may have refreshed it while this one waited
+                if self._stale(version):
+                    self._refresh(version)
+        key = self.key(name)
+        with self._lock:
+            # dropped by rebuild() since the check: no answer but maybe
+            found = self._filter is None or key in self._filter
+        if not found:
+            self.rejected += 1
+        return found
+
+    def rebuild(self):
+        """
+        Drop the filter, it is built again from the whole table at the next lookup
+        """
+        with self._refresh_lock, self._lock:
+            self._filter = None
+            self._last_id = 0
+
+    def stats(self):
+        """
+        :return: dict with the size of the filter and how many lookups it answered
+        """
+        with self._lock:
+            bloom = self._filter
+            return {'names': bloom.count if bloom else 0, 'capacity': self.capacity,
+                    'bits': bloom.size if bloom else 0, 'hashes': bloom.hashes if bloom else 0,
+                    'refreshes': self.refreshes, 'rejected': self.rejected}
@@ -0,0 +1,394 @@
+import collections
+import contextlib
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:     # not a POSIX system, only the in-process caches work
+    fcntl = None
+
+"""
+This file defines the caches used by the backend: in-process caches,
+and caches in a memory mapped file shared by all the workers of a host
+"""
+
+
+class TTLCache(object):
+    """
+    A bounded, thread-safe LRU cache whose entries expire ttl seconds
+    after they were stored. It counts hits and misses.
+    """
+
+    def __init__(self, maxsize, ttl):
+        """
+        :param maxsize: the maximum number of entries, the least recently used is evicted first
+        :param ttl: seconds an entry stays valid
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()   # key -> (expiry time, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the cached value, or None if the key is missing or expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: dict with the size, hit and miss counters of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class VersionCounter(object):
+    """
+    A counter bumped whenever the data it versions changes. Anything
+    cached under an older version is out of date.
+
+    Each counter lives in one process. Its epoch tells counters of
+    different processes apart, so equal values from two processes
+    never pass for the same version.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+        self.epoch = uuid.uuid4().hex[:8]
+        self.modified = time.time()     # when the data last changed, as far as this counter knows
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def tag(self):
+        """
+        :return: a string that identifies the current version across processes
+        """
+        return '%s-%d' % (self.epoch, self._value)
+
+    def bump(self):
+        """
+        :return: the new version
+        """
+        with self._lock:
+            self._value += 1
+            self.modified = time.time()
+            return self._value
+
+
+class SharedMemory(object):
+    """
+    A file mapped in memory by every worker process that opens it. It
+    holds a table of named version counters and fixed size cache slots.
+    The file is locked while it is read or written, so all the workers
+    always see the same data.
+
+    Values are pickled, the file must only be writable by the service.
+    """
+
+    MAGIC = b'QA327SC1'
+    HEADER = struct.Struct('<8sII8sQ')      # magic, slots, slot size, epoch, last write stamp
+    COUNTER = struct.Struct('<32sQd')       # name, value, modified
+    SLOT = struct.Struct('<16sdQI')         # key digest, expiry, write stamp, value length
+    COUNTERS = 64
+    WAYS = 4                                # slots a key can be stored in
+    DATA_OFFSET = 4096
+
+    def __init__(self, path, slots=4096, slot_size=16384):
+        """
+        :param path: the file, created if missing
+        :param slots: the number of cache slots, when the file is created
+        :param slot_size: the size of a slot in bytes, when the file is created
+        """
+        if fcntl is None:
+            raise RuntimeError('the shared cache needs a POSIX system')
+        self.path = path
+        self.slots = max(slots - slots % self.WAYS, self.WAYS)
+        self.slot_size = slot_size
+        self._pid = None
+        # taken by the threads of a forked worker that find the file opened
+        # by the parent process, so only one of them opens it again
+        self._reopen_lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        # every process maps the file itself: flock does not tell apart
+        # processes that share a file descriptor inherited over fork
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        self._counters = {}
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, self.HEADER.size, 0)
+            if len(header) == self.HEADER.size and header[:8] == self.MAGIC:
+                # the geometry of an existing file wins over the arguments
+                _, self.slots, self.slot_size, self.epoch, _ = self.HEADER.unpack(header)
+            else:
+                self.epoch = uuid.uuid4().hex[:8].encode()
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.DATA_OFFSET + self.slots * self.slot_size)
+                os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, self.slots, self.slot_size,
+                                                     self.epoch, 0), 0)
+            self._map = mmap.mmap(self._fd, self.DATA_OFFSET + self.slots * self.slot_size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.epoch = self.epoch.decode()
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive=False):
+        if self._pid != os.getpid():
+            with self._reopen_lock:
+                if self._pid != os.getpid():
+                    # forked since the file was opened: drop the inherited mapping
+                    # and descriptor, the parent process still has its own. The
+                    # pid is set last, other threads wait here until it is done
+                    self._map.close()
+                    os.close(self._fd)
+                    self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _counter_offset(self, name):
+        """
+        :return: the offset of the named counter, which is added to the
+            table if needed
+        """
+        offset = self._counters.get(name)
+        if offset is not None:
+            return offset
+        encoded = name.encode()[:32].ljust(32, b'\0')
+        with self._locked(exclusive=True) as memory:
+            for index in range(self.COUNTERS):
+                offset = self.HEADER.size + index * self.COUNTER.size
+                stored = memory[offset:offset + 32]
+                if stored == encoded:
+                    break
+                if stored == bytes(32):
+                    self.COUNTER.pack_into(memory, offset, encoded, 0, time.time())
+                    break
+            else:
+                raise RuntimeError('no room for counter %r in %s' % (name, self.path))
+        self._counters[name] = offset
+        return offset
+
+    def read_counter(self, name):
+        """
+        :return: tuple of (value, time of the last bump) of the named counter
+        """
+        offset = self._counter_offset(name)
+        with self._locked() as memory:
+            _, value, modified = self.COUNTER.unpack_from(memory, offset)
+        return value, modified
+
+    def bump_counter(self, name):
+        """
+        :return: the new value of the named counter
+        """
+        offset = self._counter_offset(name)
+        with self._locked(exclusive=True) as memory:
+            stored, value, _ = self.COUNTER.unpack_from(memory, offset)
+            self.COUNTER.pack_into(memory, offset, stored, value + 1, time.time())
+        return value + 1
+
+    def _slot_offsets(self, digest):
+        first = int.from_bytes(digest[:8], 'little') % (self.slots // self.WAYS) * self.WAYS
+        return [self.DATA_OFFSET + (first + way) * self.slot_size for way in range(self.WAYS)]
+
+    def get(self, digest):
+        """
+        :param digest: the 16 byte digest of the key
+        :return: the stored bytes, or None if the key is missing or expired
+        """
+        now = time.time()
+        with self._locked() as memory:
+            for offset in self._slot_offsets(digest):
+                stored, expiry, _, length = self.SLOT.unpack_from(memory, offset)
+                if stored == digest:
+                    if expiry < now:
+                        return None
+                    start = offset + self.SLOT.size
+                    return memory[start:start + length]
+        return None
+
+    def set(self, digest, data, ttl):
+        """
+        Store bytes under a key digest for ttl seconds, in place of the
+        same key, an empty or expired slot, or the oldest write
+        :return: False if the data does not fit in a slot
+        """
+        if len(data) > self.slot_size - self.SLOT.size:
+            return False
+        now = time.time()
+        with self._locked(exclusive=True) as memory:
+            target = None
+            best = None
+            for offset in self._slot_offsets(digest):
+                stored, expiry, stamp, _ = self.SLOT.unpack_from(memory, offset)
+                if stored == digest:
+                    target = offset
+                    break
+                # empty and expired slots first, then the oldest write
+                rank = 0 if expiry < now else stamp
+                if best is None or rank < best:
+                    target, best = offset, rank
+            magic, slots, slot_size, epoch, last_stamp = self.HEADER.unpack_from(memory, 0)
+            self.HEADER.pack_into(memory, 0, magic, slots, slot_size, epoch, last_stamp + 1)
+            start = target + self.SLOT.size
+            memory[start:start + len(data)] = data
+            self.SLOT.pack_into(memory, target, digest, now + ttl, last_stamp + 1, len(data))
+        return True
+
+    def delete(self, digest):
+        with self._locked(exclusive=True) as memory:
+            for offset in self._slot_offsets(digest):
+                if memory[offset:offset + 16] == digest:
+                    self.SLOT.pack_into(memory, offset, bytes(16), 0, 0, 0)
+
+    def clear(self):
+        """
+        Empty every cache slot, the counters are kept
+        """
+        empty = self.SLOT.pack(bytes(16), 0, 0, 0)
+        with self._locked(exclusive=True) as memory:
+            for slot in range(self.slots):
+                offset = self.DATA_OFFSET + slot * self.slot_size
+                memory[offset:offset + len(empty)] = empty
+
+
+class SharedCache(object):
+    """
+    A cache in a SharedMemory file, with the same interface as TTLCache.
+    Keys are any picklable values, namespaced so several caches can use
+    the same file. Values larger than a slot are not cached.
+    """
+
+    def __init__(self, memory, namespace, ttl):
+        """
+        :param memory: the SharedMemory to store the entries in
+        :param namespace: name that tells this cache's keys apart from other caches'
+        :param ttl: seconds an entry stays valid
+        """
+        self.memory = memory
+        self.namespace = namespace
+        self.ttl = ttl
+        # counted per process
+        self.hits = 0
+        self.misses = 0
+        self.too_large = 0
+
+    def _digest(self, key):
+        return hashlib.blake2b(pickle.dumps((self.namespace, key), protocol=4), digest_size=16).digest()
+
+    def get(self, key):
+        """
+        :return: the cached value, or None if the key is missing or expired
+        """
+        data = self.memory.get(self._digest(key))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        if not self.memory.set(self._digest(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                               self.ttl):
+            self.too_large += 1
+
+    def invalidate(self, key):
+        self.memory.delete(self._digest(key))
+
+    def clear(self):
+        """
+        Empty the whole shared file, the namespaces of all caches included
+        """
+        self.memory.clear()
+
+    def stats(self):
+        """
+        :return: dict with the geometry, hit and miss counters of the cache
+        """
+        lookups = self.hits + self.misses
+        return {'shared': True, 'maxsize': self.memory.slots, 'slot_size': self.memory.slot_size,
+                'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                'too_large': self.too_large, 'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class SharedVersionCounter(object):
+    """
+    A VersionCounter kept in a SharedMemory file: a bump in one worker
+    is seen by every worker at its next read, and all the workers share
+    the epoch of the file.
+    """
+
+    def __init__(self, memory, name):
+        self.memory = memory
+        self.name = name
+        self.epoch = memory.epoch
+
+    @property
+    def value(self):
+        return self.memory.read_counter(self.name)[0]
+
+    @property
+    def modified(self):
+        return self.memory.read_counter(self.name)[1]
+
+    @property
+    def tag(self):
+        """
+        :return: a string that identifies the current version across processes
+        """
+        return '%s-%d' % (self.epoch, self.value)
+
+    def bump(self):
+        """
+        :return: the new version
+        """
+        return self.memory.bump_counter(self.name)
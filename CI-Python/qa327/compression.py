@@ -0,0 +1,282 @@
+import threading
+import time
+import zlib
+from werkzeug.http import parse_accept_header, quote_etag, unquote_etag
+
+try:
+    import brotli
+except ImportError:     # responses are only compressed with gzip
+    brotli = None
+
+"""
+This file defines the WSGI middleware that compresses the responses of
+the service with brotli or gzip, whichever the client prefers.
+
+Bodies smaller than min_size are sent as they are, compressing them
+costs more CPU than the bytes it saves. Streamed responses (without a
+Content-Length) are read until min_size bytes came, then compressed
+chunk by chunk, each chunk flushed so the client gets it right away.
+It counts the bytes in and out and the CPU time spent compressing, per
+encoding, so the ratio can be weighed against the cost.
+"""
+
+# the content types worth compressing, images and fonts mostly are already
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'image/svg+xml')
+
+
+class Compressor(object):
+    """
+    Compresses one response, in chunks
+    """
+
+    def __init__(self, encoding, gzip_level, brotli_quality):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: the gzip format
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        """
+        :param data: the next part of the body
+        :param flush: send out everything so far, e.g. for a streamed response
+        :return: the compressed bytes ready
+        """
+        if self.encoding == 'br':
+            output = self._brotli.process(data)
+            return output + self._brotli.flush() if flush else output
+        output = self._zlib.compress(data)
+        return output + self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self):
+        """
+        :return: the end of the compressed body
+        """
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+class CompressionMiddleware(object):
+    """
+    Compresses the responses of a WSGI application
+    """
+
+    def __init__(self, app, min_size=1024, gzip_level=6, brotli_quality=4):
+        """
+        :param app: the WSGI application
+        :param min_size: the smallest body compressed, in bytes
+        :param gzip_level: zlib compression level, 1 (fast) to 9 (small)
+        :param brotli_quality: brotli quality, 0 (fast) to 11 (small)
+        """
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        self._lock = threading.Lock()
+        self._compressed = dict((encoding, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0})
+                                for encoding in self.encodings)
+        self._skipped = {'not_accepted': 0, 'small': 0, 'type': 0, 'encoded': 0, 'status': 0}
+
+    def negotiate(self, accept_encoding):
+        """
+        :param accept_encoding: the Accept-Encoding header of the request
+        :return: the encoding to compress with, or None
+        """
+        if not accept_encoding:
+            return None
+        return parse_accept_header(accept_encoding).best_match(self.encodings)
+
+    def skip_reason(self, status, headers):
+        """
+        :param status: the status code of the response
+        :param headers: its headers, as (name, value) pairs
+        :return: why the response is sent as it is, or None to compress it
+        """
+        if status < 200 or status in (204, 206, 304):
+            return 'status'
+        content_type = ''
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-encoding' or (name == 'cache-control' and 'no-transform' in value):
+                return 'encoded'
+            if name == 'content-type':
+                content_type = value.lower()
+            if name == 'content-length' and int(value) < self.min_size:
+                return 'small'
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return 'type'
+        return None
+
+    def vary_headers(self, headers):
+        """
+        Add Accept-Encoding to the Vary header of a response of a type that
+        is compressed, whether this one was or not: a shared cache must not
+        give the body sent for one Accept-Encoding to a client that sent another
+        :param headers: the headers, as (name, value) pairs
+        :return: the headers to send
+        """
+        content_type = ''
+        vary = []
+        others = []
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-type':
+                content_type = value.lower()
+            if lower == 'vary':
+                vary.extend(field.strip() for field in value.split(',') if field.strip())
+            else:
+                others.append((name, value))
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return headers
+        if '*' in vary or 'accept-encoding' in [field.lower() for field in vary]:
+            return headers
+        return others + [('Vary', ', '.join(vary + ['Accept-Encoding']))]
+
+    def compressed_headers(self, headers, encoding):
+        """
+        :return: the headers of the response once compressed
+        """
+        compressed = []
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag':
+                # the compressed body is not the same bytes: a weak ETag still
+                # matches If-None-Match, so conditional requests keep working
+                etag, weak = unquote_etag(value)
+                value = quote_etag(etag, weak=True)
+            compressed.append((name, value))
+        compressed.append(('Content-Encoding', encoding))
+        return self.vary_headers(compressed)
+
+    def count_skipped(self, reason):
+        with self._lock:
+            self._skipped[reason] += 1
+
+    def count(self, encoding, bytes_in, bytes_out, cpu_seconds):
+        with self._lock:
+            stats = self._compressed[encoding]
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['cpu_seconds'] += cpu_seconds
+
+    def compress_body(self, status, headers, body, accept_encoding):
+        """
+        Compress a whole response body, e.g. one made without WSGI
+        :param status: the status code
+        :param headers: the headers, as (name, value) pairs
+        :param body: the body
+        :param accept_encoding: the Accept-Encoding header of the request
+        :return: tuple of (headers without Content-Length, body) to send
+        """
+        encoding = self.negotiate(accept_encoding)
+        if encoding is None:
+            self.count_skipped('not_accepted')
+            return self.vary_headers(headers), body
+        reason = self.skip_reason(status, headers) or ('small' if len(body) < self.min_size else None)
+        if reason is not None:
+            self.count_skipped(reason)
+            return self.vary_headers(headers), body
+        start = time.thread_time()
+        compressor = Compressor(encoding, self.gzip_level, self.brotli_quality)
+        compressed = compressor.compress(body) + compressor.finish()
+        with self._lock:
+            self._compressed[encoding]['responses'] += 1
+        self.count(encoding, len(body), len(compressed), time.thread_time() - start)
+        return self.compressed_headers(headers, encoding), compressed
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None or environ['REQUEST_METHOD'] == 'HEAD':
+            self.count_skipped('not_accepted')
+
+            def vary(status, headers, exc_info=None):
+                return start_response(status, self.vary_headers(headers), exc_info)
+            return self.app(environ, vary)
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = status
+            response['headers'] = headers
+            return lambda data: response.setdefault('written', []).append(data)
+
+        return self.respond(self.app(environ, capture), response, encoding, start_response)
+
+    def respond(self, iterable, response, encoding, start_response):
+        try:
+            chunks = iter(iterable)
+            # the app starts the response at the latest with its first chunk
+            first = next(chunks, None)
+            buffered = response.pop('written', []) + ([first] if first is not None else [])
+
+            status, headers = response['status'], response['headers']
+            reason = self.skip_reason(int(status.split(' ', 1)[0]), headers)
+            streamed = not any(name.lower() == 'content-length' for name, _ in headers)
+            if reason is None and streamed:
+                # read a streamed body until it is worth compressing
+                size = sum(len(chunk) for chunk in buffered)
+                while size < self.min_size:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        reason = 'small'
+                        break
+                    buffered.append(chunk)
+                    size += len(chunk)
+            response['started'] = True
+
+            if reason is not None:
+                self.count_skipped(reason)
+                start_response(status, self.vary_headers(headers))
+                for chunk in buffered:
+                    yield chunk
+                for chunk in chunks:
+                    for written in response.pop('written', []):
+                        yield written
+                    yield chunk
+                for written in response.pop('written', []):
+                    yield written
+                return
+
+            start_response(status, self.compressed_headers(headers, encoding))
+            with self._lock:
+                self._compressed[encoding]['responses'] += 1
+            compressor = Compressor(encoding, self.gzip_level, self.brotli_quality)
+            pending = buffered
+            while pending:
+                for chunk in pending:
+                    if chunk:
+                        start = time.thread_time()
+                        output = compressor.compress(chunk, flush=streamed)
+                        self.count(encoding, len(chunk), len(output), time.thread_time() - start)
+                        if output:
+                            yield output
+                chunk = next(chunks, None)
+                pending = response.pop('written', []) + ([chunk] if chunk is not None else [])
+            start = time.thread_time()
+            output = compressor.finish()
+            self.count(encoding, 0, len(output), time.thread_time() - start)
+            yield output
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def stats(self):
+        """
+        :return: dict with, per encoding, the bytes in and out, the ratio and
+            the CPU time spent, and the responses not compressed by reason
+        """
+        with self._lock:
+            encodings = {}
+            for encoding, stats in self._compressed.items():
+                encodings[encoding] = dict(stats)
+                encodings[encoding]['ratio'] = stats['bytes_out'] / stats['bytes_in'] if stats['bytes_in'] else None
+                encodings[encoding]['cpu_ms_per_mb'] = (stats['cpu_seconds'] * 1000 / (stats['bytes_in'] / 1e6)
+                                                        if stats['bytes_in'] else None)
+            return {'min_size': self.min_size, 'encodings': encodings, 'skipped': dict(self._skipped)}
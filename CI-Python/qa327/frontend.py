@@ -1,7 +1,15 @@
-from flask import render_template, request, session, redirect, url_for
-from qa327 import app
+from flask import Blueprint, current_app, render_template, request, session, redirect, url_for, jsonify, abort, \
+    make_response, send_from_directory, stream_with_context
+from markupsafe import Markup
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+from qa327 import validation
+from qa327.assets import Assets, STATIC_DIR
+from qa327.ratelimit import TokenBucketLimiter
 import qa327.backend as bn
-import re
+import datetime
+import hashlib
+import math
+import mimetypes
 
 
 
@@ -12,114 +20,232 @@ http requests from the client (browser) through templating.
 The html templates are stored in the 'templates' folder. 
 """
 
+# the pages of the service, registered on the app by qa327.create_app()
+bp = Blueprint('frontend', __name__)
 
-@app.route('/register', methods=['GET'])
-def register_get():
-    # templates are stored in the templates folder
-    return render_template('register.html', message='Register')
+# number of tickets shown on one page of the ticket listing
+TICKETS_PER_PAGE = 20
 
+# shown when too many passwords are waiting to be hashed
+BUSY_MESSAGE = "Too many requests, please try again later"
 
-''' This function is used to check if the password formatting is correct.
-Password needs to have at least: 1 uppercase char, 1 lowercase char,
-and special char (special chars defined below)
-Input: string variable password
-Output: string error message'''
-def check_special_pass(password):
-
-    specialChar = "!@#$%^&*()_-+=/"
-
-    special = False
-    upper = False
-    lower = False
-    for i in range(len(password)):
-        if password[i].isupper():
-            upper = True
-        if password[i].islower():
-            lower = True
-        if any(password[i] in word for word in specialChar):
-            special = True
-    if not upper or not lower or not special or (len(password) < 6):
-        return False
-    else:
-        return True
+# shown when a client or an email made too many login or register attempts
+RATE_LIMIT_MESSAGE = "Too many attempts, please try again later"
 
 
-''' This function is used to check that the email formatting is correct.
-We use a regular expression to make sure that all the conditions of 
-a regular email address is met. Length of email is also checked.
-Input: string variable email
-Output: string error message'''
-def check_email_format(email):
+def make_limiter(per_minute):
+    """
+    :param per_minute: attempts allowed per minute, also allowed at once
+    :return: a token bucket limiter, or None for no limit
+    """
+    if per_minute <= 0:
+        return None
+    return TokenBucketLimiter(per_minute / 60, per_minute)
 
-    regex = '^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$'
 
-    if not re.search(regex, email) or len(email) < 3:  # email must be in RFC5322 format
-        return False
-    else:
-        return True
+def client_address():
+    """
+    :return: the IP address of the client, as seen by the proxy in front
+        of the service if RATE_LIMIT_TRUST_PROXY is set
+    """
+    if current_app.config['RATE_LIMIT_TRUST_PROXY'] and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
 
 
-''' This function is used to check if there are spaces in the first or 
-last index of the word. 
-Input: string word 
-Output: boolean '''
-def check_spaces(word):
+def rate_limited(form):
+    """
+    Check the rate limits of a login or register attempt, before anything
+    else is done with it: a rejected attempt reaches neither the backend
+    nor the password hasher
+    :param form: the form submitted, 'login' or 'register'
+    :return: a 429 response if the client or the email made too many attempts, or None
+    """
+    address = client_address()
+    email = (request.form.get('email') or '').lower()
+    state = bn.get_state()
+    for limiter, key in ((state['ip_limiter'], (form, address)), (state['email_limiter'], (form, email))):
+        if limiter is not None and not limiter.allow(key):
+            response = make_response(render_template(form + '.html', message=RATE_LIMIT_MESSAGE), 429)
+            response.headers['Retry-After'] = str(max(1, int(math.ceil(limiter.retry_after(key)))))
+            return response
+    return None
 
-    if word[0] == " " or word[-1] == " ":
-        return False
-    else:
-        return True
+
+# seconds browsers keep a built asset, whose URL changes with its content
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+
+def init_app(app):
+    """
+    Set up from the config of an app, after the backend, and keep in its
+    state (see bn.get_state()):
+
+        ip_limiter, email_limiter   attempts at the login and register forms,
+                                    by client IP and by email, or None
+        fragment_cache              rendered pages of the ticket list, keyed by
+                                    inventory version, so they are reused until a
+                                    ticket is listed, bought, updated or archived
+        assets                      the CSS, JS, fonts and images of the pages,
+                                    built by python -m qa327 assets
+
+    :param app: the Flask application
+    """
+    state = bn.get_state(app)
+    state['ip_limiter'] = make_limiter(app.config['RATE_LIMIT_IP_PER_MINUTE'])
+    state['email_limiter'] = make_limiter(app.config['RATE_LIMIT_EMAIL_PER_MINUTE'])
+    state['fragment_cache'] = bn.make_cache(app, 'fragments', app.config['FRAGMENT_CACHE_SIZE'],
+                                            app.config['FRAGMENT_CACHE_TTL'])
+    state['assets'] = Assets(STATIC_DIR, app.config['ASSETS_BUILD_DIR'])
+
+    def asset_url(name):
+        """
+        Used by the templates to link an asset. Bound to the state of the
+        app, so pages also render without an app context
+        :param name: path of the asset under qa327/static, e.g. 'vendor/js/jquery.min.js'
+        :return: the URL of the asset
+        """
+        return state['assets'].url(name)
+    app.add_template_global(asset_url)
+
+
+def read_page_args(args):
+    """
+    Read which page of the ticket listing is asked for. Like an unknown
+    sort, a cursor that can't be read shows the first page
+    :param args: the arguments of the query string
+    :return: tuple of (cursor of the previous page or None, name of the column to sort by)
+    """
+    sort = args.get('sort', 'id')
+    if sort not in bn.TICKET_SORTS:
+        sort = 'id'
+    after = args.get('after')
+    if after is not None:
+        try:
+            bn.decode_cursor(after, sort)
+        except ValueError:
+            after = None
+    return after, sort
+
+
+def check_page(environ, user, after, sort, show_all=False, app=None):
+    """
+    Check a conditional GET of a page showing the tickets and a user's
+    balance. The page only changes with the tickets or the balance (and
+    holdings, which change with it), so clients that already have the
+    current version get an empty 304 response without any rendering
+    :param environ: the WSGI environ of the request
+    :param user: the user the page is for
+    :param after: cursor of the page of tickets shown
+    :param sort: name of the column the tickets are sorted by
+    :param show_all: whether all tickets are shown instead of one page
+    :param app: the Flask application, the current one by default
+    :return: tuple of (whether the page must be sent, its validator and cache headers)
+    """
+    tag, last_modified = bn.get_page_validators(user, app)
+    etag_key = '%s:%s:%s' % (tag, after, sort) if not show_all else '%s:all:%s' % (tag, sort)
+    etag = hashlib.sha1(etag_key.encode()).hexdigest()
+    # the page is personal, and must be revalidated on every use
+    headers = [('ETag', quote_etag(etag)), ('Last-Modified', http_date(last_modified)),
+               ('Cache-Control', 'private, no-cache')]
+    return is_resource_modified(environ, etag=etag, last_modified=last_modified), headers
+
+
+def ticket_list_key(after, sort, app=None):
+    """
+    :param after: cursor of the previous page, or None for the first page
+    :param sort: name of the column to sort by
+    :param app: the Flask application, the current one by default
+    :return: the key of a rendered page of the ticket list in the fragment cache
+    """
+    # read the version before the tickets: a fragment rendered while the
+    # inventory changes is stored under the old version and never reused.
+    # expiry is checked against today, so the date is part of the key too
+    return bn.get_inventory_version(app), datetime.date.today(), after, sort
 
 
-''' This function is used to check if the word passed is is only 
-alphanumeric (it can only contain letters, numbers or spaces).
-Input: string word
-Output: Boolean'''
-def check_alnum(word):
-    for char in range(len(word)):
-        if not (word[char].isalnum() or word[char].isspace()):
-            return False
-    return True
+def render_ticket_list(after=None, sort='id'):
+    """
+    Render one page of the available tickets, from the fragment cache
+    when the inventory did not change since it was rendered
+    :param after: cursor of the previous page, or None for the first page
+    :param sort: name of the column to sort by
+    :return: the rendered ticket list
+    """
+    key = ticket_list_key(after, sort)
+    fragment_cache = bn.get_state()['fragment_cache']
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        tickets, next_after = bn.get_tickets_page(after, TICKETS_PER_PAGE, sort)
+        fragment = Markup(render_template('ticket_list.html', tickets=tickets,
+                                          next_after=next_after, sort=sort))
+        fragment_cache.set(key, fragment)
+    return fragment
+
+
+def stream_template(template_name, **context):
+    """
+    Render a template as it is sent, instead of building the whole page
+    in memory first. The pieces are sent in chunks of STREAM_CHUNK_SIZE
+    bytes, so the client gets the top of the page while the rest renders
+    :param template_name: name of the template
+    :param context: the variables of the template
+    :return: iterator of the chunks of the page, to use as a response body
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+
+    def generate():
+        chunk, size = [], 0
+        for piece in template.generate(context):
+            chunk.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield ''.join(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield ''.join(chunk)
+
+    # the request context (and its database session) stays open until the
+    # last chunk is sent
+    return stream_with_context(generate())
+
+
+@bp.route('/register', methods=['GET'])
+def register_get():
+    # templates are stored in the templates folder
+    return render_template('register.html', message='Register')
 
 
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register_post():
+    response = rate_limited('register')
+    if response is not None:
+        return response
     email = request.form.get('email')
     name = request.form.get('name')
     password = request.form.get('password')
     password2 = request.form.get('password2')
     error_message = ""
 
-    # The passwords do not match
-    if password != password2:
-        return render_template('register.html', message="The passwords do not match")
-
-    # The email format and email length is wrong
-    if not check_email_format(email):
-        return render_template('register.html', message="Email format is incorrect")
-
-    # The password format is wrong
-    if not check_special_pass(password):
-        return render_template('register.html', message="Password format is incorrect")
-
-    # Name is less than 2 characters or longer than 20 character
-    if len(name) <= 2 or len(name) >= 20:
-        return render_template('register.html', message="Name length formatting error")
-
-    # Name has special char
-    if not check_alnum(name):
-        return render_template('register.html', message="Name contains special characters")
-
-    # Space error
-    if not check_spaces(name):
-        return render_template('register.html', message="Invalid spaces found in word")
+    # the passwords must match, the email and password must be well formed
+    # and the name 3 to 19 letters, digits or inner spaces
+    values, errors = validation.validate('register', request.form)
+    if errors:
+        return render_template('register.html', message=errors[0]['message'])
 
     # No errors, so no returns on function has been called, so no issue with validity of credentials
     user = bn.get_user(email)
-    if user:
-        error_message = "This email has already been used"  # changed error message to satisfy requirement
-    elif not bn.register_user(email, name, password, password2):  # new instance of user created
-        error_message = "Failed to store user info."
+    try:
+        if user:
+            error_message = "This email has already been used"  # changed error message to satisfy requirement
+        elif not bn.register_user(email, name, password, password2):  # new instance of user created
+            error_message = "Failed to store user info."
+    except bn.HasherBusy:
+        # too many passwords are waiting to be hashed, turn the request away
+        return render_template('register.html', message=BUSY_MESSAGE), 503
     # if there is any error messages when registering new user
     # at the backend, go back to the register page.
 
@@ -129,32 +255,34 @@ def register_post():
         return redirect('/login')
 
 
-@app.route('/login', methods=['GET'])
+@bp.route('/login', methods=['GET'])
 def login_get():
     return render_template('login.html', message='Please login')
 
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login_post():
+    response = rate_limited('login')
+    if response is not None:
+        return response
     email = request.form.get('email')
     password = request.form.get('password')
-    user = bn.login_user(email, password)
     """
     Validation for email/password. We must check for blank email or password, 
     invalid password, and invalid email
     """
-    if email == "" or password == "":
-        return render_template('login.html', message="Email/password cant be blank")
-
-    # "Email format is incorrect" should be error message
-    if not check_email_format(email):
-        return render_template('login.html', message="Email format is incorrect")
-
-    # Password format is wrong
-    if not check_special_pass(password):
-        return render_template('login.html', message="Password format is incorrect")
+    values, errors = validation.validate('login', request.form)
+    if errors:
+        return render_template('login.html', message=errors[0]['message'])
 
+    try:
+        user = bn.login_user(email, password)
+    except bn.HasherBusy:
+        # too many passwords are waiting to be checked, turn the request away
+        return render_template('login.html', message=BUSY_MESSAGE), 503
     if user:
+        # start the new login from a fresh copy of the user
+        bn.invalidate_user(user.email)
         session['logged_in'] = user.email
         """
         Session is an object that contains sharing information 
@@ -173,7 +301,7 @@ def login_post():
         return render_template('login.html', message='login failed')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     if 'logged_in' in session:
         session.pop('logged_in', None)
@@ -202,7 +330,7 @@ def authenticate(inner_function):
         # check did we store the key in the session
         if 'logged_in' in session:
             email = session['logged_in']
-            user = bn.get_user(email)
+            user = bn.get_cached_user(email)
             if user:
                 # if the user exists, call the inner_function
                 # with user as parameter
@@ -217,7 +345,7 @@ def authenticate(inner_function):
     return wrapped_inner
 
 
-@app.route('/')
+@bp.route('/')
 @authenticate
 def profile(user):
     # authentication is done in the wrapper function
@@ -225,86 +353,141 @@ def profile(user):
     # by using @authenticate, we don't need to re-write
     # the login checking code all the time for other
     # front-end portals
-    tickets = bn.get_all_tickets()
-    return render_template('index.html', user=user, tickets=tickets)
+    # only one page of tickets is loaded, the cursor of the next page
+    # (sort value and id of the last ticket shown) travels in the query string
+    after, sort = read_page_args(request.args)
+    # all tickets on one page instead of one page of them
+    show_all = request.args.get('view') == 'all'
+
+    modified, headers = check_page(request.environ, user, after, sort, show_all)
+    if not modified:
+        response = current_app.response_class(status=304)
+    elif show_all:
+        # too large to render in memory or cache: the rows are read from a
+        # cursor and rendered while the page is sent, one batch at a time
+        holdings = bn.get_user_holdings(user)
+        tickets = bn.iter_tickets(sort, current_app.config['LISTING_STREAM_BATCH'])
+        response = current_app.response_class(stream_template('index.html', user=user, holdings=holdings,
+                                                              tickets=tickets, sort=sort, show_all=True),
+                                              mimetype='text/html')
+    else:
+        holdings = bn.get_user_holdings(user)
+        response = make_response(render_template('index.html', user=user, holdings=holdings,
+                                                 ticket_list=render_ticket_list(after, sort)))
+    for name, value in headers:
+        response.headers[name] = value
+    return response
 
 
-@app.route('/*')
+@bp.route('/search', methods=['GET'])
+@authenticate
+def search(user):
+    query = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    tickets, next_page = bn.search_tickets(query, page, TICKETS_PER_PAGE)
+    return render_template('search.html', user=user, query=query, tickets=tickets,
+                           page=page, next_page=next_page)
+
+
+@bp.route('/stats/pool', methods=['GET'])
+def pool_stats():
+    # live connection pool statistics, used to size the pool per worker
+    if not current_app.config['STATS_ENABLED']:
+        abort(404)
+    return jsonify(bn.get_pool_stats())
+
+
+@bp.route('/stats/hasher', methods=['GET'])
+def hasher_stats():
+    # size and counters of the password hashing pool
+    if not current_app.config['STATS_ENABLED']:
+        abort(404)
+    return jsonify(bn.get_state()['password_hasher'].stats())
+
+
+@bp.route('/stats/ratelimit', methods=['GET'])
+def ratelimit_stats():
+    # number of limited keys and rejected login and register attempts
+    if not current_app.config['STATS_ENABLED']:
+        abort(404)
+    state = bn.get_state()
+    return jsonify(dict((name, limiter.stats()) for name, limiter in
+                        (('ip', state['ip_limiter']), ('email', state['email_limiter'])) if limiter is not None))
+
+
+@bp.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    # hit and miss counters of the backend and fragment caches
+    if not current_app.config['STATS_ENABLED']:
+        abort(404)
+    stats = bn.get_cache_stats()
+    stats['fragments'] = bn.get_state()['fragment_cache'].stats()
+    return jsonify(stats)
+
+
+@bp.route('/stats/compression', methods=['GET'])
+def compression_stats():
+    # bytes in and out, ratio and CPU time of the response compression
+    compression = current_app.extensions.get('compression')
+    if not current_app.config['STATS_ENABLED'] or compression is None:
+        abort(404)
+    return jsonify(compression.stats())
+
+
+@bp.route('/static/<path:filename>', methods=['GET'])
+def static_file(filename):
+    # built assets are sent compressed when the client accepts it, and
+    # never change: browsers and proxies keep them without asking again
+    assets = bn.get_state()['assets']
+    folder, path, encoding, immutable, varies = assets.find(filename, request.accept_encodings)
+    response = send_from_directory(folder, path, conditional=True,
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if varies:
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % ASSET_MAX_AGE
+        response.expires = None
+    return response
+
+
+@bp.route('/*')
 def error():
     return redirect('/', code=404)
 
 
-''' This function checks the quantity/price of a ticket and makes sure 
-it is in the valid length range.
-Input: valid range and int ticket quantity/price
-Output: boolean'''
-def check_quantity(low,high,item):
-
-    if item <= low or item >= high:
-        return False
-    else:
-        return True
-
-
-@app.route('/sell', methods=['POST', "GET"])
+@bp.route('/sell', methods=['POST', "GET"])
 @authenticate  # Needed to access instance of user
 def sell_ticket(user):
-    ticket_name = request.form.get('name')
-    ticket_quantity = int(float(request.form.get('quantity')))
-    ticket_price = float(request.form.get('price'))
-    ticket_date = request.form.get('exp_date')
-    error_message = ""
-
-    # There must not be a space at beginning or end, and the name mus tbe alphanumeric
-    if not check_spaces(ticket_name):
-        return render_template('index.html', user=user, message="Invalid spaces found in word")
-
-    # Ticket name must be shorter than 60 characters
-    if len(ticket_name) > 60:
-        return render_template('index.html', user=user, message="Ticket name is too long")
-
-    # Ticket quantity must be greater than 0 and less than or equal to 100
-    if not check_quantity(0, 101, ticket_quantity):
-        return render_template('index.html', user=user, message="Invalid quantity of tickets")
-
-    # Ticket price has to be of range [10,100]
-    if ticket_price > 100 or ticket_price < 10:
-        return render_template('index.html', user=user, message="Ticket price outside of valid range")
-
-    # Ticket date must be in valid format - YYYYMMDD
+    # The name must not start or end with a space and be at most 60 characters,
+    # the quantity in [1, 100], the price in [10, 100] and the date YYYYMMDD
     # Assumption: ticket dates will start from today (2020-11-26) and go onwards
-    if (int(ticket_date[:4]) < 2020 or int(ticket_date[4:6]) < 0 or int(ticket_date[4:6]) > 12 or
-            int(ticket_date[6:]) < 0 or int(ticket_date[4:6]) > 31):
-        return render_template('index.html', user=user, message="Invalid ticket date")
+    values, errors = validation.validate('sell', request.form)
+    if errors:
+        return render_template('index.html', user=user, message=errors[0]['message'])
+    ticket_name = values['name']
+    ticket_quantity = values['quantity']
+    ticket_price = values['price']
+    ticket_date = values['exp_date']
 
     bn.sell_ticket(ticket_name, ticket_quantity, ticket_price, ticket_date, user.email)
-    tickets = bn.get_all_tickets()
     # Add the ticket to the user's list of tickets.
-    return render_template('index.html', user=user, ticket=tickets)
+    return render_template('index.html', user=user, ticket_list=render_ticket_list())
 
 
-@app.route('/buy', methods=['POST'])
+@bp.route('/buy', methods=['POST'])
 @authenticate  # Needed to access instance of user
 def buy_ticket(user):
-    ticket_name = request.form.get('name')
-    ticket_quantity = request.form.get('quantity')
     error_message = ""
 
-    # ticket contains invalid spaces
-    if not check_spaces(ticket_name):
-        return render_template('index.html', user=user, message="Invalid spaces found in word")
-
-    # Check if ticket name is only alphanumeric
-    if not check_alnum(ticket_name):
-        return render_template('index.html', user=user, message="Name contains invalid characters")
-
-    # ticket name is longer than 60 chars
-    if len(ticket_name) > 60:
-        return render_template('index.html', user=user, message="Ticket name is too long")
-
-    # Ticket quantity must be greater than 0 and less than or equal to 100
-    if not check_quantity(1, 101, int(ticket_quantity)):
-        return render_template('index.html', user=user, message="Invalid quantity of tickets")
+    # The name must be alphanumeric, without spaces at the beginning or end
+    # and at most 60 characters, the quantity in [1, 100]
+    values, errors = validation.validate('buy', request.form)
+    if errors:
+        return render_template('index.html', user=user, message=errors[0]['message'])
+    ticket_name = values['name']
+    ticket_quantity = values['quantity']
 
     ticket = bn.get_ticket(ticket_name)   # have a try catch error here?
 
@@ -312,53 +495,47 @@ def buy_ticket(user):
         return render_template('index.html', user=user, message="Ticket does not exist")
 
     # ticket quantity has to be more than quantity requested to buy
-    if int(ticket_quantity) > ticket.quantity:
+    if ticket_quantity > ticket.quantity:
         return render_template('index.html', user=user, message="Requested quantity larger than available tickets")
 
     # user has to have more balance than ticket price + xtra fees
-    if user.balance < (ticket.price * int(ticket_quantity) * 1.35 * 1.05):
+    if user.balance_cents < bn.purchase_cost_cents(ticket.price, ticket_quantity):
         return render_template('index.html', user=user, message="User balance not enough for purchase")
 
     # redirect and display error message if possible
     if error_message != "":
         return redirect('/', message=error_message)
-    else:  # add ticket to user's profile
-        bn.register_ticket(ticket.date, ticket.name, ticket.quantity, ticket.price, ticket.date)
-        # Check if this works
-        user.balance = user.balance - (ticket.price * int(ticket_quantity) * 1.35 * 1.05)
+    else:
+        # the checks above only give quick feedback, the backend checks the
+        # quantity and the balance again inside the purchase transaction
+        error_message = bn.buy_ticket(user, ticket, ticket_quantity)
+        if error_message:
+            return render_template('index.html', user=user, message=error_message)
+        # the purchase dropped the cached user, reload it to show the new balance
+        user = bn.get_cached_user(user.email)
         # Now shows updated tickets for user and redirects to sell page
         return render_template('index.html', user=user, message="Ticket bought successfully")
 
 
-@app.route('/update', methods=['POST'])
+@bp.route('/update', methods=['POST'])
 @authenticate  # Needed to access instance of user
 def update_ticket(user):
     # This function will display the update ticket page to the user
     # We need the user information and the ticket information
     # This will then display the update.html page
 
-    ticket_name = request.form.get('name')  # using name but should id be used instead?
-    ticket_quantity = int(request.form.get('quantity'))
-    ticket_price = int(request.form.get('price'))
-    ticket_date = request.form.get('exp_date')
-
     error_message = ""
 
-    # There must not be a space at beginning or end
-    if not check_spaces(ticket_name):
-        return render_template('index.html', user=user, message="Invalid spaces found in ticket name")
-
-    # The name must be alphanumeric
-    if not check_alnum(ticket_name):
-        return render_template('index.html', user=user, message="Name contains special characters")
-
-    # The name of the ticket is no longer than 60 characters
-    if len(ticket_name) > 60:
-        return render_template('index.html', user=user, message="Ticket name is too long")
-
-    # The quantity of the tickets has to be more than 0, and less than or equal to 100
-    if not check_quantity(1, 101, ticket_quantity):
-        return render_template('index.html', user=user, message="Invalid quantity of tickets")  # CHANGE REROUTE TO /UPDATE????
+    # The name must be alphanumeric, without spaces at the beginning or end
+    # and at most 60 characters, the quantity in [1, 100], the price in
+    # [10, 100] and the date given in format YYYYMMDD
+    values, errors = validation.validate('update', request.form)
+    if errors:
+        return render_template('index.html', user=user, message=errors[0]['message'])
+    ticket_name = values['name']  # using name but should id be used instead?
+    ticket_quantity = values['quantity']
+    ticket_price = values['price']
+    ticket_date = values['exp_date']
 
     ticket = bn.get_ticket(ticket_name)
 
@@ -366,30 +543,13 @@ def update_ticket(user):
     if ticket is None:
         return render_template('index.html', user=user, message="Ticket does not exist")
 
-    # Price has to be of range [10, 100]
-    if not check_quantity(9, 101, ticket_price):
-        return render_template('index.html', user=user, message="Invalid ticket price")
-
-    # Date must be given in format YYYYMMDD
-    try:
-        int(ticket_date)
-    except:
-        return render_template('index.html', user=user, message="Invalid ticket date")
-
-
-    if (int(ticket_date[:4]) < 2020 or int(ticket_date[4:6]) < 0 or int(ticket_date[4:6]) > 12 or
-            int(ticket_date[6:]) < 0 or int(ticket_date[4:6]) > 31):
-        return render_template('index.html', user=user, message="Invalid ticket date")
-
     # For any errors, redirect back to / and show an error message
     if error_message != "":
         return redirect('index.html', user=user, message=error_message)
 
     # If there are no errors?
     else:
-        ticket.quantity = ticket_quantity
-        ticket.price = ticket_price
-        ticket.date = ticket_date
+        bn.update_ticket(ticket, ticket_quantity, ticket_price, ticket_date)
         # can we change name?? look into that
 
         return render_template('index.html', user=user, message="Successfully updated")
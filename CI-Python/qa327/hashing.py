@@ -0,0 +1,172 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+from werkzeug.security import generate_password_hash, check_password_hash
+
+"""
+This file hashes and checks passwords in a pool of worker processes,
+so an expensive key derivation function does not hold the request
+threads (and the GIL) of the web worker while it runs.
+
+The number of pbkdf2 iterations is calibrated when the hasher is made,
+so a hash takes about the target time on this machine. Workers forked
+from the process that made it inherit the result, and a process started
+anew can be given it instead of calibrating again.
+"""
+
+# the key derivation function passwords are hashed with
+METHOD = 'pbkdf2:sha256'
+
+# the iterations are never calibrated above this
+MAX_ITERATIONS = 10000000
+
+
+class HasherBusy(Exception):
+    """
+    Raised when too many passwords are already waiting to be hashed
+    """
+
+
+def calibrate(target, min_iterations, samples=3, probe=10000):
+    """
+    Find the number of pbkdf2 iterations that takes the target time
+    :param target: the time a hash should take, in seconds
+    :param min_iterations: the iterations are never calibrated below this
+    :param samples: number of timed probes, the fastest one counts
+    :param probe: iterations of a timed probe
+    :return: the number of iterations
+    """
+    best = None
+    for _ in range(samples):
+        start = time.perf_counter()
+        generate_password_hash('calibration', method='%s:%d' % (METHOD, probe))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    iterations = int(probe * target / max(best, 1e-6))
+    return min(max(iterations, min_iterations), MAX_ITERATIONS)
+
+
+def start_context():
+    """
+    :return: the multiprocessing context the worker processes are started with:
+        not fork, so they do not inherit the listening sockets and database
+        connections of the web worker. Like with any such pool, a script
+        that hashes passwords must guard its code with if __name__ == '__main__'
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def hash_password(password, method):
+    # runs in a worker process
+    return generate_password_hash(password, method=method)
+
+
+def check_password(pwhash, password):
+    # runs in a worker process
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher(object):
+    """
+    Hashes and checks passwords in a bounded pool of processes. At most
+    workers + queue_depth passwords are in the pool at once, past that
+    HasherBusy is raised instead of queueing more work.
+    """
+
+    def __init__(self, workers, queue_depth, target, min_iterations, timeout=10, iterations=None):
+        """
+        :param workers: number of worker processes, 0 to hash on the calling thread
+        :param queue_depth: number of passwords that may wait for a worker
+        :param target: the time a hash should take, in seconds
+        :param min_iterations: the pbkdf2 iterations are never calibrated below this
+        :param timeout: seconds to wait for a result before giving up with HasherBusy
+        :param iterations: the pbkdf2 iterations, calibrated here if None
+        """
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.target = target
+        self.min_iterations = min_iterations
+        self.timeout = timeout
+        # never on a request thread: a hash made while calibrating would
+        # hold up every request waiting for it
+        self.iterations = iterations or calibrate(target, min_iterations)
+        self.rejected = 0
+        self.rehashed = 0
+        self._slots = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def method(self):
+        """
+        :return: the method new hashes are made with
+        """
+        return '%s:%d' % (METHOD, self.iterations)
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        with self._lock:
+            if self._pid != os.getpid():
+                # created at the first use, and again after a fork: a pool
+                # inherited from the parent has no processes of its own
+                self._slots = threading.BoundedSemaphore(self.workers + self.queue_depth)
+                self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, start_context())
+                self._pid = os.getpid()
+            slots, executor = self._slots, self._executor
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            future = executor.submit(function, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            self.rejected += 1
+            raise HasherBusy()
+
+    def hash(self, password):
+        """
+        :return: the salted hash of the password
+        """
+        return self._run(hash_password, password, self.method)
+
+    def check(self, pwhash, password):
+        """
+        :return: True if the password matches the hash, whatever method made it
+        """
+        return self._run(check_password, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        Tell whether a hash should be replaced at the next login: hashes
+        of another method, e.g. the old single round sha256, and pbkdf2
+        hashes with less than half the calibrated iterations
+        :param pwhash: the stored hash
+        :return: True if the password should be hashed again
+        """
+        method = pwhash.split('$', 1)[0]
+        if not method.startswith(METHOD + ':'):
+            return True
+        try:
+            iterations = int(method[len(METHOD) + 1:])
+        except ValueError:
+            return True
+        return iterations * 2 < int(self.method.rsplit(':', 1)[1])
+
+    def stats(self):
+        """
+        :return: dict with the pool size, the calibrated iterations and the counters
+        """
+        return {'workers': self.workers, 'queue_depth': self.queue_depth,
+                'target_ms': self.target * 1000, 'iterations': self.iterations,
+                'rejected': self.rejected, 'rehashed': self.rehashed}
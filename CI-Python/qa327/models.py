@@ -1,5 +1,7 @@
-from qa327 import app
-from flask_sqlalchemy import SQLAlchemy
+from qa327.routing import RoutingSQLAlchemy
+from sqlalchemy import inspect
+from decimal import Decimal
+import datetime
 
 """
 This file defines all models used by the server
@@ -9,8 +11,8 @@ write SQL queries such as 'select', 'update' etc.
 """
 
 
-db = SQLAlchemy()
-db.init_app(app)
+# sessions send the queries of @read_only backend functions to read replicas
+db = RoutingSQLAlchemy()
 
 
 class User(db.Model):
@@ -23,9 +25,40 @@ class User(db.Model):
     name = db.Column(db.String(1000))
 
     # added attributes:
-    # do not include primary key because balance does not have to be unique
-    balance = db.Column(db.Integer)
-    tickets = db.Column(db.String(100))
+    # balance in integer cents, materialized from the ledger: it is only
+    # changed together with a LedgerEntry, in the same transaction
+    balance_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    # bumped with every balance change, used to tell if a page showing it is out of date
+    balance_version = db.Column(db.Integer, nullable=False, default=0)
+    balance_updated = db.Column(db.DateTime)
+    # tickets the user bought are in the Holding table
+
+    @property
+    def balance(self):
+        """The balance in dollars, for display"""
+        if self.balance_cents is None:
+            return None
+        return Decimal(self.balance_cents) / 100
+
+    @balance.setter
+    def balance(self, dollars):
+        self.balance_cents = int(Decimal(str(dollars)) * 100)
+
+
+class LedgerEntry(db.Model):
+    """
+    An append-only ledger of money movements. Every change of a user's
+    balance is recorded here, so the sum of a user's entries always
+    equals the user's materialized balance.
+    """
+    __table_args__ = (db.UniqueConstraint('user_id', 'txn_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    txn_id = db.Column(db.String(32), nullable=False)      # groups the entries of one transaction
+    amount_cents = db.Column(db.BigInteger, nullable=False)  # positive is a credit, negative a debit
+    kind = db.Column(db.String(20), nullable=False)        # signup, purchase, sale, migration
+    created = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
 class Form(db.Model):
     """
@@ -49,11 +82,11 @@ class Ticket(db.Model):
     A ticket model which holds information about a ticket
     """
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(100))  # owner of ticket
-    name = db.Column(db.String(1000))               # name of ticket
+    email = db.Column(db.String(100), index=True)   # owner of ticket
+    name = db.Column(db.String(100), index=True)    # name of ticket (at most 60 chars, see frontend)
     quantity = db.Column(db.Integer)                # quantity of this ticket
-    price = db.Column(db.Integer)                   # price of ticket of this type
-    date = db.Column(db.String(50))                 # expiration date
+    price = db.Column(db.Integer, index=True)       # price of ticket of this type
+    date = db.Column(db.Date, index=True)           # expiration date
 
     instances = []
 
@@ -62,7 +95,191 @@ class Ticket(db.Model):
                                      # list of objects of type Ticket
 
 
-# it creates all the SQL tables if they do not exist
-with app.app_context():
+class ArchivedTicket(db.Model):
+    """
+    Cold storage for tickets past their expiration date. The archive job
+    moves them out of the ticket table, keeping their id, so the hot
+    table stays small and expired listings stay available for reports.
+    """
+    __tablename__ = 'ticket_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    email = db.Column(db.String(100), index=True)   # owner of ticket
+    name = db.Column(db.String(100))                # name of ticket
+    quantity = db.Column(db.Integer)                # quantity left unsold
+    price = db.Column(db.Integer)                   # price of ticket of this type
+    date = db.Column(db.Date, index=True)           # expiration date
+    archived = db.Column(db.DateTime)               # when the ticket was archived
+
+
+class Holding(db.Model):
+    """
+    A holding model which records the tickets a user bought,
+    one row per purchase
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # not a foreign key: the holding must outlive the listing it was bought from
+    ticket_id = db.Column(db.Integer, nullable=False, index=True)
+    name = db.Column(db.String(100))                # name of the ticket when bought
+    quantity = db.Column(db.Integer, nullable=False)  # amount of tickets bought
+    price_cents = db.Column(db.BigInteger)          # price of one ticket when bought
+    date = db.Column(db.Date)                       # expiration date of the ticket
+    txn_id = db.Column(db.String(32))               # the ledger transaction that paid for it
+    created = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+
+def create_missing_indexes():
+    """
+    Create the indexes declared on the models that an existing database
+    does not have yet. db.create_all() only creates indexes together with
+    a brand new table, so databases created before an index was added to a
+    model would otherwise keep doing full table scans.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+
+
+def migrate_ticket_dates():
+    """
+    Convert ticket expiry dates stored by older versions as YYYYMMDD
+    strings into real dates. db.create_all() never alters an existing
+    table, so the conversion is done here, and it is a no-op once the
+    rows have been migrated.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        # sqlite has no DATE storage class, SQLAlchemy stores dates as
+        # YYYY-MM-DD text, which sorts and compares in date order. Older
+        # versions did not check the day, so rows like 20301299 exist: they
+        # can't be loaded as dates and are set to NULL, like on MySQL. Days
+        # past the 28th are checked again in case an earlier run of this
+        # migration converted them without checking
+        rows = db.session.execute(
+            "SELECT id, date FROM ticket WHERE (length(date) = 8 AND date NOT LIKE '%-%')"
+            " OR (date LIKE '____-__-__' AND (date(date) IS NULL OR substr(date, 9, 2) > '28'))").fetchall()
+        updates = []
+        for ticket_id, value in rows:
+            # the column has numeric affinity, YYYYMMDD values are stored as integers
+            value = str(value)
+            try:
+                date = datetime.datetime.strptime(value.replace('-', ''), '%Y%m%d').date().isoformat()
+            except ValueError:
+                date = None
+            if date != value:
+                updates.append({'id': ticket_id, 'date': date})
+        if updates:
+            db.session.execute("UPDATE ticket SET date = :date WHERE id = :id", updates)
+    elif dialect == 'mysql':
+        columns = inspect(db.engine).get_columns('ticket')
+        date_type = [column['type'] for column in columns if column['name'] == 'date'][0]
+        if not isinstance(date_type, db.Date):
+            # rows that do not hold a valid date can't be converted
+            db.session.execute(
+                "UPDATE ticket SET date = NULL WHERE STR_TO_DATE(date, '%Y%m%d') IS NULL")
+            db.session.execute("ALTER TABLE ticket MODIFY date DATE")
+    db.session.commit()
+
+
+def migrate_ticket_names():
+    """
+    Shrink the ticket name column of databases created by older versions,
+    as VARCHAR(1000), to the VARCHAR(100) of the model. On MySQL an index
+    on the wide column goes over the 3072 byte key limit of InnoDB with
+    utf8mb4, so this runs before the missing indexes are created. sqlite
+    does not enforce the length and needs nothing.
+    """
+    if db.engine.dialect.name != 'mysql':
+        return
+    columns = inspect(db.engine).get_columns('ticket')
+    name_type = [column['type'] for column in columns if column['name'] == 'name'][0]
+    length = Ticket.__table__.c.name.type.length
+    if getattr(name_type, 'length', None) != length:
+        # the forms never took names this long, older rows are cut to fit
+        db.session.execute("UPDATE ticket SET name = LEFT(name, :length) WHERE CHAR_LENGTH(name) > :length",
+                           {'length': length})
+        db.session.execute("ALTER TABLE ticket MODIFY name VARCHAR(%d)" % length)
+    db.session.commit()
+
+
+def migrate_user_balances():
+    """
+    Move balances kept by older versions in whole dollars in user.balance
+    into user.balance_cents, and record each one as an opening ledger
+    entry so the ledger adds up to the balances.
+    """
+    columns = [column['name'] for column in inspect(db.engine).get_columns('user')]
+    if 'balance_cents' in columns:
+        return
+    db.session.execute("ALTER TABLE user ADD COLUMN balance_cents BIGINT NOT NULL DEFAULT 0")
+    if 'balance' in columns:
+        db.session.execute("UPDATE user SET balance_cents = ROUND(balance * 100) WHERE balance IS NOT NULL")
+        db.session.execute(
+            "INSERT INTO ledger_entry (user_id, txn_id, amount_cents, kind, created)"
+            " SELECT id, 'migration', balance_cents, 'migration', CURRENT_TIMESTAMP"
+            " FROM user WHERE balance_cents != 0")
+    db.session.commit()
+
+
+def migrate_user_versions():
+    """
+    Add the balance version columns to user tables created by older versions
+    """
+    columns = [column['name'] for column in inspect(db.engine).get_columns('user')]
+    if 'balance_version' not in columns:
+        db.session.execute("ALTER TABLE user ADD COLUMN balance_version INTEGER NOT NULL DEFAULT 0")
+    if 'balance_updated' not in columns:
+        db.session.execute("ALTER TABLE user ADD COLUMN balance_updated DATETIME")
+    db.session.commit()
+
+
+def create_ticket_search_index():
+    """
+    Create the full-text index used to search tickets by name: an FTS5
+    table kept in sync by triggers on sqlite, a FULLTEXT index on MySQL.
+    Other databases have no full-text index and search with LIKE.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        if 'ticket_fts' in inspect(db.engine).get_table_names():
+            return
+        # external content table: the text lives in ticket, ticket_fts only holds the index
+        db.session.execute(
+            "CREATE VIRTUAL TABLE ticket_fts USING fts5(name, content='ticket', content_rowid='id')")
+        db.session.execute(
+            "CREATE TRIGGER ticket_fts_insert AFTER INSERT ON ticket BEGIN"
+            " INSERT INTO ticket_fts(rowid, name) VALUES (new.id, new.name); END")
+        db.session.execute(
+            "CREATE TRIGGER ticket_fts_delete AFTER DELETE ON ticket BEGIN"
+            " INSERT INTO ticket_fts(ticket_fts, rowid, name) VALUES ('delete', old.id, old.name); END")
+        db.session.execute(
+            "CREATE TRIGGER ticket_fts_update AFTER UPDATE OF name ON ticket BEGIN"
+            " INSERT INTO ticket_fts(ticket_fts, rowid, name) VALUES ('delete', old.id, old.name);"
+            " INSERT INTO ticket_fts(rowid, name) VALUES (new.id, new.name); END")
+        # index the tickets that existed before the search index
+        db.session.execute("INSERT INTO ticket_fts(ticket_fts) VALUES ('rebuild')")
+    elif dialect == 'mysql':
+        indexes = [index['name'] for index in inspect(db.engine).get_indexes('ticket')]
+        if 'ix_ticket_name_fulltext' not in indexes:
+            db.session.execute("ALTER TABLE ticket ADD FULLTEXT INDEX ix_ticket_name_fulltext (name)")
+    db.session.commit()
+
+
+def init_db():
+    """
+    Create the SQL tables that do not exist, and bring the existing ones
+    up to date. Run once at startup, by the server and the maintenance
+    commands, within an app context
+    """
     db.create_all()
+    migrate_ticket_dates()
+    migrate_ticket_names()
+    migrate_user_balances()
+    migrate_user_versions()
+    create_missing_indexes()
+    create_ticket_search_index()
     db.session.commit()
@@ -0,0 +1,82 @@
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+"""
+This file defines the database connection pool used for client/server
+databases (MySQL), and the statistics it reports. sqlite connections
+are not pooled.
+"""
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    A QueuePool that also measures how long callers wait for a connection,
+    so the pool can be sized for the number of workers and threads
+    """
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0          # connections handed out
+        self.timeouts = 0           # callers that gave up waiting
+        self.wait_total = 0.0       # seconds spent waiting for a connection
+        self.wait_max = 0.0         # longest single wait
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def engine_options(config):
+    """
+    Build the SQLAlchemy engine options of the connection pool
+    :param config: mapping with the DB_POOL_* settings, e.g. app.config or os.environ
+    :return: dict of keyword arguments for create_engine
+    """
+    pre_ping = config.get('DB_POOL_PRE_PING', '1')
+    return {
+        'poolclass': MeteredQueuePool,
+        # connections kept open per process
+        'pool_size': int(config.get('DB_POOL_SIZE', 5)),
+        # extra connections opened under load, closed when returned
+        'max_overflow': int(config.get('DB_POOL_MAX_OVERFLOW', 10)),
+        # seconds to wait for a connection before giving up
+        'pool_timeout': float(config.get('DB_POOL_TIMEOUT', 30)),
+        # reconnect connections older than this many seconds, -1 to never recycle
+        'pool_recycle': int(config.get('DB_POOL_RECYCLE', 3600)),
+        # test each connection on checkout, so a database restart costs
+        # one reconnect instead of errors on every stale connection
+        'pool_pre_ping': pre_ping if isinstance(pre_ping, bool) else pre_ping not in ('0', 'false', 'False'),
+    }
+
+
+def get_pool_stats(engine):
+    """
+    Get live statistics of an engine's connection pool
+    :param engine: the SQLAlchemy engine
+    :return: dict of pool statistics
+    """
+    pool = engine.pool
+    stats = {'class': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(),
+                     checked_out=pool.checkedout(), overflow=pool.overflow())
+    if isinstance(pool, MeteredQueuePool):
+        with pool._stats_lock:
+            stats.update(checkouts=pool.checkouts, timeouts=pool.timeouts,
+                         wait_total=pool.wait_total, wait_max=pool.wait_max,
+                         wait_avg=pool.wait_total / pool.checkouts if pool.checkouts else 0.0)
+    return stats
@@ -0,0 +1,80 @@
+import threading
+import time
+
+"""
+This file defines the token bucket rate limiter that guards the login
+and register forms against password guessing
+"""
+
+
+class TokenBucketLimiter(object):
+    """
+    One token bucket per key: a bucket holds up to burst tokens and
+    refills at rate tokens per second, each allowed request takes a
+    token. A check is O(1). Buckets left alone long enough to be full
+    again are the same as new ones, they are evicted every
+    evict_interval seconds so the table only holds recently active keys.
+    """
+
+    def __init__(self, rate, burst, evict_interval=60):
+        """
+        :param rate: tokens added per second
+        :param burst: the size of a bucket, the requests allowed at once
+        :param evict_interval: seconds between two sweeps of the full buckets
+        """
+        self.rate = rate
+        self.burst = burst
+        self.evict_interval = evict_interval
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = {}      # key -> [tokens, time of the last update]
+        self._lock = threading.Lock()
+        self._next_eviction = time.monotonic() + evict_interval
+
+    def allow(self, key):
+        """
+        Take a token from the key's bucket
+        :param key: what is limited, e.g. an IP address
+        :return: True if the request is allowed
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_eviction:
+                self._evict(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                self.rejected += 1
+                return False
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+
+    def retry_after(self, key):
+        """
+        :return: seconds until the key's bucket has a token again
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0
+            tokens = bucket[0] + (time.monotonic() - bucket[1]) * self.rate
+            return max(0.0, (1 - tokens) / self.rate)
+
+    def _evict(self, now):
+        full_after = self.burst / self.rate
+        for key in [key for key, (_, updated) in self._buckets.items() if now - updated >= full_after]:
+            del self._buckets[key]
+        self._next_eviction = now + self.evict_interval
+
+    def stats(self):
+        """
+        :return: dict with the number of buckets and the allowed and rejected counters
+        """
+        with self._lock:
+            return {'keys': len(self._buckets), 'rate': self.rate, 'burst': self.burst,
+                    'allowed': self.allowed, 'rejected': self.rejected}
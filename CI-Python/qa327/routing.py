@@ -0,0 +1,124 @@
+import functools
+import itertools
+import threading
+import time
+from flask import g, session, has_app_context, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+
+"""
+This file routes read-only database work to read replicas.
+
+Backend functions that only read are decorated with @read_only. While
+one of them runs, the session sends its queries to one of the replicas
+listed in SQLALCHEMY_REPLICA_URIS (round robin). Everything else,
+including every flush, goes to the primary database.
+
+A replica may lag behind the primary, so after a commit the rest of
+the request, and the same client for SQLALCHEMY_REPLICA_LAG seconds
+(e.g. register then login), read from the primary as well.
+"""
+
+_local = threading.local()
+
+
+def read_only(function):
+    """
+    Mark a backend function as read-only, so its queries may be
+    answered by a read replica
+    """
+
+    @functools.wraps(function)
+    def wrapped(*args, **kwargs):
+        _local.depth = getattr(_local, 'depth', 0) + 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.depth -= 1
+
+    return wrapped
+
+
+def in_read_only():
+    """
+    :return: True if the current thread is running a read-only function
+    """
+    return getattr(_local, 'depth', 0) > 0
+
+
+def pinned_to_primary(app):
+    """
+    Check whether reads must go to the primary because of a recent write
+    :return: True if this context or client wrote less than SQLALCHEMY_REPLICA_LAG seconds ago
+    """
+    if has_app_context() and g.get('db_wrote'):
+        return True
+    if has_request_context():
+        last_write = session.get('db_write_at', 0)
+        return time.time() - last_write < app.config['SQLALCHEMY_REPLICA_LAG']
+    return False
+
+
+def get_replica_engines(app):
+    """
+    Get the engines of the read replicas configured for an app, creating
+    them the first time
+    :return: tuple of (list of engines, round robin iterator over them)
+    """
+    uris = tuple(app.config.get('SQLALCHEMY_REPLICA_URIS') or ())
+    state = app.extensions.setdefault('sqlalchemy_replicas', {'uris': None})
+    if state['uris'] != uris:
+        for engine in state.get('engines', []):
+            engine.dispose()
+        engines = []
+        for uri in uris:
+            # replicas of a pooled database get the same pool settings as the primary
+            options = {} if uri.startswith('sqlite') else app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+            engines.append(create_engine(uri, **options))
+        state.update(uris=uris, engines=engines, cycle=itertools.cycle(engines),
+                     lock=threading.Lock())
+    return state['engines'], state
+
+
+def next_replica_engine(app):
+    """
+    :return: the next replica engine in round robin order, or None if there are no replicas
+    """
+    engines, state = get_replica_engines(app)
+    if not engines:
+        return None
+    with state['lock']:
+        return next(state['cycle'])
+
+
+class RoutingSession(SignallingSession):
+    """
+    A session that sends the queries of read-only functions to a replica
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if in_read_only() and not self._flushing and not pinned_to_primary(self.app):
+            replica = next_replica_engine(self.app)
+            if replica is not None:
+                return replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def pin_after_write(db_session):
+    """Read from the primary for a while after a commit, so writes are visible"""
+    if not db_session.app.config.get('SQLALCHEMY_REPLICA_URIS'):
+        return
+    if has_app_context():
+        g.db_wrote = True
+    if has_request_context():
+        session['db_write_at'] = time.time()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy extension whose sessions route reads to replicas
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,289 @@
+import errno
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+"""
+This file defines the production server of `python -m qa327 serve`:
+a master process that opens the listening socket and keeps a number of
+pre-forked worker processes running, each serving requests with a pool
+of threads.
+
+Signals of the master:
+
+    SIGHUP             graceful reload: the master executes itself again
+                       (loading the new code) and keeps the socket, new
+                       workers are started and the old ones finish their
+                       requests before they exit
+    SIGTERM, SIGINT    graceful stop
+
+A worker finishes its requests and exits on SIGTERM, and after serving
+max_requests requests (plus a random jitter, so the workers do not all
+restart at once). The master replaces workers that exit.
+"""
+
+# environment of a reloaded master: the listening socket and the old workers
+LISTEN_FD_ENV = 'QA327_LISTEN_FD'
+OLD_WORKERS_ENV = 'QA327_OLD_WORKERS'
+
+# seconds workers get to finish their requests when the server stops
+GRACEFUL_TIMEOUT = 30
+
+
+class RequestHandler(WSGIRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests, for the number
+    # of seconds set as timeout
+    protocol_version = 'HTTP/1.1'
+
+    def end_headers(self):
+        # a connection kept alive holds its thread while it waits for the
+        # next request: when every thread has a connection, the others
+        # would wait in the backlog behind idle ones, so it is closed
+        if not self.close_connection and self.server.saturated():
+            self.send_header('Connection', 'close')
+        WSGIRequestHandler.end_headers(self)
+
+
+class PoolWSGIServer(BaseWSGIServer):
+    """
+    A WSGI server that serves connections with a fixed pool of threads.
+    A connection is only accepted once a thread is free to serve it: when
+    all threads are busy, new connections wait in the listen backlog where
+    the other workers can pick them up.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, listener, app, threads, keepalive):
+        handler = type('KeepAliveHandler', (RequestHandler,), {'timeout': keepalive})
+        host, port = listener.getsockname()[:2]
+        BaseWSGIServer.__init__(self, host, port, app, handler=handler, fd=listener.fileno())
+        self.threads = threads
+        self.socket.setblocking(False)
+        self.executor = ThreadPoolExecutor(threads)
+        self._slots = threading.Semaphore(threads)
+        self._slot_taken = False
+        self._connections = 0
+        self._lock = threading.Lock()
+
+    def saturated(self):
+        """
+        :return: True if every thread of the pool is serving a connection
+        """
+        return self._connections >= self.threads
+
+    def _handle_request_noblock(self):
+        # called by serve_forever when the listener is readable. Wait for a
+        # free thread first, then check the connection was not taken by
+        # another worker meanwhile, so accept() takes no connection this
+        # worker can't serve yet. The listener does not block either, for
+        # the connections taken between the check and accept()
+        if not self._slots.acquire(timeout=0.5):
+            return
+        self._slot_taken = True
+        try:
+            if select.select([self.socket], [], [], 0)[0]:
+                BaseWSGIServer._handle_request_noblock(self)
+        finally:
+            if self._slot_taken:
+                # nothing was accepted, or the connection was turned away
+                self._slot_taken = False
+                self._slots.release()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self._connections += 1
+        try:
+            self.executor.submit(self._process, request, client_address)
+        except Exception:
+            with self._lock:
+                self._connections -= 1
+            raise
+        # the thread that serves the connection releases the slot
+        self._slot_taken = False
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self._connections -= 1
+            self._slots.release()
+
+
+def open_listener(host, port, backlog):
+    """
+    :return: the listening socket, inherited from the previous master on a reload
+    """
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is not None:
+        listener = socket.socket(fileno=int(fd))
+        listener.listen(backlog)
+        return listener
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+def run_worker(listener, app, threads, keepalive, max_requests):
+    """
+    Serve requests until told to stop or max_requests are served
+    :return: never, the process exits
+    """
+    server = PoolWSGIServer(listener, app, threads, keepalive)
+    stopping = threading.Event()
+
+    def stop(*args):
+        # shutdown() waits for serve_forever, which runs on this thread
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    if max_requests:
+        served = [0]
+        lock = threading.Lock()
+
+        def counting_app(environ, start_response):
+            with lock:
+                served[0] += 1
+                if served[0] == max_requests:
+                    stop()
+            return app(environ, start_response)
+        server.app = counting_app
+
+    status = 0
+    try:
+        server.serve_forever()
+        server.executor.shutdown(wait=True)
+    except Exception:
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # skip the exit handlers inherited from the master
+        os._exit(status)
+
+
+def serve(app, host, port, workers, threads, backlog=2048, keepalive=2, max_requests=0,
+          max_requests_jitter=0, before_fork=None, argv=None):
+    """
+    Run the master process until it is stopped
+    :param app: the WSGI application
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :param workers: number of worker processes
+    :param threads: number of threads of each worker
+    :param backlog: the listen backlog of the socket
+    :param keepalive: seconds an idle connection is kept open
+    :param max_requests: requests served by a worker before it is replaced, 0 for no limit
+    :param max_requests_jitter: largest random number of requests added to max_requests
+    :param before_fork: function called before the workers are started, e.g. to close connections
+    :param argv: the command line that starts the master again on a reload
+    :return: exit status
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('the production server needs a system with fork')
+    listener = open_listener(host, port, backlog)
+    argv = argv or [sys.executable] + sys.argv
+    children = {}       # pid -> time the worker started
+    flags = {'stop': False, 'reload': False}
+
+    def on_stop(*args):
+        flags['stop'] = True
+
+    def on_reload(*args):
+        flags['reload'] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_reload)
+
+    def spawn():
+        limit = max_requests + random.randint(0, max_requests_jitter) if max_requests else 0
+        pid = os.fork()
+        if pid == 0:
+            run_worker(listener, app, threads, keepalive, limit)
+        children[pid] = time.monotonic()
+
+    # workers of the master this one replaced, they stop once ours run
+    old_workers = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+    if before_fork is not None:
+        before_fork()
+    for _ in range(workers):
+        spawn()
+    for pid in old_workers:
+        signal_worker(pid, signal.SIGTERM)
+    print(' * Serving on %s:%d with %d workers of %d threads' % (host, port, workers, threads))
+    sys.stdout.flush()
+
+    while not flags['stop']:
+        if flags['reload']:
+            # execute the master again: the new code is loaded and starts
+            # its workers on the same socket, then stops these ones
+            listener.set_inheritable(True)
+            os.environ[LISTEN_FD_ENV] = str(listener.fileno())
+            os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in list(children) + old_workers)
+            sys.stdout.flush()
+            os.execv(argv[0], argv)
+        for pid in reap():
+            if pid in old_workers:
+                old_workers.remove(pid)
+            started = children.pop(pid, None)
+            if started is not None and not flags['stop']:
+                if time.monotonic() - started < 1:
+                    time.sleep(1)   # a worker that dies at start should not be restarted in a loop
+                spawn()
+        time.sleep(0.2)
+
+    for pid in list(children) + old_workers:
+        signal_worker(pid, signal.SIGTERM)
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT
+    while children and time.monotonic() < deadline:
+        for pid in reap():
+            children.pop(pid, None)
+        time.sleep(0.1)
+    for pid in children:
+        signal_worker(pid, signal.SIGKILL)
+    listener.close()
+    return 0
+
+
+def reap():
+    """
+    :return: the pids of the child processes that exited
+    """
+    pids = []
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except OSError as error:
+            if error.errno == errno.ECHILD:
+                return pids
+            raise
+        if pid == 0:
+            return pids
+        pids.append(pid)
+
+
+def signal_worker(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except OSError:
+        pass    # already gone
@@ -0,0 +1,84 @@
+import argparse
+import sys
+import time
+
+"""
+This file measures the cold start of the service, what a new worker
+process goes through before it answers its first request:
+
+    python -m qa327.startup [--path /login] [--budget-ms 1000]
+
+It imports the application, creates the app, creates and migrates the
+tables of the configured database and serves two requests in process,
+then reports how long each step took. The cold start is everything up
+to the end of the first request, the second request shows what a warm
+request costs. Run it in a new process, e.g. `python -m qa327 startup`,
+so nothing is imported already.
+"""
+
+
+def measure(path='/login'):
+    """
+    Start the application step by step
+    :param path: the page of the first requests
+    :return: list of (step, milliseconds) pairs
+    """
+    timings = []
+    start = time.perf_counter()
+
+    def step(name):
+        nonlocal start
+        now = time.perf_counter()
+        timings.append((name, (now - start) * 1000))
+        start = now
+
+    import flask  # noqa: F401
+    import qa327
+    import qa327.frontend  # noqa: F401
+    step('import the application')
+    app = qa327.create_app()
+    step('create the app')
+    from qa327.models import init_db
+    with app.app_context():
+        init_db()
+    step('create and migrate the tables')
+    client = app.test_client()
+    client.get(path)
+    step('first request GET %s' % path)
+    client.get(path)
+    step('second request GET %s' % path)
+    return timings
+
+
+def report(timings, budget_ms=0):
+    """
+    Print the timings of the steps and the cold start
+    :param timings: list of (step, milliseconds) pairs from measure()
+    :param budget_ms: the longest acceptable cold start, 0 for no budget
+    :return: exit status, 1 if the cold start took longer than the budget
+    """
+    cold_start = sum(ms for _, ms in timings[:-1])
+    width = max(len(name) for name, _ in timings)
+    print('startup of qa327, python %d.%d' % sys.version_info[:2])
+    for name, ms in timings[:-1]:
+        print('  %-*s %9.1f ms' % (width, name, ms))
+    print('  %-*s %9.1f ms' % (width, 'cold start', cold_start))
+    name, ms = timings[-1]
+    print('  %-*s %9.1f ms' % (width, name, ms))
+    if budget_ms and cold_start > budget_ms:
+        print('the cold start is over the budget of %.0f ms' % budget_ms)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m qa327.startup')
+    parser.add_argument('--path', default='/login', help='page of the first requests (default: /login)')
+    parser.add_argument('--budget-ms', type=float, default=0,
+                        help='fail if the cold start takes longer (default: 0, no budget)')
+    args = parser.parse_args(argv)
+    return report(measure(args.path), args.budget_ms)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
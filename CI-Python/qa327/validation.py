@@ -0,0 +1,259 @@
+import datetime
+import functools
+import re
+
+"""
+This file defines the validation rules of the forms.
+
+The rules of every form are declared once below, in the order they are
+checked, and compiled into a list of check functions per form when the
+module is imported. A form can then be validated on its own (stopping at
+the first error, which is what the pages show) or as a batch of records,
+which reports every failing field of every record.
+
+    values, errors = validate('sell', request.form)
+    if errors:
+        message = errors[0]['message']
+
+The values returned are converted: quantities and prices are numbers and
+dates are datetime.date objects.
+"""
+
+# characters a password needs at least one of
+SPECIAL_CHARACTERS = "!@#$%^&*()_-+=/"
+
+# Each rule is (field, check, argument, message). The checks are defined
+# in CHECKS below. The first failing rule of a field is reported, the
+# other rules of that field are skipped.
+RULES = {
+    'register': [
+        ('password', 'same_as', 'password2', "The passwords do not match"),
+        ('email', 'email', None, "Email format is incorrect"),
+        ('password', 'password', 6, "Password format is incorrect"),
+        ('name', 'length', (3, 19), "Name length formatting error"),
+        ('name', 'alnum', None, "Name contains special characters"),
+        ('name', 'no_edge_spaces', None, "Invalid spaces found in word"),
+    ],
+    'login': [
+        ('email', 'required', None, "Email/password cant be blank"),
+        ('password', 'required', None, "Email/password cant be blank"),
+        ('email', 'email', None, "Email format is incorrect"),
+        ('password', 'password', 6, "Password format is incorrect"),
+    ],
+    'sell': [
+        ('name', 'no_edge_spaces', None, "Invalid spaces found in word"),
+        ('name', 'length', (1, 60), "Ticket name is too long"),
+        ('quantity', 'integer', (1, 100), "Invalid quantity of tickets"),
+        ('price', 'number', (10, 100), "Ticket price outside of valid range"),
+        ('exp_date', 'date', 2020, "Invalid ticket date"),
+    ],
+    'buy': [
+        ('name', 'no_edge_spaces', None, "Invalid spaces found in word"),
+        ('name', 'alnum', None, "Name contains invalid characters"),
+        ('name', 'length', (1, 60), "Ticket name is too long"),
+        ('quantity', 'integer', (1, 100), "Invalid quantity of tickets"),
+    ],
+    'update': [
+        ('name', 'no_edge_spaces', None, "Invalid spaces found in ticket name"),
+        ('name', 'alnum', None, "Name contains special characters"),
+        ('name', 'length', (1, 60), "Ticket name is too long"),
+        ('quantity', 'integer', (1, 100), "Invalid quantity of tickets"),
+        ('price', 'integer', (10, 100), "Invalid ticket price"),
+        ('exp_date', 'date', 2020, "Invalid ticket date"),
+    ],
+}
+
+# returned by a check when the value is not valid
+INVALID = object()
+
+# Each check below takes the argument of a rule and returns the function
+# checking a field: function(value, values) returns the value converted,
+# or INVALID. values holds the submitted fields, for checks comparing two.
+
+
+def _required(argument):
+    def check(value, values):
+        return value if value else INVALID
+    return check
+
+
+def _same_as(other):
+    def check(value, values):
+        return value if value == values[other] else INVALID
+    return check
+
+
+def _email(argument):
+    match = re.compile(r'^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$').search
+
+    def check(value, values):
+        return value if value and match(value) else INVALID
+    return check
+
+
+def _password(min_length):
+    special = re.compile('[%s]' % re.escape(SPECIAL_CHARACTERS)).search
+
+    def check(value, values):
+        # a string has an upper case character when lowering it changes it,
+        # and a lower case one when upper casing it does
+        if (value and len(value) >= min_length and value.lower() != value
+                and value.upper() != value and special(value)):
+            return value
+        return INVALID
+    return check
+
+
+def _length(bounds):
+    low, high = bounds
+
+    def check(value, values):
+        return value if value is not None and low <= len(value) <= high else INVALID
+    return check
+
+
+def _alnum(argument):
+    # letters, digits and white space only: no character that is neither
+    # a word character nor a space, and no underscore
+    search = re.compile(r'[^\w\s]').search
+
+    def check(value, values):
+        if value is None or search(value) or '_' in value:
+            return INVALID
+        return value
+    return check
+
+
+def _no_edge_spaces(argument):
+    def check(value, values):
+        if not value or value[0] == ' ' or value[-1] == ' ':
+            return INVALID
+        return value
+    return check
+
+
+def _integer(bounds):
+    low, high = bounds
+
+    def check(value, values):
+        try:
+            number = int(float(value))
+        except (TypeError, ValueError, OverflowError):
+            return INVALID
+        return number if low <= number <= high else INVALID
+    return check
+
+
+def _number(bounds):
+    low, high = bounds
+
+    def check(value, values):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return INVALID
+        return number if low <= number <= high else INVALID
+    return check
+
+
+def _date(min_year):
+    match = re.compile(r'^\d{8}$').match
+
+    # the same few dates are submitted over and over
+    @functools.lru_cache(maxsize=4096)
+    def check_date(value):
+        try:
+            date = datetime.date(int(value[:4]), int(value[4:6]), int(value[6:]))
+        except ValueError:
+            return INVALID
+        return date if date.year >= min_year else INVALID
+
+    def check(value, values):
+        # dates are given as YYYYMMDD
+        if not value or not match(value):
+            return INVALID
+        return check_date(value)
+    return check
+
+
+# builds the check function of a rule from its argument
+CHECKS = {
+    'required': _required,
+    'same_as': _same_as,
+    'email': _email,
+    'password': _password,
+    'length': _length,
+    'alnum': _alnum,
+    'no_edge_spaces': _no_edge_spaces,
+    'integer': _integer,
+    'number': _number,
+    'date': _date,
+}
+
+
+def compile_rules(rules):
+    """
+    Compile the rules of one form
+    :param rules: list of (field, check, argument, message)
+    :return: (fields, compiled rules), each compiled rule a tuple of
+        (field, check function, check, message)
+    """
+    fields = []
+    compiled = []
+    for field, check, argument, message in rules:
+        if check not in CHECKS:
+            raise ValueError('unknown check %r' % check)
+        for used in (field, argument) if check == 'same_as' else (field,):
+            if used not in fields:
+                fields.append(used)
+        compiled.append((field, CHECKS[check](argument), check, message))
+    return tuple(fields), tuple(compiled)
+
+
+# every form, compiled once
+FORMS = {form: compile_rules(rules) for form, rules in RULES.items()}
+
+
+def _validate(fields, rules, data, first_error):
+    get = data.get
+    values = {field: get(field) for field in fields}
+    errors = []
+    for field, function, check, message in rules:
+        value = values[field]
+        if value is INVALID:
+            # the field failed an earlier rule
+            continue
+        value = function(value, values)
+        if value is INVALID:
+            errors.append({'field': field, 'check': check, 'message': message})
+            if first_error:
+                break
+        values[field] = value
+    for error in errors:
+        values[error['field']] = None
+    return values, errors
+
+
+def validate(form, data, first_error=True):
+    """
+    Validate one submitted form
+    :param form: name of the form, a key of RULES
+    :param data: mapping of the submitted fields, e.g. request.form
+    :param first_error: stop at the first error, like the pages do
+    :return: (converted values, list of errors), each error a dict with
+        the field, the check and the message
+    """
+    fields, rules = FORMS[form]
+    return _validate(fields, rules, data, first_error)
+
+
+def validate_batch(form, records):
+    """
+    Validate many records of the same form, e.g. an import
+    :param form: name of the form, a key of RULES
+    :param records: iterable of mappings
+    :return: list of (converted values, list of errors), one per record,
+        with every failing field of the record reported
+    """
+    fields, rules = FORMS[form]
+    return [_validate(fields, rules, record, False) for record in records]
@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+import pytest
+import qa327
+
+"""
+This file tests the application factory and the startup report: the
+package is imported without Flask, and an app and its tables are only
+made when asked for
+"""
+
+# runs in a new process, so the app of the test server is left alone
+CREATE_APP = '''
+import sys
+import qa327
+assert 'flask' not in sys.modules and 'sqlalchemy' not in sys.modules, 'imported too early'
+app = qa327.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + sys.argv[1], 'STATS_ENABLED': False})
+from sqlalchemy import inspect
+from qa327.models import db, init_db
+with app.app_context():
+    assert 'user' not in inspect(db.engine).get_table_names(), 'tables created too early'
+    init_db()
+    assert {'user', 'ticket'} <= set(inspect(db.engine).get_table_names())
+client = app.test_client()
+assert client.get('/login').status_code == 200
+assert client.get('/stats/pool').status_code == 404
+assert qa327.app is qa327.app
+# the pool settings given to the factory are the ones used
+mysql = qa327.create_app({'SQLALCHEMY_DATABASE_URI': 'mysql+pymysql://user:pw@localhost/qa327',
+                          'DB_POOL_SIZE': 3, 'DB_POOL_PRE_PING': False})
+assert mysql.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'] == 3
+assert mysql.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'] is False
+assert mysql.config['STATS_ENABLED'] is False
+# each app has its own caches, the first one is left as it was
+import qa327.backend as bn
+assert bn.get_state(mysql) is not bn.get_state(app)
+assert bn.get_state(mysql)['user_cache'] is not bn.get_state(app)['user_cache']
+with app.app_context():
+    assert bn.get_state() is app.extensions['qa327']
+assert client.get('/login').status_code == 200
+'''
+
+
+def run(args, tmp_path):
+    env = dict(os.environ, DB_NAME=str(tmp_path / 'db.sqlite').lstrip('/'), PASSWORD_HASH_WORKERS='0')
+    return subprocess.run([sys.executable] + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          cwd=os.path.dirname(os.path.dirname(qa327.__file__)), env=env,
+                          universal_newlines=True, timeout=120)
+
+
+@pytest.mark.usefixtures('server')
+def test_create_app_binds_lazily(tmp_path):
+    result = run(['-c', CREATE_APP, str(tmp_path / 'factory.sqlite')], tmp_path)
+    assert result.returncode == 0, result.stdout
+
+
+@pytest.mark.usefixtures('server')
+def test_startup_report_and_budget(tmp_path):
+    result = run(['-m', 'qa327', 'startup'], tmp_path)
+    assert result.returncode == 0, result.stdout
+    for step in ('import the application', 'create the app', 'first request GET /login', 'cold start'):
+        assert step in result.stdout
+    assert os.path.exists(str(tmp_path / 'db.sqlite'))
+
+    # no process starts in a microsecond
+    result = run(['-m', 'qa327', 'startup', '--budget-ms', '0.001'], tmp_path)
+    assert result.returncode == 1
+    assert 'over the budget' in result.stdout
@@ -0,0 +1,32 @@
+import datetime
+import pytest
+import qa327.backend as bn
+from qa327.models import db, Ticket, ArchivedTicket
+
+"""
+This file tests the archival of expired tickets
+"""
+
+
+@pytest.mark.usefixtures('server')
+def test_archive_expired_tickets_in_batches():
+    db.session.query(Ticket).delete()
+    db.session.query(ArchivedTicket).delete()
+    db.session.commit()
+    for i in range(7):
+        bn.sell_ticket('old%d' % i, 10, 20, '20200101', 'archive@test.com')
+    bn.sell_ticket('current', 10, 20, '20301210', 'archive@test.com')
+    old_ids = [ticket.id for ticket in Ticket.query.filter(Ticket.name.like('old%'))]
+
+    assert bn.archive_expired_tickets(batch_size=3) == 7
+    # only the ticket that has not expired stays in the hot table
+    assert [ticket.name for ticket in Ticket.query.all()] == ['current']
+
+    archived = bn.get_archived_tickets('archive@test.com')
+    assert sorted(ticket.id for ticket in archived) == sorted(old_ids)
+    assert all(ticket.archived is not None for ticket in archived)
+    assert bn.get_archived_tickets(since=datetime.date(2021, 1, 1)) == []
+    # archived tickets are gone from the search index too
+    assert bn.search_tickets('old0') == ([], None)
+
+    assert bn.archive_expired_tickets() == 0
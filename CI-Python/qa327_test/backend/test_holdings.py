@@ -0,0 +1,30 @@
+import pytest
+import qa327.backend as bn
+from qa327.models import db, User, Ticket, Holding
+
+"""
+This file tests that purchases are recorded in the buyer's holdings
+"""
+
+
+@pytest.mark.usefixtures('server')
+def test_purchase_is_recorded_in_holdings():
+    db.session.query(Ticket).delete()
+    for email in ['holder@test.com', 'holdseller@test.com']:
+        if not bn.get_user(email):
+            bn.register_user(email, 'holder', 'Holder_pw1', 'Holder_pw1')
+    buyer = bn.get_user('holder@test.com')
+    Holding.query.filter_by(buyer_id=buyer.id).delete()
+    db.session.commit()
+    bn.sell_ticket('h1', 10, 20, '20301210', 'holdseller@test.com')
+    bn.sell_ticket('h2', 10, 30, '20301210', 'holdseller@test.com')
+
+    assert bn.buy_ticket(buyer, bn.get_ticket('h1'), 2) is None
+    assert bn.buy_ticket(buyer, bn.get_ticket('h2'), 1) is None
+    # a failed purchase leaves no holding behind
+    assert bn.buy_ticket(buyer, bn.get_ticket('h2'), 50) is not None
+
+    holdings = bn.get_user_holdings(buyer)
+    assert [(h.name, h.quantity, h.price_cents) for h in holdings] == [('h2', 1, 3000), ('h1', 2, 2000)]
+    assert holdings[0].ticket_id == bn.get_ticket('h2').id
+    assert bn.get_user_holdings(bn.get_user('holdseller@test.com')) == []
@@ -0,0 +1,55 @@
+import pytest
+import qa327.backend as bn
+from qa327.models import db, User, LedgerEntry
+
+"""
+This file tests the money ledger and the materialized user balances
+"""
+
+
+def fresh_user(email):
+    user = bn.get_user(email)
+    if user:
+        LedgerEntry.query.filter_by(user_id=user.id).delete()
+        db.session.delete(user)
+        db.session.commit()
+    bn.register_user(email, 'ledger', 'Ledger_pw1', 'Ledger_pw1')
+    return bn.get_user(email)
+
+
+@pytest.mark.usefixtures('server')
+def test_register_posts_opening_balance():
+    user = fresh_user('ledger_signup@test.com')
+    assert user.balance_cents == bn.OPENING_BALANCE_CENTS
+    assert user.balance == 5000
+    entries = bn.get_ledger(user)
+    assert [(entry.kind, entry.amount_cents) for entry in entries] == [('signup', 500000)]
+
+
+@pytest.mark.usefixtures('server')
+def test_purchase_cost_is_integer_cents():
+    # 2 tickets at $15.50 + 35% fee + 5% tax = $43.9425, rounded to $43.94
+    assert bn.purchase_cost_cents(15.5, 2) == 4394
+    assert bn.purchase_cost_cents(100, 1) == 14175
+
+
+@pytest.mark.usefixtures('server')
+def test_post_ledger_entry_requires_funds():
+    user = fresh_user('ledger_funds@test.com')
+    assert not bn.post_ledger_entry(user.id, 'big', 'purchase', -500001, require_funds=True)
+    assert bn.post_ledger_entry(user.id, 'small', 'purchase', -100, require_funds=True)
+    db.session.commit()
+
+    db.session.refresh(user)
+    assert user.balance_cents == 500000 - 100
+    mismatched = [row[0] for row in bn.reconcile_balances()]
+    assert user.id not in mismatched
+
+
+@pytest.mark.usefixtures('server')
+def test_reconcile_finds_drifted_balance():
+    user = fresh_user('ledger_drift@test.com')
+    # change the balance behind the ledger's back
+    User.query.filter_by(id=user.id).update({'balance_cents': 1})
+    db.session.commit()
+    assert (user.id, 1, 500000) in bn.reconcile_balances()
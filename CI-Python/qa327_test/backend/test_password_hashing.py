@@ -0,0 +1,71 @@
+import threading
+import pytest
+import qa327.backend as bn
+from qa327 import load_config
+from qa327.hashing import PasswordHasher, HasherBusy, calibrate
+from qa327.models import db, User
+from werkzeug.security import generate_password_hash
+
+"""
+This file tests the password hashing pool, its calibration and the
+rehashing of old password hashes at login
+"""
+
+
+@pytest.mark.usefixtures('server')
+def test_calibration_is_bounded():
+    assert calibrate(0.0001, 1000) == 1000
+    assert calibrate(1000, 1000) == 10000000
+
+
+@pytest.mark.usefixtures('server')
+def test_iterations_are_known_before_the_first_hash():
+    # calibrated when the app is made, not by the first request
+    assert bn.get_state()['password_hasher'].iterations >= bn.get_state()['password_hasher'].min_iterations
+    # or given, e.g. to the processes the server starts again on a reload
+    hasher = PasswordHasher(workers=0, queue_depth=0, target=0.1, min_iterations=1000, iterations=12345)
+    assert hasher.method == 'pbkdf2:sha256:12345'
+    assert load_config({'PASSWORD_HASH_ITERATIONS': '12345'})['PASSWORD_HASH_ITERATIONS'] == 12345
+    assert load_config({})['PASSWORD_HASH_ITERATIONS'] is None
+
+
+@pytest.mark.usefixtures('server')
+def test_old_sha256_hash_is_replaced_at_login():
+    email = 'rehash@test.com'
+    if not bn.get_user(email):
+        bn.register_user(email, 'rehash', 'Rehash_pw1', 'Rehash_pw1')
+    user = bn.get_user(email)
+    assert user.password.startswith('pbkdf2:sha256:')
+    user.password = generate_password_hash('Rehash_pw1', method='sha256')
+    db.session.commit()
+
+    assert bn.login_user(email, 'Wrong_pw1') is None
+    assert bn.get_user(email).password.startswith('sha256$')
+    assert bn.login_user(email, 'Rehash_pw1') is not None
+    db.session.expire_all()
+    password = User.query.filter_by(email=email).first().password
+    assert password.startswith(bn.get_state()['password_hasher'].method + '$')
+    assert bn.login_user(email, 'Rehash_pw1') is not None
+    assert not bn.get_state()['password_hasher'].needs_rehash(password)
+
+
+@pytest.mark.usefixtures('server')
+def test_full_pool_turns_requests_away():
+    hasher = PasswordHasher(workers=1, queue_depth=1, target=0.2, min_iterations=1000)
+    results = []
+
+    def hash_password():
+        try:
+            results.append(hasher.hash('Password!'))
+        except HasherBusy:
+            results.append(None)
+
+    threads = [threading.Thread(target=hash_password) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # one password is hashed, one waits, the others are turned away
+    assert results.count(None) >= 3
+    assert hasher.stats()['rejected'] == results.count(None)
+    assert hasher.check([result for result in results if result][0], 'Password!')
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import pytest
+from sqlalchemy import create_engine, exc
+from qa327 import load_config
+from qa327.pool import MeteredQueuePool, engine_options, get_pool_stats
+
+"""
+This file tests the connection pool settings and statistics
+"""
+
+
+def test_engine_options_from_config():
+    options = engine_options({'DB_POOL_SIZE': '8', 'DB_POOL_MAX_OVERFLOW': '2',
+                              'DB_POOL_RECYCLE': '600', 'DB_POOL_PRE_PING': '0'})
+    assert options['poolclass'] is MeteredQueuePool
+    assert options['pool_size'] == 8
+    assert options['max_overflow'] == 2
+    assert options['pool_recycle'] == 600
+    assert options['pool_pre_ping'] is False
+    assert engine_options({})['pool_pre_ping'] is True
+    # the typed values of the app config work the same
+    options = engine_options(load_config({'DB_POOL_SIZE': '8', 'DB_POOL_PRE_PING': '0'}))
+    assert options['pool_size'] == 8 and options['pool_pre_ping'] is False
+
+
+def test_pool_stats_count_checkouts_and_timeouts():
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        engine = create_engine('sqlite:///' + os.path.join(tmp_folder, 'pool.sqlite'),
+                               poolclass=MeteredQueuePool, pool_size=1, max_overflow=0,
+                               pool_timeout=0.1)
+        first = engine.connect()
+        stats = get_pool_stats(engine)
+        assert stats['checked_out'] == 1
+        assert stats['checkouts'] == 1
+
+        # the only connection is in use, so the next caller waits and times out
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        stats = get_pool_stats(engine)
+        assert stats['timeouts'] == 1
+        assert stats['wait_max'] >= 0.1
+
+        first.close()
+        assert get_pool_stats(engine)['checked_in'] == 1
+        engine.dispose()
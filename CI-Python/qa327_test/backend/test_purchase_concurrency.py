@@ -0,0 +1,95 @@
+import datetime
+import threading
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.models import db, User, Ticket, LedgerEntry
+
+"""
+This file stress tests the purchase transaction with many simultaneous buyers
+"""
+
+BUYERS = 10
+PURCHASES = 200
+STOCK = 50
+PRICE = 20
+
+
+def reset_data():
+    db.session.query(Ticket).delete()
+    old_ids = db.session.query(User.id).filter(User.email.like('%@stress.com'))
+    db.session.query(LedgerEntry).filter(LedgerEntry.user_id.in_(old_ids.subquery())).delete(
+        synchronize_session=False)
+    old_ids.delete(synchronize_session=False)
+    db.session.commit()
+    db.session.add(User(email='seller@stress.com', name='seller', password='x', balance=0))
+    for i in range(BUYERS):
+        buyer = User(email='buyer%d@stress.com' % i, name='buyer', password='x', balance=0)
+        db.session.add(buyer)
+        db.session.flush()
+        bn.post_ledger_entry(buyer.id, 'opening', 'signup', 500000)
+    db.session.commit()
+    bn.sell_ticket('stress', STOCK, PRICE, '20301210', 'seller@stress.com')
+
+
+@pytest.mark.usefixtures('server')
+def test_concurrent_purchases_do_not_oversell():
+    reset_data()
+    ticket_id = bn.get_ticket('stress').id
+    buyer_ids = [user.id for user in User.query.filter(User.email.like('buyer%@stress.com'))]
+
+    start = threading.Barrier(PURCHASES)
+    results = []
+
+    def purchase(buyer_id):
+        with app.app_context():
+            buyer = User.query.get(buyer_id)
+            ticket = Ticket.query.get(ticket_id)
+            start.wait()
+            results.append(bn.buy_ticket(buyer, ticket, 1))
+            db.session.remove()
+
+    threads = [threading.Thread(target=purchase, args=(buyer_ids[i % BUYERS],))
+               for i in range(PURCHASES)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db.session.expire_all()
+    sold = results.count(None)
+    assert sold == STOCK
+    assert results.count("Requested quantity larger than available tickets") == PURCHASES - STOCK
+    assert Ticket.query.get(ticket_id).quantity == 0
+
+    # every successful purchase moved money exactly once
+    seller = User.query.filter_by(email='seller@stress.com').one()
+    assert seller.balance == STOCK * PRICE
+    spent = sum(500000 - User.query.get(buyer_id).balance_cents for buyer_id in buyer_ids)
+    assert spent == STOCK * bn.purchase_cost_cents(PRICE, 1)
+    # the ledger still adds up to the materialized balances
+    mismatched = [row[0] for row in bn.reconcile_balances()]
+    assert not set(mismatched) & set(buyer_ids + [seller.id])
+
+
+@pytest.mark.usefixtures('server')
+def test_purchase_uses_the_current_price_and_date():
+    reset_data()
+    buyer = User.query.filter_by(email='buyer0@stress.com').one()
+    ticket = bn.get_ticket('stress')
+
+    # the seller changes the price, in another request, after the buyer loaded the ticket
+    db.engine.execute(Ticket.__table__.update().where(Ticket.id == ticket.id).values(price=PRICE + 10))
+    assert bn.buy_ticket(buyer, ticket, 1) == "Ticket price changed, please try again"
+    db.session.expire_all()
+    assert User.query.get(buyer.id).balance_cents == 500000
+
+    # the ticket expired, it can still be found by name but not bought
+    ticket = bn.get_ticket('stress')
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    db.session.execute(Ticket.__table__.update().where(Ticket.id == ticket.id).values(date=yesterday))
+    db.session.commit()
+    assert bn.buy_ticket(buyer, bn.get_ticket('stress'), 1) == "Ticket has expired"
+    db.session.expire_all()
+    assert Ticket.query.get(ticket.id).quantity == STOCK
+    assert User.query.get(buyer.id).balance_cents == 500000
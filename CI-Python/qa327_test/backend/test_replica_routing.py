@@ -0,0 +1,61 @@
+import os
+import tempfile
+import time
+import pytest
+from flask import session
+import qa327.backend as bn
+from qa327 import app
+from qa327.models import db, User, Ticket
+from qa327.routing import get_replica_engines
+
+"""
+This file tests the routing of read-only backend functions to a read
+replica, using a second sqlite file as the replica
+"""
+
+
+@pytest.fixture
+def replica():
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        app.config['SQLALCHEMY_REPLICA_URIS'] = ['sqlite:///' + os.path.join(tmp_folder, 'replica.sqlite')]
+        engines, _ = get_replica_engines(app)
+        db.metadata.create_all(bind=engines[0])
+        # only the replica knows this user, so reads that return it came from the replica
+        engines[0].execute(User.__table__.insert().values(
+            email='replica_only@test.com', name='replica', password='x', balance_cents=0))
+        yield engines[0]
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        get_replica_engines(app)
+
+
+@pytest.mark.usefixtures('server')
+def test_reads_go_to_replica(replica):
+    with app.app_context():
+        assert bn.get_user('replica_only@test.com') is not None
+        # a query outside of a read-only backend function goes to the primary
+        assert User.query.filter_by(email='replica_only@test.com').first() is None
+        db.session.remove()
+
+
+@pytest.mark.usefixtures('server')
+def test_writes_go_to_primary_and_pin_reads(replica):
+    with app.app_context():
+        db.session.query(Ticket).filter_by(name='routed').delete()
+        db.session.commit()
+        bn.sell_ticket('routed', 10, 20, '20301210', 'seller@test.com')
+        assert replica.execute("SELECT count(*) FROM ticket WHERE name = 'routed'").scalar() == 0
+        # after the write, this context reads its own writes from the primary
+        assert bn.get_ticket('routed') is not None
+        assert bn.get_user('replica_only@test.com') is None
+        db.session.remove()
+
+
+@pytest.mark.usefixtures('server')
+def test_client_reads_from_primary_after_writing(replica):
+    # the client's session cookie remembers when it last wrote
+    with app.test_request_context():
+        session['db_write_at'] = time.time() - 60
+        assert bn.get_user('replica_only@test.com') is not None
+        session['db_write_at'] = time.time()
+        assert bn.get_user('replica_only@test.com') is None
+        db.session.remove()
@@ -0,0 +1,54 @@
+import pytest
+import qa327.backend as bn
+from qa327.models import db, Ticket
+
+"""
+This file tests the full-text ticket search
+"""
+
+
+def fill_tickets():
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    for name in ['Jazz Night', 'Rock Night', 'Rock Festival', 'Jazz Brunch', 'Opera']:
+        bn.sell_ticket(name, 10, 20, '20301210', 'seller@test.com')
+    bn.sell_ticket('Old Rock', 10, 20, '20200101', 'seller@test.com')
+
+
+@pytest.mark.usefixtures('server')
+def test_search_matches_words_and_prefix():
+    fill_tickets()
+    tickets, next_page = bn.search_tickets('rock')
+    # the expired ticket is not a search result
+    assert sorted(ticket.name for ticket in tickets) == ['Rock Festival', 'Rock Night']
+    assert next_page is None
+
+    tickets, _ = bn.search_tickets('night jaz')
+    assert [ticket.name for ticket in tickets] == ['Jazz Night']
+
+
+@pytest.mark.usefixtures('server')
+def test_search_is_paginated():
+    fill_tickets()
+    first, next_page = bn.search_tickets('night', 1, 1)
+    assert len(first) == 1 and next_page == 2
+    second, next_page = bn.search_tickets('night', 2, 1)
+    assert len(second) == 1 and next_page is None
+    assert first[0].id != second[0].id
+
+
+@pytest.mark.usefixtures('server')
+def test_search_follows_ticket_changes():
+    fill_tickets()
+    db.session.query(Ticket).filter_by(name='Opera').delete()
+    db.session.commit()
+    assert bn.search_tickets('opera') == ([], None)
+
+
+@pytest.mark.usefixtures('server')
+def test_search_ignores_query_syntax():
+    fill_tickets()
+    assert bn.search_tickets('') == ([], None)
+    assert bn.search_tickets('"*') == ([], None)
+    tickets, _ = bn.search_tickets('rock: "night')
+    assert [ticket.name for ticket in tickets] == ['Rock Night']
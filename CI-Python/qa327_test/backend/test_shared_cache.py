@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import threading
+import time
+import pytest
+from qa327.cache import SharedMemory, SharedCache, SharedVersionCounter
+
+"""
+This file tests the cache and version counters shared by the workers
+through a memory mapped file
+"""
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='the shared cache needs a POSIX system')
+
+
+def sell_in_other_worker(path):
+    # what a sale does in another worker: bump the version and drop the user
+    memory = SharedMemory(path)
+    SharedVersionCounter(memory, 'inventory').bump()
+    SharedCache(memory, 'users', 60).invalidate('buyer@test.com')
+
+
+@pytest.mark.usefixtures('server')
+def test_changes_are_seen_by_other_processes(tmp_path):
+    path = str(tmp_path / 'cache')
+    memory = SharedMemory(path, slots=64, slot_size=1024)
+    users = SharedCache(memory, 'users', 60)
+    version = SharedVersionCounter(memory, 'inventory')
+    users.set('buyer@test.com', {'id': 1, 'balance_cents': 500})
+    assert users.get('buyer@test.com') == {'id': 1, 'balance_cents': 500}
+    assert version.value == 0
+
+    worker = multiprocessing.get_context('fork').Process(target=sell_in_other_worker, args=(path,))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    assert version.value == 1
+    assert users.get('buyer@test.com') is None
+    # a new worker opening the file shares its epoch and geometry
+    other = SharedMemory(path, slots=8, slot_size=64)
+    assert (other.epoch, other.slots, other.slot_size) == (memory.epoch, 64, 1024)
+    assert SharedVersionCounter(other, 'inventory').tag == version.tag
+
+
+def bump_inherited(memory, result):
+    # a worker forked after the file was opened uses the object it inherited
+    inherited = memory._map
+    SharedVersionCounter(memory, 'inventory').bump()
+    result.put((inherited.closed, memory._map is not inherited))
+
+
+@pytest.mark.usefixtures('server')
+def test_forked_workers_reopen_the_file(tmp_path):
+    memory = SharedMemory(str(tmp_path / 'cache'), slots=8, slot_size=256)
+    version = SharedVersionCounter(memory, 'inventory')
+    context = multiprocessing.get_context('fork')
+    result = context.Queue()
+    worker = context.Process(target=bump_inherited, args=(memory, result))
+    worker.start()
+    # the inherited mapping is closed, not left open next to the new one
+    assert result.get(timeout=30) == (True, True)
+    worker.join()
+    assert worker.exitcode == 0
+    assert version.value == 1
+    assert not memory._map.closed
+
+
+def bump_from_threads(memory, threads, bumps, result):
+    # the request threads of a new worker all use the inherited file at once
+    version = SharedVersionCounter(memory, 'inventory')
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def bump():
+        barrier.wait()
+        try:
+            for _ in range(bumps):
+                version.bump()
+        except Exception as error:
+            errors.append(repr(error))
+
+    workers = [threading.Thread(target=bump) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    result.put(errors)
+
+
+@pytest.mark.usefixtures('server')
+def test_forked_worker_threads_reopen_the_file_once(tmp_path):
+    memory = SharedMemory(str(tmp_path / 'cache'), slots=8, slot_size=256)
+    version = SharedVersionCounter(memory, 'inventory')
+    context = multiprocessing.get_context('fork')
+    for _ in range(10):
+        result = context.Queue()
+        worker = context.Process(target=bump_from_threads, args=(memory, 8, 20, result))
+        worker.start()
+        assert result.get(timeout=30) == []
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+    assert version.value == 10 * 8 * 20
+
+
+@pytest.mark.usefixtures('server')
+def test_slots_expire_evict_and_reject_large_values(tmp_path):
+    memory = SharedMemory(str(tmp_path / 'cache'), slots=8, slot_size=256)
+    fragments = SharedCache(memory, 'fragments', 60)
+    # keys of different caches do not collide
+    SharedCache(memory, 'users', 60).set('key', 'user')
+    fragments.set('key', 'fragment')
+    assert fragments.get('key') == 'fragment'
+
+    fragments.set('large', 'x' * 1000)
+    assert fragments.get('large') is None
+    assert fragments.stats()['too_large'] == 1
+
+    # 8 slots: most of 100 keys are evicted, the last one written stays
+    for i in range(100):
+        fragments.set(('page', i), i)
+    assert fragments.get(('page', 99)) == 99
+    assert sum(fragments.get(('page', i)) is not None for i in range(100)) <= 8
+
+    short = SharedCache(memory, 'short', 0.05)
+    short.set('key', 'value')
+    time.sleep(0.1)
+    assert short.get('key') is None
+
+    fragments.clear()
+    assert fragments.get(('page', 99)) is None
@@ -0,0 +1,53 @@
+import datetime
+import pytest
+import qa327.backend as bn
+from qa327.models import db, Ticket
+
+"""
+This file tests the ticket expiry dates and the SQL side expiry filtering
+"""
+
+
+@pytest.mark.usefixtures('server')
+def test_parse_ticket_date():
+    assert bn.parse_ticket_date('20301210') == datetime.date(2030, 12, 10)
+    assert bn.parse_ticket_date(datetime.date(2030, 12, 10)) == datetime.date(2030, 12, 10)
+    # wrong month, wrong day, not zero padded, not a number
+    for invalid in ['20301310', '20300230', '2030121', 'abcdefgh', '', None]:
+        assert bn.parse_ticket_date(invalid) is None
+
+
+@pytest.mark.usefixtures('server')
+def test_listing_drops_expired_tickets():
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    bn.sell_ticket('expired', 10, 20, yesterday, 'seller@test.com')
+    bn.sell_ticket('today', 10, 20, datetime.date.today(), 'seller@test.com')
+    bn.sell_ticket('future', 10, 20, '20301210', 'seller@test.com')
+
+    assert bn.get_ticket('future').date == datetime.date(2030, 12, 10)
+    assert [ticket.name for ticket in bn.get_all_tickets()] == ['today', 'future']
+    tickets, _ = bn.get_tickets_page(None, 10, 'date')
+    assert [ticket.name for ticket in tickets] == ['today', 'future']
+
+
+@pytest.mark.usefixtures('server')
+def test_migration_drops_dates_that_do_not_exist():
+    from qa327.models import migrate_ticket_dates
+    db.session.query(Ticket).delete()
+    # rows of older versions: dates as YYYYMMDD text, days never checked,
+    # and one converted by an earlier run of the migration
+    for name, date in [('valid', '20301210'), ('bad_day', '20301299'), ('zeros', '20300000'),
+                       ('converted', '2030-02-30'), ('done', '2030-12-11')]:
+        db.session.execute("INSERT INTO ticket (email, name, quantity, price, date)"
+                           " VALUES ('seller@test.com', :name, 10, 20, :date)", {'name': name, 'date': date})
+    db.session.commit()
+    migrate_ticket_dates()
+    db.session.expire_all()
+
+    tickets, _ = bn.get_tickets_page(None, 10, 'date')
+    assert [(ticket.name, ticket.date) for ticket in tickets] == [('valid', datetime.date(2030, 12, 10)),
+                                                                  ('done', datetime.date(2030, 12, 11))]
+    dates = dict((ticket.name, ticket.date) for ticket in Ticket.query.all())
+    assert dates['bad_day'] is None and dates['zeros'] is None and dates['converted'] is None
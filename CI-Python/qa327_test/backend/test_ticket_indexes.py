@@ -0,0 +1,30 @@
+import pytest
+import qa327.backend as bn
+from qa327.models import db, Ticket
+from sqlalchemy import inspect
+
+"""
+This file tests the indexed ticket lookups in the backend
+"""
+
+
+@pytest.mark.usefixtures('server')
+def test_ticket_lookup_columns_are_indexed():
+    # name, seller email and expiry date must each be covered by an index
+    indexed = set()
+    for index in inspect(db.engine).get_indexes('ticket'):
+        indexed.update(index['column_names'])
+    assert {'name', 'email', 'date'} <= indexed
+
+
+@pytest.mark.usefixtures('server')
+def test_get_tickets_by_seller():
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    bn.sell_ticket('t1', 10, 20, '20301210', 'seller_a@test.com')
+    bn.sell_ticket('t2', 10, 20, '20301210', 'seller_b@test.com')
+    bn.sell_ticket('t3', 10, 20, '20301210', 'seller_a@test.com')
+
+    tickets = bn.get_tickets_by_seller('seller_a@test.com')
+    assert [ticket.name for ticket in tickets] == ['t1', 't3']
+    assert bn.get_tickets_by_seller('nobody@test.com') == []
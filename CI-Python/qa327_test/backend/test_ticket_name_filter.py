@@ -0,0 +1,81 @@
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.bloom import BloomFilter, NameFilter
+from qa327.models import db, Ticket
+
+"""
+This file tests the Bloom filter of ticket names that answers lookups of
+names that were never listed
+"""
+
+
+@pytest.mark.usefixtures('server')
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add('ticket%d' % i)
+    assert all('ticket%d' % i in bloom for i in range(1000))
+    false_positives = sum('other%d' % i in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+@pytest.mark.usefixtures('server')
+def test_missing_names_are_answered_without_query(monkeypatch):
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    bn.get_state()['ticket_names'].rebuild()
+    bn.sell_ticket('listed', 10, 20, '20301210', 'seller@test.com')
+
+    queries = []
+    find_ticket = bn.find_ticket
+    monkeypatch.setattr(bn, 'find_ticket', lambda name: queries.append(name) or find_ticket(name))
+    assert bn.get_ticket('listed').name == 'listed'
+    assert bn.get_ticket('never listed') is None
+    assert bn.get_ticket(-1000) is None
+    assert queries == ['listed']
+
+    # a ticket listed without sell_ticket, e.g. by another worker, is
+    # found once the inventory version changes
+    db.session.add(Ticket(name='elsewhere', quantity=1, price=20, email='seller@test.com',
+                          date=bn.parse_ticket_date('20301210')))
+    db.session.commit()
+    bn.get_state()['inventory_version'].bump()
+    assert bn.get_ticket('elsewhere').name == 'elsewhere'
+    assert bn.get_cache_stats()['ticket_names']['rejected'] >= 2
+
+
+@pytest.mark.usefixtures('server')
+def test_filter_grows_past_capacity():
+    rows = [(i, 'name%d' % i) for i in range(1, 501)]
+    names = NameFilter(lambda after_id: [row for row in rows if row[0] > after_id], capacity=100)
+    assert names.might_exist('name1', 0)
+    assert names.stats()['capacity'] >= 500
+    rows.append((501, 'late'))
+    assert names.might_exist('late', 1)
+
+
+@pytest.mark.usefixtures('server')
+def test_rows_are_loaded_outside_the_lock():
+    rows = [(i, 'name%d' % i) for i in range(1, 51)]
+
+    def load(after_id):
+        # lookups of other threads can go on while the table is read
+        assert not names._lock.locked()
+        return [row for row in rows if row[0] > after_id]
+
+    names = NameFilter(load, capacity=100)
+    names.refresh(0)
+    assert names.stats()['names'] == 50
+    rows.append((51, 'late'))
+    assert not names.might_exist('late', 0)
+    assert names.might_exist('late', 1)
+    assert names.stats()['refreshes'] == 2
+
+
+@pytest.mark.usefixtures('server')
+def test_filter_is_built_before_the_first_request():
+    assert bn.build_ticket_names in app.before_first_request_funcs
+    bn.get_state()['ticket_names'].rebuild()
+    bn.build_ticket_names()
+    assert bn.get_state()['ticket_names'].stats()['names'] == Ticket.query.count()
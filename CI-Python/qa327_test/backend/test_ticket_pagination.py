@@ -0,0 +1,86 @@
+import pytest
+import qa327.backend as bn
+from qa327.models import db, Ticket
+
+"""
+This file tests the keyset pagination of the ticket listing
+"""
+
+
+def fill_tickets():
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    # only 3 distinct prices, so sorting by price needs the id tie breaker
+    for i in range(25):
+        bn.sell_ticket('t%02d' % i, 10, 10 + i % 3, '20301210', 'seller@test.com')
+
+
+def walk_pages(limit, sort):
+    seen = []
+    after = None
+    while True:
+        tickets, after = bn.get_tickets_page(after, limit, sort)
+        assert len(tickets) <= limit
+        seen.extend(tickets)
+        if after is None:
+            return seen
+
+
+@pytest.mark.usefixtures('server')
+def test_get_tickets_page_by_id():
+    fill_tickets()
+    tickets, after = bn.get_tickets_page(None, 10)
+    assert [ticket.name for ticket in tickets] == ['t%02d' % i for i in range(10)]
+    assert bn.decode_cursor(after) == (tickets[-1].id, tickets[-1].id)
+
+    seen = walk_pages(10, 'id')
+    assert [ticket.name for ticket in seen] == ['t%02d' % i for i in range(25)]
+
+
+@pytest.mark.usefixtures('server')
+def test_get_tickets_page_sorted_with_ties():
+    fill_tickets()
+    seen = walk_pages(4, 'price')
+    assert len(seen) == 25
+    assert len(set(ticket.id for ticket in seen)) == 25
+    keys = [(ticket.price, ticket.id) for ticket in seen]
+    assert keys == sorted(keys)
+
+
+@pytest.mark.usefixtures('server')
+def test_get_tickets_page_last_page_has_no_cursor():
+    fill_tickets()
+    tickets, after = bn.get_tickets_page(None, 25)
+    assert len(tickets) == 25
+    assert after is None
+
+
+@pytest.mark.usefixtures('server')
+def test_get_tickets_page_after_the_last_ticket_is_deleted():
+    fill_tickets()
+    for sort in ('price', 'name', 'id'):
+        first, after = bn.get_tickets_page(None, 4, sort)
+        keys = [(getattr(ticket, sort), ticket.id) for ticket in first]
+        # the ticket the cursor points at is gone before the next page is read
+        db.session.delete(first[-1])
+        db.session.commit()
+        second, _ = bn.get_tickets_page(after, 4, sort)
+        assert len(second) == 4
+        keys += [(getattr(ticket, sort), ticket.id) for ticket in second]
+        # the next page starts right after the deleted ticket
+        assert keys == sorted(set(keys))
+
+
+@pytest.mark.usefixtures('server')
+def test_get_tickets_page_invalid_cursor():
+    fill_tickets()
+    _, after = bn.get_tickets_page(None, 4, 'price')
+    for cursor, sort in [('5', 'price'), ('not a cursor', 'id'), (after, 'date'), (after, 'name')]:
+        with pytest.raises(ValueError):
+            bn.get_tickets_page(cursor, 4, sort)
+
+
+@pytest.mark.usefixtures('server')
+def test_get_tickets_page_unknown_sort():
+    with pytest.raises(ValueError):
+        bn.get_tickets_page(None, 10, 'password')
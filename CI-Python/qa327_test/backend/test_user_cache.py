@@ -0,0 +1,73 @@
+import time
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.cache import TTLCache
+from qa327.models import db, Ticket
+
+"""
+This file tests the user identity caches
+"""
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # 'b' was used least recently
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.set('a', 1)
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+
+def register(email):
+    if not bn.get_user(email):
+        bn.register_user(email, 'cached', 'Cached_pw1', 'Cached_pw1')
+
+
+@pytest.mark.usefixtures('server')
+def test_cached_user_is_rebuilt_without_query():
+    register('cached@test.com')
+    bn.invalidate_user('cached@test.com')
+    with app.app_context():
+        first = bn.get_cached_user('cached@test.com')
+        # same object within the same request
+        assert bn.get_cached_user('cached@test.com') is first
+    hits = bn.get_state()['user_cache'].hits
+    with app.app_context():
+        user = bn.get_cached_user('cached@test.com')
+        assert bn.get_state()['user_cache'].hits == hits + 1
+        assert user.email == 'cached@test.com' and user.balance_cents == first.balance_cents
+        # the rebuilt user is attached to the session like a loaded one
+        assert user in db.session
+        db.session.remove()
+
+
+@pytest.mark.usefixtures('server')
+def test_purchase_invalidates_cached_balances():
+    register('cached_buyer@test.com')
+    register('cached_seller@test.com')
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    bn.sell_ticket('cached', 10, 20, '20301210', 'cached_seller@test.com')
+    with app.app_context():
+        buyer = bn.get_cached_user('cached_buyer@test.com')
+        seller = bn.get_cached_user('cached_seller@test.com')
+        before = buyer.balance_cents, seller.balance_cents
+        assert bn.buy_ticket(buyer, bn.get_ticket('cached'), 1) is None
+        db.session.remove()
+    with app.app_context():
+        assert bn.get_cached_user('cached_buyer@test.com').balance_cents == before[0] - bn.purchase_cost_cents(20, 1)
+        assert bn.get_cached_user('cached_seller@test.com').balance_cents == before[1] + 2000
+        db.session.remove()
@@ -0,0 +1,72 @@
+import datetime
+import pytest
+from qa327 import validation
+
+"""
+This file tests the compiled form validation rules
+"""
+
+
+def first_message(form, data):
+    values, errors = validation.validate(form, data)
+    return errors[0]['message'] if errors else None
+
+
+@pytest.mark.usefixtures('server')
+def test_register_messages_in_order():
+    form = dict(email='user@test.com', name='user', password='Password!', password2='Password!')
+    assert first_message('register', form) is None
+    # the first failing check is reported, in the order the page checks them
+    assert first_message('register', dict(form, password2='x', email='bad')) == "The passwords do not match"
+    assert first_message('register', dict(form, email='bad', name='x')) == "Email format is incorrect"
+    assert first_message('register', dict(form, password='password', password2='password')) == \
+        "Password format is incorrect"
+    assert first_message('register', dict(form, name='us')) == "Name length formatting error"
+    assert first_message('register', dict(form, name='us!er')) == "Name contains special characters"
+    assert first_message('register', dict(form, name=' user')) == "Invalid spaces found in word"
+
+
+@pytest.mark.usefixtures('server')
+def test_sell_converts_values():
+    values, errors = validation.validate('sell', dict(name='concert', quantity='5', price='15.5',
+                                                      exp_date='20301210'))
+    assert errors == []
+    assert values == dict(name='concert', quantity=5, price=15.5, exp_date=datetime.date(2030, 12, 10))
+    form = dict(name='concert', quantity='5', price='15', exp_date='20301210')
+    assert first_message('sell', dict(form, name='x' * 61)) == "Ticket name is too long"
+    assert first_message('sell', dict(form, quantity='0')) == "Invalid quantity of tickets"
+    assert first_message('sell', dict(form, quantity='many')) == "Invalid quantity of tickets"
+    assert first_message('sell', dict(form, price='9')) == "Ticket price outside of valid range"
+    assert first_message('sell', dict(form, exp_date='20300230')) == "Invalid ticket date"
+    assert first_message('sell', dict(form, exp_date='20191210')) == "Invalid ticket date"
+
+
+@pytest.mark.usefixtures('server')
+def test_buy_and_update_accept_a_single_ticket():
+    assert first_message('buy', dict(name='concert', quantity='1')) is None
+    assert first_message('buy', dict(name='concert', quantity='101')) == "Invalid quantity of tickets"
+    assert first_message('buy', dict(name='con_cert', quantity='1')) == "Name contains invalid characters"
+    form = dict(name='concert', quantity='1', price='10', exp_date='20301210')
+    assert first_message('update', form) is None
+    assert first_message('update', dict(form, name='concert ')) == "Invalid spaces found in ticket name"
+    assert first_message('update', dict(form, price='101')) == "Invalid ticket price"
+
+
+@pytest.mark.usefixtures('server')
+def test_batch_reports_every_field():
+    results = validation.validate_batch('sell', [
+        dict(name='concert', quantity='5', price='15', exp_date='20301210'),
+        dict(name=' concert', quantity='500', price='15', exp_date='2030'),
+    ])
+    assert results[0][1] == []
+    values, errors = results[1]
+    assert [(error['field'], error['check']) for error in errors] == \
+        [('name', 'no_edge_spaces'), ('quantity', 'integer'), ('exp_date', 'date')]
+    # failed fields have no value, the valid ones are converted
+    assert values == dict(name=None, quantity=None, price=15.0, exp_date=None)
+
+
+@pytest.mark.usefixtures('server')
+def test_unknown_check_is_rejected():
+    with pytest.raises(ValueError):
+        validation.compile_rules([('name', 'no_such_check', None, "message")])
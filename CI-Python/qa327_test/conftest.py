@@ -5,7 +5,8 @@ import signal
 import time
 import tempfile
 from qa327.__main__ import FLASK_PORT
-from qa327.__main__ import app
+from qa327 import app
+from qa327.models import init_db
 import threading
 from werkzeug.serving import make_server
 
@@ -19,6 +20,7 @@ class ServerThread(threading.Thread):
         self.srv = make_server('127.0.0.1', FLASK_PORT, app)
         self.ctx = app.app_context()
         self.ctx.push()
+        init_db()
 
     def run(self):
         self.srv.serve_forever()
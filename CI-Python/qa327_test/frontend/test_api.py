@@ -0,0 +1,136 @@
+import decimal
+import json
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.models import db, Ticket
+
+"""
+This file tests the JSON API: tokens, the ticket routes with their
+pagination and sparse fieldsets, and the user route
+"""
+
+
+def call(client, method, path, token=None, body=None, headers=None):
+    headers = dict(headers or {})
+    if token is not None:
+        headers['Authorization'] = 'Bearer ' + token
+    response = client.open(path, method=method, headers=headers,
+                           data=json.dumps(body) if body is not None else None,
+                           content_type='application/json')
+    return response.status_code, json.loads(response.data) if response.data else None, response
+
+
+def get_token(client, email):
+    if not bn.get_user(email):
+        bn.register_user(email, 'api', 'Api_pw1', 'Api_pw1')
+    status, body, _ = call(client, 'POST', '/api/v1/tokens', body={'email': email, 'password': 'Api_pw1'})
+    assert status == 200
+    assert body['expires_in'] == app.config['API_TOKEN_TTL']
+    return body['token']
+
+
+@pytest.fixture
+def client():
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    return app.test_client()
+
+
+@pytest.mark.usefixtures('server')
+def test_tokens_are_required_and_checked(client):
+    status, body, response = call(client, 'GET', '/api/v1/tickets')
+    assert status == 401 and body == {'error': 'Missing token'}
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+    assert call(client, 'GET', '/api/v1/tickets', token='forged')[:2] == (401, {'error': 'Invalid token'})
+
+    assert call(client, 'POST', '/api/v1/tokens', body={'email': 'api@test.com', 'password': 'Wrong_pw1'})[:2] == \
+        (401, {'error': 'login failed'})
+    assert call(client, 'POST', '/api/v1/tokens', body={'email': 'api', 'password': 'Api_pw1'})[:2] == \
+        (400, {'error': 'Email format is incorrect', 'field': 'email'})
+    assert call(client, 'POST', '/api/v1/tokens', body=['api@test.com'])[0] == 400
+
+    token = get_token(client, 'api@test.com')
+    status, body, _ = call(client, 'GET', '/api/v1/users/me', token=token)
+    assert status == 200
+    assert body['email'] == 'api@test.com' and body['name'] == 'api'
+    assert body['balance'] == '5000' and body['holdings'] == []
+
+
+@pytest.mark.usefixtures('server')
+def test_tickets_are_paginated_with_sparse_fields(client):
+    token = get_token(client, 'api@test.com')
+    for number in range(5):
+        status, body, response = call(client, 'POST', '/api/v1/tickets', token=token,
+                                      body={'name': 'api%d' % number, 'quantity': 10, 'price': 20 + number,
+                                            'date': '20301210'})
+        assert status == 201
+        assert response.headers['Location'].endswith('/api/v1/tickets/api%d' % number)
+    assert call(client, 'POST', '/api/v1/tickets', token=token,
+                body={'name': 'api9', 'quantity': 500, 'price': 20, 'date': '20301210'})[:2] == \
+        (400, {'error': 'Invalid quantity of tickets', 'field': 'quantity'})
+    assert call(client, 'POST', '/api/v1/tickets', token=token,
+                body={'name': 'api9', 'quantity': 5, 'price': 20, 'date': '2030'})[:2] == \
+        (400, {'error': 'Invalid ticket date', 'field': 'date'})
+
+    status, body, response = call(client, 'GET', '/api/v1/tickets?limit=2&sort=price&fields=name,price', token=token)
+    assert status == 200
+    assert body['tickets'] == [{'name': 'api0', 'price': 20}, {'name': 'api1', 'price': 21}]
+    names = [ticket['name'] for ticket in body['tickets']]
+    while body['next_after']:
+        body = call(client, 'GET', '/api/v1/tickets?limit=2&sort=price&fields=name&after=%s' % body['next_after'],
+                    token=token)[1]
+        names += [ticket['name'] for ticket in body['tickets']]
+    assert names == ['api0', 'api1', 'api2', 'api3', 'api4']
+
+    # polling an unchanged list gets an empty response
+    etag = response.headers['ETag']
+    again = call(client, 'GET', '/api/v1/tickets?limit=2&sort=price&fields=name,price', token=token,
+                 headers={'If-None-Match': etag})
+    assert again[0] == 304
+
+    assert call(client, 'GET', '/api/v1/tickets?fields=name,password', token=token)[:2] == \
+        (400, {'error': 'Unknown field: password', 'field': 'fields'})
+    assert call(client, 'GET', '/api/v1/tickets?limit=1000', token=token)[0] == 400
+    assert call(client, 'GET', '/api/v1/tickets?sort=email', token=token)[0] == 400
+    assert call(client, 'GET', '/api/v1/tickets?sort=price&after=5', token=token)[:2] == \
+        (400, {'error': 'Invalid cursor', 'field': 'after'})
+
+    status, body, _ = call(client, 'GET', '/api/v1/tickets/api3', token=token)
+    assert status == 200
+    assert body == {'id': body['id'], 'name': 'api3', 'price': 23, 'quantity': 10, 'seller': 'api@test.com',
+                    'date': '20301210'}
+    assert call(client, 'GET', '/api/v1/tickets/api3?fields=quantity', token=token)[1] == {'quantity': 10}
+    assert call(client, 'GET', '/api/v1/tickets/missing', token=token)[:2] == \
+        (404, {'error': 'Ticket does not exist'})
+
+
+@pytest.mark.usefixtures('server')
+def test_tickets_are_updated_and_bought(client):
+    seller = get_token(client, 'api@test.com')
+    buyer = get_token(client, 'api_buyer@test.com')
+    call(client, 'POST', '/api/v1/tickets', token=seller,
+         body={'name': 'apiconcert', 'quantity': 10, 'price': 20, 'date': '20301210'})
+
+    # only the fields given change, and only the seller can change them
+    status, body, _ = call(client, 'PATCH', '/api/v1/tickets/apiconcert', token=seller, body={'price': 30})
+    assert status == 200
+    assert (body['price'], body['quantity'], body['date']) == (30, 10, '20301210')
+    assert call(client, 'PATCH', '/api/v1/tickets/apiconcert', token=buyer, body={'price': 10})[0] == 403
+
+    # the seller pays the fees on their own tickets
+    balance = bn.get_user('api@test.com').balance_cents + bn.price_cents(30) - bn.purchase_cost_cents(30, 1)
+    status, body, _ = call(client, 'POST', '/api/v1/tickets/apiconcert/purchases', token=seller, body={'quantity': 1})
+    assert status == 201
+    assert body['balance'] == str(decimal.Decimal(balance) / 100)
+    assert call(client, 'POST', '/api/v1/tickets/apiconcert/purchases', token=buyer, body={'quantity': 11})[:2] == \
+        (409, {'error': 'Requested quantity larger than available tickets'})
+    status, body, _ = call(client, 'POST', '/api/v1/tickets/apiconcert/purchases', token=buyer, body={'quantity': 2})
+    assert status == 201
+    assert body['name'] == 'apiconcert' and body['quantity'] == 2
+
+    me = call(client, 'GET', '/api/v1/users/me?fields=balance,holdings', token=buyer)[1]
+    assert sorted(me) == ['balance', 'holdings']
+    assert me['balance'] == body['balance']
+    assert me['holdings'][0] == {'name': 'apiconcert', 'quantity': 2, 'price': '30', 'date': '20301210'}
+    assert call(client, 'GET', '/api/v1/tickets/apiconcert?fields=quantity', token=buyer)[1] == {'quantity': 7}
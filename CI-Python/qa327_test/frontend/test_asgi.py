@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.asgi import create_asgi_app
+from qa327.models import db, Ticket
+
+"""
+This file tests the ASGI entry point: the pages served by coroutines
+match the Flask ones, and the other requests are handed to Flask
+"""
+
+
+def request(application, method, path, query=b'', headers=(), body=b''):
+    """Send one request to an ASGI application, return (status, headers, body)"""
+    async def call():
+        messages = []
+        pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            return pending.pop() if pending else {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+                 'path': path, 'query_string': query, 'root_path': '',
+                 'headers': [(name.encode(), value.encode()) for name, value in headers],
+                 'client': ('127.0.0.1', 50000), 'server': ('localhost', 8081)}
+        await application(scope, receive, send)
+        return messages
+    return unpack(asyncio.run(call()))
+
+
+def unpack(messages):
+    start = messages[0]
+    headers = dict((name.decode().lower(), value.decode()) for name, value in start['headers'])
+    return start['status'], headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+@pytest.fixture
+def client():
+    for email in ['asgi@test.com', 'asgi_seller@test.com']:
+        if not bn.get_user(email):
+            bn.register_user(email, 'asgi', 'Asgi_pw1', 'Asgi_pw1')
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    bn.get_state()['inventory_version'].bump()
+    for i in range(25):
+        bn.sell_ticket('asgi%02d' % (24 - i), 10, 10 + i, '20301210', 'asgi_seller@test.com')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = 'asgi@test.com'
+    return client
+
+
+def session_cookie(email):
+    value = app.session_interface.get_signing_serializer(app).dumps({'logged_in': email})
+    return ('Cookie', '%s=%s' % (app.session_cookie_name, value))
+
+
+@pytest.mark.usefixtures('server')
+def test_read_pages_match_flask(client):
+    application = create_asgi_app(app)
+    cookie = session_cookie('asgi@test.com')
+    after = bn.get_tickets_page(None, 5, 'price')[1]
+    for path, query in [('/', b''), ('/', b'sort=name'), ('/', ('sort=price&after=%s' % after).encode()),
+                        ('/', b'sort=price&after=5'),
+                        ('/search', b'q=asgi0'), ('/search', b'q=asgi&page=2')]:
+        status, headers, body = request(application, 'GET', path, query, [cookie])
+        expected = client.get(path + '?' + query.decode())
+        assert status == 200
+        assert body == expected.data
+        if path == '/':
+            assert headers['etag'] == expected.headers['ETag']
+            assert headers['last-modified'] == expected.headers['Last-Modified']
+
+    status, headers, _ = request(application, 'GET', '/', headers=[cookie])
+    assert request(application, 'GET', '/', headers=[cookie, ('If-None-Match', headers['etag'])])[0] == 304
+    # not logged in
+    assert request(application, 'GET', '/')[:2] == (302, {'location': '/login', 'content-length': '0'})
+    asyncio.run(application.shutdown())
+
+
+@pytest.mark.usefixtures('server')
+def test_writes_are_served_by_flask(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'STATS_ENABLED', True)
+    application = create_asgi_app(app)
+    cookie = session_cookie('asgi_seller@test.com')
+    form = b'name=asgi+sold&quantity=5&price=20&exp_date=20301210'
+    status, _, body = request(application, 'POST', '/sell', headers=[
+        cookie, ('Content-Type', 'application/x-www-form-urlencoded'), ('Content-Length', str(len(form)))],
+        body=form)
+    assert status == 200
+    assert bn.get_ticket('asgi sold') is not None
+    assert b'asgi sold' in request(application, 'GET', '/search', b'q=sold', [cookie])[2]
+    # pages the coroutines do not serve go to Flask as well
+    assert request(application, 'GET', '/login')[0] == 200
+    assert request(application, 'GET', '/logout', headers=[cookie])[0] == 302
+
+    # many listings in flight at once on one event loop
+    async def listings():
+        responses = [[] for _ in range(30)]
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        def call(messages):
+            async def send(message):
+                messages.append(message)
+            scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'',
+                     'headers': [(b'cookie', cookie[1].encode())]}
+            return application(scope, receive, send)
+        await asyncio.gather(*(call(messages) for messages in responses))
+        return [unpack(messages)[0] for messages in responses]
+    assert asyncio.run(listings()) == [200] * 30
+
+    status, _, body = request(application, 'GET', '/stats/asgi')
+    assert status == 200
+    assert b'"peak_in_flight"' in body and b'"driver"' in body
+    assert application.peak_in_flight > 1
+    assert application.served_wsgi == 3
+    asyncio.run(application.shutdown())
@@ -45,9 +45,9 @@ test_tickets = [
 
 class FrontEndBuyTest(BaseCase):
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
-    @patch('qa327.backend.register_ticket', return_value=test_ticket)
+    @patch('qa327.backend.buy_ticket', return_value=None)
     def test_buy_invalid_name_alnum(self, *_):
         """ R6.1A The name of the ticket has to be alphanumeric-only, and space
         allowed only if it is not the first or the last character."""
@@ -77,7 +77,7 @@ class FrontEndBuyTest(BaseCase):
         test cases below.
         """
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_buy_invalid_name_spaces(self, *_):
         """ R6.1B The name of the ticket can have spaces allowed only
@@ -102,7 +102,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid spaces found in word", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_buy_invalid_name_long(self, *_):
         """ R6.2 The name of the ticket is no longer than 60 characters."""
@@ -127,7 +127,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Ticket name is too long", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_buy_invalid_quantity_neg(self, *_):
         """ R6.3A The quantity of the tickets has to be more than 0."""
@@ -151,7 +151,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid quantity of tickets", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_buy_invalid_quantity_big(self, *_):
         """ R6.3B The quantity of the tickets has to be less than or equal to 100."""
@@ -175,7 +175,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid quantity of tickets", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=None)
     def test_buy_name_does_not_exist(self, *_):
         """ R6.4A The ticket name exists in the database."""
@@ -199,7 +199,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Ticket does not exist", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_buy_invalid_quantity_for_name(self, *_):
         """ R6.4B The ticket name exists in the database and the
@@ -224,7 +224,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Requested quantity larger than available tickets", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_poor_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_buy_balance_not_enough(self, *_):
         """ R6.5 The user has more balance than the ticket price * quantity
@@ -249,9 +249,9 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("User balance not enough for purchase", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
-    @patch('qa327.backend.register_ticket', return_value=None)
+    @patch('qa327.backend.buy_ticket', return_value=None)
     def test_buy_ticket_success(self, *_):
         """The user is successful in buying a ticket"""
         self.open(base_url + '/logout')
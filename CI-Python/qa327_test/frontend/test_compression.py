@@ -0,0 +1,105 @@
+import gzip
+import json
+import zlib
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+import qa327.backend as bn
+from qa327 import app
+from qa327.compression import CompressionMiddleware
+
+"""
+This file tests the compression of the responses: negotiation, the
+size threshold, streamed bodies and the statistics
+"""
+
+PAGE = b'<div><h4>ticket 10 20 seller@test.com 2030-12-10</h4></div>\n' * 100
+
+
+def page_app(environ, start_response):
+    # a page as Flask sends it, or another kind of response by path
+    path = environ['PATH_INFO']
+    headers = [('Content-Type', 'text/html; charset=utf-8'), ('ETag', '"page"')]
+    body = PAGE
+    if path == '/small':
+        body = b'<p>small</p>'
+    elif path == '/image':
+        headers[0] = ('Content-Type', 'image/png')
+    elif path == '/encoded':
+        headers.append(('Content-Encoding', 'gzip'))
+    elif path == '/stream':
+        start_response('200 OK', headers)
+        return (PAGE[i:i + 600] for i in range(0, len(PAGE), 600))
+    start_response('200 OK', headers + [('Content-Length', str(len(body)))])
+    return [body]
+
+
+@pytest.mark.usefixtures('server')
+def test_compresses_large_bodies_the_client_accepts():
+    middleware = CompressionMiddleware(page_app, min_size=1024)
+    client = Client(middleware, BaseResponse)
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == 'W/"page"'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(response.data) == PAGE
+
+    for path, accept in [('/', 'identity'), ('/', 'gzip;q=0'), ('/small', 'gzip'),
+                         ('/image', 'gzip'), ('/encoded', 'gzip')]:
+        response = client.get(path, headers={'Accept-Encoding': accept})
+        assert response.headers.get('Content-Encoding') in (None, 'gzip' if path == '/encoded' else None)
+        assert response.headers['ETag'] == '"page"'
+        # any response of a compressed type varies, compressed or not
+        assert response.headers.get('Vary') == (None if path == '/image' else 'Accept-Encoding')
+    # nor without an Accept-Encoding header
+    response = client.get('/')
+    assert response.data == PAGE
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+    stats = middleware.stats()
+    assert stats['encodings']['gzip']['responses'] == 1
+    assert stats['encodings']['gzip']['ratio'] < 0.2
+    assert stats['encodings']['gzip']['cpu_seconds'] >= 0
+    assert stats['skipped'] == {'not_accepted': 3, 'small': 1, 'type': 1, 'encoded': 1, 'status': 0}
+
+
+@pytest.mark.usefixtures('server')
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    middleware = CompressionMiddleware(page_app, min_size=1024)
+    response = Client(middleware, BaseResponse).get('/stream', headers={'Accept-Encoding': 'gzip'},
+                                                    buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    decompressor = zlib.decompressobj(31)
+    chunks = [chunk for chunk in response.response if chunk]
+    response.close()
+    # every chunk decompresses as it comes, the client does not wait for the end
+    parts = [decompressor.decompress(chunk) for chunk in chunks]
+    assert len(chunks) > 3
+    assert [len(part) for part in parts[:-1]] == [600] * (len(chunks) - 1)
+    assert b''.join(parts) == PAGE
+
+
+@pytest.mark.usefixtures('server')
+def test_pages_are_compressed_and_still_revalidated(monkeypatch):
+    if not bn.get_user('compress@test.com'):
+        bn.register_user('compress@test.com', 'compress', 'Compress_pw1', 'Compress_pw1')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = 'compress@test.com'
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert b'Hi compress' in gzip.decompress(response.data)
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    again = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert again.status_code == 304
+
+    # the statistics are off unless asked for
+    assert client.get('/stats/compression').status_code == 404
+    monkeypatch.setitem(app.config, 'STATS_ENABLED', True)
+    stats = json.loads(client.get('/stats/compression').data)
+    assert stats['encodings']['gzip']['responses'] >= 1
@@ -0,0 +1,53 @@
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.models import db, Ticket
+
+"""
+This file tests the ETag / Last-Modified support of the profile page
+"""
+
+
+@pytest.fixture
+def client():
+    for email in ['etag@test.com', 'etag_seller@test.com']:
+        if not bn.get_user(email):
+            bn.register_user(email, 'etag', 'Etag_pw1', 'Etag_pw1')
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = 'etag@test.com'
+    return client
+
+
+@pytest.mark.usefixtures('server')
+def test_unchanged_page_is_not_modified(client):
+    first = client.get('/')
+    assert first.status_code == 200
+    assert first.headers['ETag'] and first.headers['Last-Modified']
+    assert 'no-cache' in first.headers['Cache-Control']
+
+    again = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+
+    since = client.get('/', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert since.status_code == 304
+
+
+@pytest.mark.usefixtures('server')
+def test_page_changes_with_inventory_and_balance(client):
+    etag = client.get('/').headers['ETag']
+    bn.sell_ticket('etag', 10, 20, '20301210', 'etag_seller@test.com')
+    changed = client.get('/', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert b'etag' in changed.data
+
+    # another page of the listing has its own ETag
+    assert client.get('/?sort=price').headers['ETag'] != changed.headers['ETag']
+
+    etag = changed.headers['ETag']
+    assert bn.buy_ticket(bn.get_user('etag@test.com'), bn.get_ticket('etag'), 1) is None
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,67 @@
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.models import db, Ticket
+
+"""
+This file tests the versioned cache of the rendered ticket list
+"""
+
+
+@pytest.fixture
+def client():
+    if not bn.get_user('fragment@test.com'):
+        bn.register_user('fragment@test.com', 'fragment', 'Fragment_pw1', 'Fragment_pw1')
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    bn.get_state()['inventory_version'].bump()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = 'fragment@test.com'
+    return client
+
+
+@pytest.mark.usefixtures('server')
+def test_ticket_list_is_reused_until_inventory_changes(client):
+    bn.sell_ticket('fragment1', 10, 20, '20301210', 'fragment@test.com')
+    assert b'fragment1' in client.get('/').data
+
+    hits = bn.get_state()['fragment_cache'].hits
+    assert b'fragment1' in client.get('/').data
+    assert bn.get_state()['fragment_cache'].hits == hits + 1
+
+    # a new listing bumps the inventory version, so the list is rendered again
+    version = bn.get_inventory_version()
+    bn.sell_ticket('fragment2', 10, 20, '20301210', 'fragment@test.com')
+    assert bn.get_inventory_version() > version
+    assert b'fragment2' in client.get('/').data
+
+
+@pytest.mark.usefixtures('server')
+def test_update_and_purchase_bump_inventory_version(client):
+    bn.sell_ticket('fragment3', 10, 20, '20301210', 'fragment@test.com')
+    version = bn.get_inventory_version()
+    bn.update_ticket(bn.get_ticket('fragment3'), 5, 30, '20301211')
+    assert bn.get_inventory_version() > version
+
+    if not bn.get_user('fragment_buyer@test.com'):
+        bn.register_user('fragment_buyer@test.com', 'fragment', 'Fragment_pw1', 'Fragment_pw1')
+    # a seller can buy their own ticket: the page shows the balance after
+    # the purchase, net of the fees, and not the one before
+    balance = bn.get_user('fragment@test.com').balance_cents
+    page = client.post('/buy', data={'name': 'fragment3', 'quantity': '1'}).data
+    assert b'Ticket bought successfully' in page
+    balance += bn.price_cents(30) - bn.purchase_cost_cents(30, 1)
+    assert bn.get_user('fragment@test.com').balance_cents == balance
+    assert ('Your current balance is: %s' % bn.get_user('fragment@test.com').balance).encode() in page
+
+    version = bn.get_inventory_version()
+    assert bn.buy_ticket(bn.get_user('fragment_buyer@test.com'), bn.get_ticket('fragment3'), 1) is None
+    assert bn.get_inventory_version() > version
+    assert b'fragment3 30 3' in client.get('/').data
+
+
+@pytest.mark.usefixtures('server')
+def test_fragment_cache_is_sized_by_config():
+    assert bn.get_state()['fragment_cache'].maxsize == app.config['FRAGMENT_CACHE_SIZE']
+    assert bn.get_state()['fragment_cache'].ttl == app.config['FRAGMENT_CACHE_TTL']
@@ -0,0 +1,53 @@
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.ratelimit import TokenBucketLimiter
+
+"""
+This file tests the rate limiting of the login and register forms
+"""
+
+
+@pytest.mark.usefixtures('server')
+def test_token_bucket_refills_and_evicts(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('qa327.ratelimit.time.monotonic', lambda: now[0])
+    limiter = TokenBucketLimiter(rate=1, burst=2, evict_interval=10)
+    assert limiter.allow('a') and limiter.allow('a')
+    assert not limiter.allow('a')
+    assert limiter.allow('b')
+    assert limiter.retry_after('a') == 1
+    now[0] += 1
+    assert limiter.allow('a')
+    assert not limiter.allow('a')
+    # after the eviction interval, the full buckets are dropped
+    now[0] += 10
+    limiter.allow('c')
+    assert limiter.stats()['keys'] == 1
+    assert limiter.stats()['rejected'] == 2
+
+
+@pytest.mark.usefixtures('server')
+def test_rejected_logins_never_reach_the_backend(monkeypatch):
+    monkeypatch.setitem(bn.get_state(), 'ip_limiter', TokenBucketLimiter(rate=0.001, burst=5))
+    monkeypatch.setitem(bn.get_state(), 'email_limiter', TokenBucketLimiter(rate=0.001, burst=2))
+    calls = []
+    monkeypatch.setattr(bn, 'login_user', lambda email, password: calls.append(email))
+    client = app.test_client()
+
+    form = dict(email='limited@test.com', password='Wrong_pw1')
+    assert client.post('/login', data=form).status_code == 200
+    assert client.post('/login', data=form).status_code == 200
+    # the email is out of tokens
+    response = client.post('/login', data=form)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert b'Too many attempts' in response.data
+    assert calls == ['limited@test.com', 'limited@test.com']
+
+    # other emails from the same client, until the client is out of tokens
+    for i in range(2):
+        assert client.post('/login', data=dict(form, email='other%d@test.com' % i)).status_code == 200
+    assert client.post('/login', data=dict(form, email='another@test.com')).status_code == 429
+    assert client.post('/register', data=dict(form, email='another@test.com')).status_code != 429
+    assert len(calls) == 4
@@ -59,7 +59,7 @@ test_sell_form = Form(
 class FrontEndHomePageTest(BaseCase):
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_login_success(self, *_):
         """
         This is a sample front end unit test to login to home page
@@ -92,7 +92,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("t1 100 2 test123@email.com 02/23/2020", "#tickets div h4")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_login_password_failed(self, *_):
         """ Login and verify if the tickets are correctly listed."""
         # open login page
@@ -107,7 +107,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Password format is incorrect", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_has_logged_in(self, *_):  # R2.1 R2.2 [GET]
         """If the user has logged in, redirect back to the user profile page"""
         # Open the logout page to invalidate any logged-in session
@@ -127,7 +127,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Hi test_frontend", "#welcome-header")
 
     @patch('qa327.backend.register_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_hasnt_logged_in(self, *_):
         '''If the user hasn't logged in, show the user registration page'''
         # R2.2
@@ -141,7 +141,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Register", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_page(self, *_):  # R2.3 [GET]
         ''' The registration page shows a registration from requesting email, username,
         password, password2 '''
@@ -163,7 +163,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Register", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register(self, *_):  # R2.4 AND R2.5 [POST]
         '''The registration form can be submitted as a POST request to current URL'''
         '''Email, password, and password2 all have to satisfy the same required in R1'''
@@ -188,7 +188,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_element("#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_non_match(self, *_):  # R2.6 and R2.9 [POST]
         '''Password and Password 2 have to be exactly the same'''
         # log out any previous users
@@ -210,7 +210,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("The passwords do not match", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_empty(self, *_):  # R2.7A and R2.9 [POST]
         '''User name has to be non-empty'''
         # log out any previous users
@@ -233,7 +233,7 @@ class FrontEndHomePageTest(BaseCase):
         # assert message still says register
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_alnum(self, *_):  # R2.7B and R2.9 [POST]
         '''User name has to be alphanumeric only'''
         # log out any previous users
@@ -255,7 +255,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Name contains special characters", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_space(self, *_):  # R2.7C and R2.9 [POST]
         '''User name has spaces allowed only if it is not the first or the last character'''
         # log out any previous users
@@ -277,7 +277,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Invalid spaces found in word", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_name_short(self, *_):  # R2.8A and R2.9 [POST]
         '''User name has to be longer than 2 characters'''
         # log out any previous users
@@ -299,7 +299,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Name length formatting error", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_name_long(self, *_):  # R2.8B and R2.9 [POST]
         '''User name has to be less than 20 characters'''
         # log out any previous users
@@ -321,7 +321,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Name length formatting error", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_email_short(self, *_):  # R2.8B and R2.9 [POST]
         '''Email has to be longer than 1 character'''
         # log out any previous users
@@ -345,7 +345,7 @@ class FrontEndHomePageTest(BaseCase):
 
     @patch('qa327.backend.get_user', return_value=None)
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_format_email(self, *_):  # R2.8B and R2.9 [POST]
         '''For any formatting errors, redirect back to /login and show message '{}
         format is incorrect.'.format(the_corresponding_attribute)
@@ -370,7 +370,7 @@ class FrontEndHomePageTest(BaseCase):
 
     @patch('qa327.backend.get_user', return_value=None)
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_format_password(self, *_):  # R2.8B and R2.9 [POST]
         '''For any formatting errors, redirect back to /login and show message '{}
         format is incorrect.'.format(the_corresponding_attribute)
@@ -396,7 +396,7 @@ class FrontEndHomePageTest(BaseCase):
 
     @patch('qa327.backend.get_user', return_value=test_user)
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_register_email_already_used(self, *_):  # R2.8B and R2.9 [POST]
         '''If the email already exists, show message 'this email has been ALREADY used'''
         # log out any previous users
@@ -418,7 +418,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("This email has already been used", "#message")
 
     @patch('qa327.backend.register_user', return_value=test_user_register)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_user', return_value=None)
     def test_register_success(self, *_):  # R2.8B and R2.9 [POST]
         '''If no error regarding the inputs following the rules above, create
@@ -652,7 +652,7 @@ class FrontEndHomePageTest(BaseCase):
         self.assert_text("Please login", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_logged_in_redirect(self, *_):
         """If the user has logged in, redirect to the user profile page"""
         """R1.3"""
@@ -684,7 +684,7 @@ class FrontEndHomePageTest(BaseCase):
         self.type("#password", "Test_frontend@")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_login_as_post(self, *_):
         """The login form can be submitted as a POST request to the current url"""
         """R1.5"""
@@ -768,7 +768,7 @@ class FrontEndHomePageTest(BaseCase):
 
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_email_password_correct(self, *_):
         """If email / password are correct, redirect to /"""
         """R1.10"""
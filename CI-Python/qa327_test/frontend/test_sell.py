@@ -40,7 +40,7 @@ class FrontEndSellTest(BaseCase):
 
     @patch('qa327.backend.get_user', return_value=test_user)
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     def test_sell_ticket_name_alnum(self, *_):
         """The name of the ticket has to be alphanumeric-only, and space allowed only if its nit
         the first or last character
@@ -237,7 +237,7 @@ class FrontEndSellTest(BaseCase):
 
     @patch('qa327.backend.get_user', return_value=test_user)
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.sell_ticket', return_value=None)
     def test_sell_ticket_posted(self, *_):
         """  The added new ticket information will be posted on the user profile page
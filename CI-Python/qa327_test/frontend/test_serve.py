@@ -0,0 +1,156 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import requests
+import qa327
+from qa327.server import PoolWSGIServer, open_listener
+from qa327.__main__ import hash_workers_per_worker
+
+"""
+This file tests the production server of python -m qa327 serve: its
+workers, graceful reload and worker recycling
+"""
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='the production server needs fork')
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def worker_pids(master):
+    output = subprocess.run(['ps', '-o', 'pid=', '--ppid', str(master.pid)],
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return set(int(pid) for pid in output.split())
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    return condition()
+
+
+@pytest.fixture
+def serve(tmp_path):
+    port = free_port()
+    env = dict(os.environ, DB_NAME=str(tmp_path / 'db.sqlite').lstrip('/'), PASSWORD_HASH_WORKERS='0',
+               TMPDIR=str(tmp_path))
+    env.pop('SHARED_CACHE_PATH', None)
+    master = subprocess.Popen([sys.executable, '-m', 'qa327', 'serve', '--host', '127.0.0.1',
+                               '--port', str(port), '--workers', '2', '--threads', '2',
+                               '--max-requests', '5'],
+                              cwd=os.path.dirname(os.path.dirname(qa327.__file__)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:%d/login' % port
+
+    def is_up():
+        try:
+            return requests.get(url, timeout=1).status_code == 200
+        except requests.ConnectionError:
+            return False
+    assert wait_for(is_up)
+    yield master, url
+    if master.poll() is None:
+        master.kill()
+        master.wait()
+
+
+@pytest.mark.usefixtures('server')
+def test_workers_reload_recycle_and_stop(serve, tmp_path):
+    master, url = serve
+    workers = wait_for(lambda: len(worker_pids(master)) == 2 and worker_pids(master))
+    assert workers
+    # the workers share their caches through a temporary file
+    cache_files = list(tmp_path.glob('qa327-*.cache'))
+    assert len(cache_files) == 1
+
+    # keep-alive: several requests over one connection
+    with requests.Session() as session:
+        assert all(session.get(url).status_code == 200 for _ in range(3))
+
+    # each worker is replaced after 5 requests
+    for _ in range(20):
+        assert requests.get(url).status_code == 200
+    assert wait_for(lambda: len(worker_pids(master)) == 2 and not worker_pids(master) & workers)
+
+    # a reload starts new workers on the same socket, the master keeps its pid
+    workers = worker_pids(master)
+    master.send_signal(signal.SIGHUP)
+    assert wait_for(lambda: len(worker_pids(master)) == 2 and not worker_pids(master) & workers)
+    assert requests.get(url).status_code == 200
+    # the new master keeps using the same file
+    assert list(tmp_path.glob('qa327-*.cache')) == cache_files
+
+    master.send_signal(signal.SIGTERM)
+    assert master.wait(timeout=30) == 0
+    assert not cache_files[0].exists()
+
+
+def raw_get(port):
+    connection = socket.create_connection(('127.0.0.1', port), timeout=10)
+    connection.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    return connection
+
+
+def read_until_closed(connection):
+    data = b''
+    while True:
+        chunk = connection.recv(4096)
+        if not chunk:
+            return data
+        data += chunk
+
+
+@pytest.mark.usefixtures('server')
+def test_connections_wait_for_a_free_thread():
+    release = threading.Event()
+
+    def app(environ, start_response):
+        release.wait(10)
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+        return [b'ok']
+
+    listener = open_listener('127.0.0.1', 0, 16)
+    port = listener.getsockname()[1]
+    server = PoolWSGIServer(listener, app, threads=1, keepalive=5)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        first = raw_get(port)
+        assert wait_for(lambda: server.saturated())
+        # the only thread is busy: the second connection is left in the backlog
+        second = raw_get(port)
+        time.sleep(0.5)
+        assert server._connections == 1
+        release.set()
+        # and the first one is closed after its response rather than held
+        # open while the second waits
+        response = read_until_closed(first)
+        assert b'Connection: close' in response and response.endswith(b'ok')
+        assert read_until_closed(second).endswith(b'ok')
+        first.close()
+        second.close()
+    finally:
+        server.shutdown()
+        thread.join()
+        server.executor.shutdown(wait=True)
+        listener.close()
+
+
+def test_hashing_processes_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    assert hash_workers_per_worker(1) == 8
+    assert hash_workers_per_worker(4) == 2
+    # at least one each, however many workers
+    assert hash_workers_per_worker(16) == 1
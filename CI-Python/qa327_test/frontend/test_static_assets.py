@@ -0,0 +1,122 @@
+import gzip
+import os
+import posixpath
+import pytest
+import re
+import qa327.backend as bn
+from qa327 import app
+from qa327.assets import Assets, STATIC_DIR, build, is_stale
+
+"""
+This file tests the build of the fingerprinted, compressed static
+assets and how they are linked and served
+"""
+
+SCRIPT = b'$(document).ready(function () { blackKit.initDatePicker(); });\n' * 20
+STYLESHEET = (b"@font-face { src: url('../fonts/nucleo.woff2?#iefix') format('woff2'),"
+              b" url(data:font/woff;base64,AAAA); }\n.logo { background: url(../img/missing.png); }\n")
+
+
+@pytest.fixture
+def folders(tmp_path):
+    static_dir, build_dir = str(tmp_path / 'static'), str(tmp_path / 'static' / 'build')
+    for name, data in [('vendor/js/jquery.min.js', SCRIPT), ('vendor/css/demo.css', STYLESHEET),
+                       ('vendor/fonts/nucleo.woff2', os.urandom(2000))]:
+        path = os.path.join(static_dir, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as source:
+            source.write(data)
+    return static_dir, build_dir
+
+
+@pytest.mark.usefixtures('server')
+def test_build_fingerprints_and_compresses(folders):
+    static_dir, build_dir = folders
+    manifest = build(static_dir, build_dir)
+    built = manifest['assets']
+    assert sorted(built) == ['vendor/css/demo.css', 'vendor/fonts/nucleo.woff2', 'vendor/js/jquery.min.js']
+    assert built['vendor/js/jquery.min.js'].startswith('vendor/js/jquery.min.') and built['vendor/js/jquery.min.js'] != 'vendor/js/jquery.min.js'
+    # the stylesheet links the built font, other references are left alone
+    with open(os.path.join(build_dir, built['vendor/css/demo.css']), 'rb') as stylesheet:
+        css = stylesheet.read()
+    font = os.path.basename(built['vendor/fonts/nucleo.woff2']).encode()
+    assert b"url(../fonts/" + font + b"?#iefix)" in css
+    assert b'url(data:font/woff;base64,AAAA)' in css and b'url(../img/missing.png)' in css
+
+    assert 'gzip' in manifest['encodings'][built['vendor/js/jquery.min.js']]
+    assert manifest['encodings'][built['vendor/fonts/nucleo.woff2']] == []
+    with open(os.path.join(build_dir, built['vendor/js/jquery.min.js'] + '.gz'), 'rb') as compressed:
+        assert gzip.decompress(compressed.read()) == SCRIPT
+
+    # the same sources give the same build
+    assert build(static_dir, build_dir) == manifest
+    assert not is_stale(static_dir, build_dir)
+    source = os.path.join(static_dir, 'vendor', 'js', 'jquery.min.js')
+    os.utime(source, (os.path.getmtime(source) + 10,) * 2)
+    assert is_stale(static_dir, build_dir)
+
+
+@pytest.mark.usefixtures('server')
+def test_assets_are_linked_and_served(folders, monkeypatch):
+    static_dir, build_dir = folders
+    build(static_dir, build_dir)
+    assets = Assets(static_dir, build_dir)
+    monkeypatch.setitem(bn.get_state(), 'assets', assets)
+    client = app.test_client()
+
+    url = assets.url('vendor/js/jquery.min.js')
+    assert url.encode() in client.get('/login').data
+    # not built yet: linked by its source
+    assert assets.url('vendor/js/other.js') == '/static/vendor/js/other.js'
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'javascript' in response.headers['Content-Type']
+    assert 'immutable' in response.headers['Cache-Control'] and 'max-age=31536000' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == SCRIPT
+
+    plain = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == SCRIPT
+    assert client.get('/static/vendor/js/missing.js').status_code == 404
+    assert client.get('/static/../../__init__.py').status_code == 404
+
+
+@pytest.mark.usefixtures('server')
+def test_pages_need_no_third_party_host(tmp_path, monkeypatch):
+    # the assets bundled with the package
+    build_dir = str(tmp_path / 'build')
+    manifest = build(STATIC_DIR, build_dir)
+    assert 'vendor/css/black-dashboard.min.css' in manifest['assets']
+    assert not any(name.endswith(('.md', '.txt')) for name in manifest['assets'])
+    monkeypatch.setitem(bn.get_state(), 'assets', Assets(STATIC_DIR, build_dir))
+    client = app.test_client()
+
+    page = client.get('/login').data.decode()
+    links = re.findall(r'(?:href|src)="([^"]+)"', page)
+    assets = [link for link in links if '/vendor/' in link]
+    assert len(assets) >= 8
+    for link in links:
+        assert '://' not in link
+    for link in assets:
+        assert link.startswith('/static/vendor/')
+        assert client.get(link).status_code == 200
+
+    # the fonts of the stylesheets are served too
+    stylesheet = client.get(bn.get_state()['assets'].url('vendor/css/nucleo-icons.css')).data.decode()
+    font = re.search(r"url\(\.\./fonts/(nucleo\.[0-9a-f]{12}\.woff2)\)", stylesheet).group(1)
+    assert client.get('/static/vendor/fonts/' + font).status_code == 200
+
+    # and so is every file the bundled stylesheets refer to
+    for name in manifest['assets']:
+        if not (name.startswith('vendor/') and name.endswith('.css')):
+            continue
+        url = bn.get_state()['assets'].url(name)
+        stylesheet = client.get(url).data.decode()
+        for reference in re.findall(r"url\(\s*['\"]?([^'\")]+)", stylesheet):
+            if reference.startswith('data:'):
+                continue
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(url), re.split(r'[?#]', reference)[0]))
+            assert client.get(path).status_code == 200, (name, reference)
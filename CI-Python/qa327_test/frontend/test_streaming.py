@@ -0,0 +1,73 @@
+import pytest
+import qa327.backend as bn
+from qa327 import app
+from qa327.models import db, Ticket
+
+"""
+This file tests the streamed listing of all the tickets
+"""
+
+
+@pytest.fixture
+def client():
+    if not bn.get_user('stream@test.com'):
+        bn.register_user('stream@test.com', 'stream', 'Stream_pw1', 'Stream_pw1')
+    db.session.query(Ticket).delete()
+    db.session.commit()
+    for number in range(150):
+        bn.sell_ticket('stream%03d' % number, 10, 20 + number % 7, '20301210', 'stream@test.com')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = 'stream@test.com'
+    return client
+
+
+@pytest.mark.usefixtures('server')
+def test_all_tickets_are_streamed_in_chunks(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'LISTING_STREAM_BATCH', 25)
+    response = client.get('/?view=all', buffered=False)
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'Content-Length' not in response.headers
+    chunks = list(response.response)
+    response.close()
+    # the top of the page comes first, before most of the rows are rendered
+    assert len(chunks) > 2
+    assert b'Hi stream' in chunks[0] and b'stream149' not in chunks[0]
+    assert all(len(chunk) >= app.config['STREAM_CHUNK_SIZE'] for chunk in chunks[:-1])
+
+    page = b''.join(chunks)
+    for number in range(150):
+        assert b'stream%03d' % number in page
+    assert b'next-page-link' not in page and b'all-tickets-link' not in page
+    assert b'/?sort=price&amp;view=all' in page or b'/?sort=price&view=all' in page
+    # the paginated listing links the streamed one
+    assert b'all-tickets-link' in client.get('/').data
+
+
+@pytest.mark.usefixtures('server')
+def test_streamed_rows_are_sorted_and_not_kept(client):
+    identity_map = len(db.session.identity_map)
+    rows = list(bn.iter_tickets('price', batch_size=10))
+    assert len(rows) == 150
+    assert [(row.price, row.id) for row in rows] == sorted((row.price, row.id) for row in rows)
+    # plain rows: the session does not hold on to the tickets read
+    assert len(db.session.identity_map) == identity_map
+    with pytest.raises(ValueError):
+        bn.iter_tickets('email')
+
+    page = client.get('/?view=all&sort=price').data
+    assert page.index(b'stream007') < page.index(b'stream001')
+
+
+@pytest.mark.usefixtures('server')
+def test_streamed_listing_is_revalidated(client):
+    response = client.get('/?view=all', buffered=True)
+    etag = response.headers['ETag']
+    assert etag != client.get('/').headers['ETag']
+    assert client.get('/?view=all', headers={'If-None-Match': etag}).status_code == 304
+
+    bn.sell_ticket('stream150', 10, 20, '20301210', 'stream@test.com')
+    response = client.get('/?view=all', headers={'If-None-Match': etag}, buffered=True)
+    assert response.status_code == 200
+    assert b'stream150' in response.data
@@ -45,7 +45,7 @@ test_tickets = [
 
 class FrontEndBuyTest(BaseCase):
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_name_alnum(self, *_):
         """ R5.1A The name of the ticket has to be alphanumeric-only, and space
@@ -80,7 +80,7 @@ class FrontEndBuyTest(BaseCase):
         test cases below.
         """
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_name_spaces(self, *_):
         """ R5.1B The name of the ticket can have spaces allowed only
@@ -109,7 +109,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid spaces found in ticket name", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_name_long(self, *_):
         """ R5.2 The name of the ticket is no longer than 60 characters."""
@@ -138,7 +138,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Ticket name is too long", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_quantity_neg(self, *_):
         """ R5.3A The quantity of the tickets has to be more than 0."""
@@ -166,7 +166,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid quantity of tickets", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_quantity_big(self, *_):
         """ R5.3B The quantity of the tickets has to be less than or equal to 100."""
@@ -194,7 +194,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid quantity of tickets", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_price_lower(self, *_):
         """ R5.4A The ticket price has to be in more than or equal to 0."""
@@ -222,7 +222,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid ticket price", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_price_upper(self, *_):
         """ R5.4B The ticket price has to be less than or equal to 100."""
@@ -250,7 +250,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid ticket price", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_invalid_date(self, *_):
         """ R5.5 The date must be in the format YYYYMMDD."""
@@ -278,7 +278,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Invalid ticket date", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=None)
     def test_update_name_does_not_exist(self, *_):
         """ R5.6 The ticket name must exist."""
@@ -306,7 +306,7 @@ class FrontEndBuyTest(BaseCase):
         self.assert_text("Ticket does not exist", "#message")
 
     @patch('qa327.backend.get_user', return_value=test_user)
-    @patch('qa327.backend.get_all_tickets', return_value=test_tickets)
+    @patch('qa327.backend.get_tickets_page', return_value=(test_tickets, None))
     @patch('qa327.backend.get_ticket', return_value=test_ticket)
     def test_update_ticket_success(self, *_):
         """The user is successful in updating a ticket"""